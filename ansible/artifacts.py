@@ -0,0 +1 @@
+../terraform/artifacts.py
\ No newline at end of file
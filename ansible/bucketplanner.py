@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+'''Couchbase bucket RAM planning from expected working sets.
+
+Follows the Couchbase sizing guidelines: every copy of a document (active plus
+replicas) keeps its key and metadata in RAM, the resident share of the values is
+cached on top of that, and the total must stay below the high water mark with
+some headroom for the OS page cache and compaction.
+'''
+
+
+import math
+from collections import namedtuple
+
+
+METADATA_BYTES_PER_DOCUMENT = 56
+MEMCACHED_ITEM_OVERHEAD_BYTES = 50
+HIGH_WATER_MARK = 0.85
+HEADROOM = 0.25
+MIN_BUCKET_QUOTA_MB = 100
+
+# share of node RAM Couchbase should be given; the rest is left to the OS and
+# the other services
+MAX_NODE_RAM_SHARE = 0.8
+
+MB = 1024 * 1024
+
+
+BucketWorkload = namedtuple('BucketWorkload',
+                            'name type num_documents avg_doc_bytes avg_key_bytes num_replicas resident_ratio')
+
+BucketPlan = namedtuple('BucketPlan', 'workload required_quota_mb quota_mb effective_resident_ratio warnings')
+
+
+class BucketPlanningError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def required_bucket_bytes(workload):
+    '''Returns the cluster-wide RAM the bucket needs to hold its metadata and the
+    resident share of its values, including headroom and the high water mark.
+    '''
+
+    if workload.type == 'memcached':
+        data = workload.num_documents * (workload.avg_key_bytes + workload.avg_doc_bytes + MEMCACHED_ITEM_OVERHEAD_BYTES)
+        return data / HIGH_WATER_MARK
+
+    copies = 1 + workload.num_replicas
+    metadata = workload.num_documents * (METADATA_BYTES_PER_DOCUMENT + workload.avg_key_bytes) * copies
+    working_set = workload.num_documents * workload.avg_doc_bytes * copies * workload.resident_ratio
+    return (metadata + working_set) * (1 + HEADROOM) / HIGH_WATER_MARK
+
+
+def resident_ratio_for_quota(workload, quota_mb, num_nodes):
+    '''Inverts required_bucket_bytes: the share of values that fit in RAM under a given per-node quota.'''
+
+    if workload.type == 'memcached' or not workload.num_documents or not workload.avg_doc_bytes:
+        return 1.0
+
+    copies = 1 + workload.num_replicas
+    available = quota_mb * MB * num_nodes * HIGH_WATER_MARK / (1 + HEADROOM)
+    metadata = workload.num_documents * (METADATA_BYTES_PER_DOCUMENT + workload.avg_key_bytes) * copies
+    values = workload.num_documents * workload.avg_doc_bytes * copies
+    return max(0.0, min(1.0, (available - metadata) / values))
+
+
+def plan_buckets(workloads, num_nodes, cluster_ram_quota_mb):
+    '''Computes a per-node RAM quota for every bucket. If the buckets do not fit in
+    <cluster_ram_quota_mb>, every quota is scaled down proportionally and the
+    resulting resident ratio is reported against the target.
+    '''
+
+    if num_nodes < 1:
+        raise BucketPlanningError('a Couchbase cluster needs at least one node.')
+
+    required = [max(MIN_BUCKET_QUOTA_MB, int(math.ceil(required_bucket_bytes(w) / num_nodes / MB)))
+                for w in workloads]
+    if MIN_BUCKET_QUOTA_MB * len(workloads) > cluster_ram_quota_mb:
+        raise BucketPlanningError('the minimum bucket quotas (%d MB each) exceed the cluster RAM quota of %d MB.'
+                                  % (MIN_BUCKET_QUOTA_MB, cluster_ram_quota_mb))
+
+    # every bucket keeps its minimum quota; RAM above that is shared out in
+    # proportion to what each bucket asked for
+    scale = 1.0
+    if sum(required) > cluster_ram_quota_mb:
+        extra_required = sum(required) - MIN_BUCKET_QUOTA_MB * len(workloads)
+        scale = (cluster_ram_quota_mb - MIN_BUCKET_QUOTA_MB * len(workloads)) / extra_required
+
+    plans = []
+    for workload, required_mb in zip(workloads, required):
+        quota_mb = MIN_BUCKET_QUOTA_MB + int((required_mb - MIN_BUCKET_QUOTA_MB) * scale)
+        resident = resident_ratio_for_quota(workload, quota_mb, num_nodes)
+        warnings = []
+        if workload.type == 'memcached' and quota_mb < required_mb:
+            warnings.append('memcached bucket cannot hold its data set; items will be evicted outright')
+        elif resident < workload.resident_ratio - 0.005:
+            warnings.append('only %.0f%% of values fit in RAM (target %.0f%%); reads beyond that will be disk fetches'
+                            % (resident * 100, workload.resident_ratio * 100))
+        elif workload.type == 'couchbase' and resident < 1.0:
+            warnings.append('%.0f%% of values resident by design; cold reads will be disk fetches' % (resident * 100))
+        plans.append(BucketPlan(workload, required_mb, quota_mb, resident, warnings))
+
+    return plans
+
+
+def max_cluster_ram_quota_mb(node_memory_mb):
+    return int(node_memory_mb * MAX_NODE_RAM_SHARE)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+'''Elasticsearch heap and shard planning from instance memory and expected index size.
+
+Follows the Elasticsearch sizing guidelines: the heap gets half of the node's
+memory, the other half being left to the filesystem cache Lucene relies on, and
+stays below the compressed object pointer limit. Primary shards are sized to stay
+within a few tens of GB each and are spread evenly over the data nodes.
+'''
+
+
+import math
+from collections import namedtuple
+
+
+HEAP_SHARE_OF_MEMORY = 0.5
+
+# above ~32 GB the JVM can no longer use compressed object pointers
+MAX_HEAP_MB = 31 * 1024
+MIN_HEAP_MB = 256
+
+TARGET_SHARD_GB = 30
+MAX_SHARD_GB = 50
+
+DEFAULT_REFRESH_INTERVAL = '30s'
+BULK_TRANSLOG_SYNC_INTERVAL = '30s'
+
+
+IndexPlan = namedtuple('IndexPlan', 'name index_gb num_shards num_replicas shard_gb refresh_interval warnings')
+
+
+class IndexPlanningError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def heap_size_mb(memory_mb):
+    heap_mb = int(memory_mb * HEAP_SHARE_OF_MEMORY)
+    return max(MIN_HEAP_MB, min(MAX_HEAP_MB, heap_mb))
+
+
+def primary_shard_count(index_gb, num_nodes):
+    '''Enough primaries to keep each under TARGET_SHARD_GB, rounded up to a multiple
+    of the node count so that every node takes the same share of the indexing load.
+    '''
+
+    if num_nodes < 1:
+        raise IndexPlanningError('an Elasticsearch cluster needs at least one node.')
+    shards = max(1, int(math.ceil(index_gb / TARGET_SHARD_GB)))
+    return int(math.ceil(shards / num_nodes)) * num_nodes
+
+
+def plan_index(name, index_gb, num_nodes, num_replicas=1, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+    warnings = []
+    if num_replicas > num_nodes - 1:
+        warnings.append('%d replica(s) cannot be allocated on %d node(s); using %d'
+                        % (num_replicas, num_nodes, num_nodes - 1))
+        num_replicas = num_nodes - 1
+
+    num_shards = primary_shard_count(index_gb, num_nodes)
+    shard_gb = index_gb / num_shards
+    if shard_gb > MAX_SHARD_GB:
+        warnings.append('shards of %.0f GB will be slow to recover and relocate' % shard_gb)
+    return IndexPlan(name, index_gb, num_shards, num_replicas, shard_gb, refresh_interval, warnings)
+
+
+def index_template(plan):
+    return {
+        'index_patterns': ['%s*' % plan.name],
+        'settings': {
+            'number_of_shards': plan.num_shards,
+            'number_of_replicas': plan.num_replicas,
+            'refresh_interval': plan.refresh_interval
+        }
+    }
+
+
+def bulk_load_settings():
+    '''Index settings for a bulk load: no refreshes, no replicas to copy every write
+    to, and translog fsyncs batched instead of per request.
+    '''
+
+    return {
+        'index': {
+            'refresh_interval': '-1',
+            'number_of_replicas': 0,
+            'translog.durability': 'async',
+            'translog.sync_interval': BULK_TRANSLOG_SYNC_INTERVAL
+        }
+    }
+
+
+def restore_settings(plan):
+    return {
+        'index': {
+            'refresh_interval': plan.refresh_interval,
+            'number_of_replicas': plan.num_replicas,
+            'translog.durability': 'request'
+        }
+    }
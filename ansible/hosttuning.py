@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    hosttuning.py <datastore> [--roles-dir=<dir>]
+    hosttuning.py --list
+
+Options:
+    --roles-dir=<dir>   directory to write the role into [default: roles]
+
+Generates the <datastore>-host-tuning Ansible role, which prepares a datastore
+host before the service is installed and started: transparent huge pages,
+swappiness and other sysctls, and file/process limits for the service user.
+Every setting is applied persistently and then read back, so the play fails on
+a host that did not take it.
+'''
+
+
+import os
+from collections import namedtuple
+import artifacts
+import templating
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+
+
+TuningProfile = namedtuple('TuningProfile', 'datastore service_user service_name thp_mode sysctls nofile nproc memlock')
+
+
+PROFILES = {p.datastore: p for p in [
+    # Couchbase requires THP off and swapping kept to a last resort
+    TuningProfile(datastore='couchbase',
+                  service_user='couchbase',
+                  service_name='couchbase-server',
+                  thp_mode='never',
+                  sysctls=[('vm.swappiness', 1)],
+                  nofile=70000,
+                  nproc=10000,
+                  memlock=None),
+    # the JVM only uses huge pages on request, so madvise is enough; mmapfs
+    # needs a large map count and a locked heap must not be swapped
+    TuningProfile(datastore='elasticsearch',
+                  service_user='elasticsearch',
+                  service_name='elasticsearch',
+                  thp_mode='madvise',
+                  sysctls=[('vm.swappiness', 1), ('vm.max_map_count', 262144)],
+                  nofile=65536,
+                  nproc=4096,
+                  memlock='unlimited'),
+    # Redis forks for background saves and replica syncs: THP makes every
+    # copy-on-write fault copy 2 MB, and the fork must not fail for lack of
+    # overcommit
+    TuningProfile(datastore='redis',
+                  service_user='redis',
+                  service_name='redis',
+                  thp_mode='never',
+                  sysctls=[('vm.swappiness', 1), ('vm.overcommit_memory', 1), ('net.core.somaxconn', 1024)],
+                  nofile=65536,
+                  nproc=4096,
+                  memlock=None)
+]}
+
+
+HOST_TUNING_DEFAULTS_TEMPLATE = '''---
+# {{ profile.datastore }} host tuning (generated by hosttuning.py)
+
+tuning_datastore: {{ profile.datastore }}
+tuning_service_user: {{ profile.service_user }}
+tuning_service_name: {{ profile.service_name }}
+tuning_thp_mode: {{ profile.thp_mode }}
+tuning_sysctl_file: /etc/sysctl.d/60-{{ profile.datastore }}.conf
+tuning_sysctls:{% for name, value in profile.sysctls %}
+  - name: {{ name }}
+    value: {{ value }}{% endfor %}
+tuning_limits:
+  - item: nofile
+    value: {{ profile.nofile }}
+  - item: nproc
+    value: {{ profile.nproc }}{% if profile.memlock %}
+  - item: memlock
+    value: {{ profile.memlock }}{% endif %}
+'''
+
+HOST_TUNING_TASKS = '''---
+# Applies and verifies the datastore host settings; run before the service starts.
+
+- name: install the boot-time transparent huge pages setting
+  template: src=tune-thp.j2 dest=/etc/init.d/tune-thp mode=755
+
+- name: apply the transparent huge pages setting at boot, before {{ tuning_service_name }}
+  command: update-rc.d tune-thp defaults 10
+  args:
+    creates: /etc/rc2.d/S10tune-thp
+
+- name: apply the transparent huge pages setting now
+  command: /etc/init.d/tune-thp start
+  changed_when: false
+
+- name: set kernel parameters
+  sysctl: name={{ item.name }} value={{ item.value }} sysctl_file={{ tuning_sysctl_file }} reload=yes
+  with_items: "{{ tuning_sysctls }}"
+
+- name: set limits for the {{ tuning_service_user }} user
+  pam_limits: domain={{ tuning_service_user }} limit_type=- limit_item={{ item.item }} value={{ item.value }}
+  with_items: "{{ tuning_limits }}"
+
+- name: read back the transparent huge pages setting
+  command: cat /sys/kernel/mm/transparent_hugepage/enabled /sys/kernel/mm/transparent_hugepage/defrag
+  register: thp_state
+  changed_when: false
+
+- name: verify transparent huge pages
+  assert:
+    that: "'[' ~ tuning_thp_mode ~ ']' in item"
+    msg: "transparent huge pages are not set to {{ tuning_thp_mode }}: {{ item }}"
+  with_items: "{{ thp_state.stdout_lines }}"
+
+- name: read back kernel parameters
+  command: sysctl -n {{ item.name }}
+  with_items: "{{ tuning_sysctls }}"
+  register: sysctl_state
+  changed_when: false
+
+- name: verify kernel parameters
+  assert:
+    that: "item.stdout | int == item.item.value | int"
+    msg: "{{ item.item.name }} is {{ item.stdout }}, expected {{ item.item.value }}"
+  with_items: "{{ sysctl_state.results }}"
+
+- name: read back limits for the {{ tuning_service_user }} user
+  command: grep -E "^{{ tuning_service_user }}[[:space:]]+-[[:space:]]+{{ item.item }}[[:space:]]+{{ item.value }}$" /etc/security/limits.conf
+  with_items: "{{ tuning_limits }}"
+  changed_when: false
+'''
+
+TUNE_THP_INIT_SCRIPT = '''#!/bin/sh
+### BEGIN INIT INFO
+# Provides:          tune-thp
+# Required-Start:    $local_fs
+# Required-Stop:
+# X-Start-Before:    {{ tuning_service_name }}
+# Default-Start:     2 3 4 5
+# Default-Stop:
+# Short-Description: Set transparent huge pages to {{ tuning_thp_mode }} for {{ tuning_datastore }}
+### END INIT INFO
+
+case $1 in
+    start)
+        for setting in enabled defrag; do
+            if [ -f /sys/kernel/mm/transparent_hugepage/$setting ]; then
+                echo {{ tuning_thp_mode }} > /sys/kernel/mm/transparent_hugepage/$setting
+            fi
+        done
+        ;;
+esac
+'''
+
+templating.register('host_tuning_defaults', HOST_TUNING_DEFAULTS_TEMPLATE)
+
+
+class UnknownDatastore(Exception):
+    def __init__(self, datastore):
+        Exception.__init__(self, 'no host tuning profile for datastore "%s" (known: %s).'
+                           % (datastore, ', '.join(sorted(PROFILES))))
+
+
+def role_name(datastore):
+    return '%s-host-tuning' % datastore
+
+
+def role_files(profile):
+    '''Returns {path relative to the role directory: content}. Only the defaults are
+    rendered here; the tasks and init script are Ansible templates.
+    '''
+
+    return {
+        os.path.join('defaults', 'main.yml'): templating.render('host_tuning_defaults', profile=profile),
+        os.path.join('tasks', 'main.yml'): HOST_TUNING_TASKS,
+        os.path.join('templates', 'tune-thp.j2'): TUNE_THP_INIT_SCRIPT
+    }
+
+
+def write_role(datastore, roles_dir='roles'):
+    '''Writes the tuning role for <datastore> under <roles_dir>. Returns the role directory
+    and the files that changed.
+    '''
+
+    if datastore not in PROFILES:
+        raise UnknownDatastore(datastore)
+
+    role_dir = os.path.join(roles_dir, role_name(datastore))
+    changed = []
+    for relative_path, data in sorted(role_files(PROFILES[datastore]).items()):
+        filename = os.path.join(role_dir, relative_path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if artifacts.write_artifact(filename, data):
+            changed.append(filename)
+    return role_dir, changed
+
+
+def main(args):
+    if args['--list']:
+        for profile in sorted(PROFILES.values()):
+            print('  %-14s THP %-8s %s, nofile %d' % (profile.datastore, profile.thp_mode,
+                                                    ', '.join('%s=%s' % s for s in profile.sysctls), profile.nofile))
+        return
+
+    try:
+        role_dir, changed = write_role(args['<datastore>'], args['--roles-dir'])
+    except UnknownDatastore as err:
+        print('### %s' % err)
+        raise SystemExit(1)
+    print('generated role %s (%d file(s) changed).' % (role_dir, len(changed)))
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
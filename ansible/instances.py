@@ -0,0 +1 @@
+../terraform/instances.py
\ No newline at end of file
@@ -0,0 +1 @@
+../terraform/lazyimport.py
\ No newline at end of file
@@ -2,7 +2,12 @@
 
 
 '''
-        Usage:    mkcluster <project_name>
+        Usage:    mkcluster <project_name> [--tf-state=<json_file>]
+
+        Options:
+            --tf-state=<json_file>  Terraform state, or "terraform output -json", listing the
+                                    Couchbase instances (defaults to the terraform.tfstate
+                                    next to the generated .tf files)
 '''
 
 import os
@@ -10,17 +15,53 @@ import json
 import re
 from collections import namedtuple
 from contextlib import ContextDecorator
-from snap import common
-from snap import cli_tools as cli
 from cmd import Cmd
-import jinja2
-import docopt
-from docopt import docopt as docopt_func
-from docopt import DocoptExit
 import templates
+import templating
+import artifacts
+import bucketplanner
+import instances
+import tfparse
+import tfstate
+import tfinventory
+import hosttuning
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+common = lazy_import('snap.common')
+cli = lazy_import('snap.cli_tools')
+yaml = lazy_import('yaml')
 
 INT_REGEX = r'[0-9]+$'
 
+TERRAFORM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'terraform')
+
+templating.register('couchbase_cluster_script', templates.COUCHBASE_SETUP_SHELL_SCRIPT)
+templating.register('couchbase_buckets_script', '#!/bin/bash\n%s' % templates.COUCHBASE_BUCKETS_ONLY_SHELL_SCRIPT)
+templating.register('couchbase_join_nodes_script', templates.COUCHBASE_JOIN_NODES_SHELL_SCRIPT)
+templating.register('couchbase_cluster_playbook', templates.COUCHBASE_CLUSTER_PLAYBOOK)
+templating.register('couchbase_nodes_playbook', templates.COUCHBASE_NODES_PLAYBOOK)
+templating.register('couchbase_buckets_playbook', templates.COUCHBASE_BUCKETS_PLAYBOOK)
+templating.register('ansible_cfg', templates.ANSIBLE_CFG_TEMPLATE)
+
+DEFAULT_NODE_PORT = '8091'
+DEFAULT_REBALANCE_TIMEOUT_SECS = 3600
+DEFAULT_REBALANCE_POLL_INTERVAL_SECS = 10
+SCRIPT_FILE_MODE = 0o755
+
+# matches the Couchbase AMI in machines.tf
+DEFAULT_COUCHBASE_VERSION = '4.5.0'
+DEFAULT_COUCHBASE_EDITION = 'community'
+
+ANSIBLE_CFG_FILENAME = 'ansible.cfg'
+ANSIBLE_INVENTORY_FILENAME = 'hosts'
+ANSIBLE_DYNAMIC_INVENTORY = 'tfinventory.py'
+ANSIBLE_FACT_CACHE_DIR = '.ansible_fact_cache'
+ANSIBLE_FACT_CACHE_TIMEOUT_SECS = 86400
+ANSIBLE_CONTROL_PERSIST = '60s'
+MIN_ANSIBLE_FORKS = 10
+MAX_ANSIBLE_FORKS = 50
+
 def docopt_cmd(func):
     """
     This decorator is used to simplify the try/except block and pass the result
@@ -28,9 +69,9 @@ def docopt_cmd(func):
     """
     def fn(self, arg):
         try:
-            opt = docopt_func(fn.__doc__, arg)
+            opt = docopt.docopt(fn.__doc__, arg)
 
-        except DocoptExit as e:
+        except docopt.DocoptExit as e:
             # The DocoptExit is thrown when the args do not match.
             # We print a message to the user and the usage block.
 
@@ -133,12 +174,168 @@ class mandatory_input(ContextDecorator):
         return False
 
 
-CouchbaseBucketSpec = namedtuple('CouchbaseBucketSpec', 'name type ram_quota num_replicas')
+CouchbaseBucketSpec = namedtuple('CouchbaseBucketSpec',
+                                 'name type ram_quota num_replicas eviction_policy compression_mode max_ttl '
+                                 'io_priority db_fragmentation_pct view_fragmentation_pct '
+                                 'compaction_window_start compaction_window_end abort_outside_window')
+
+# performance settings are optional; None leaves the server default in place
+CouchbaseBucketSpec.__new__.__defaults__ = (None,) * 9
+
+EVICTION_POLICY_OPTIONS = [
+    {'label': 'value-only (keys and metadata stay resident)', 'value': 'valueOnly'},
+    {'label': 'full (metadata may be evicted too)', 'value': 'fullEviction'}
+]
+
+COMPRESSION_MODE_OPTIONS = [
+    {'label': 'off', 'value': 'off'},
+    {'label': 'passive', 'value': 'passive'},
+    {'label': 'active', 'value': 'active'}
+]
+
+IO_PRIORITY_OPTIONS = [
+    {'label': 'high', 'value': 'high'},
+    {'label': 'low', 'value': 'low'}
+]
+
+# settings each bucket type accepts beyond name, type and RAM quota
+BUCKET_TYPE_SETTINGS = {
+    'couchbase': {'num_replicas', 'eviction_policy', 'compression_mode', 'max_ttl', 'io_priority',
+                  'db_fragmentation_pct', 'view_fragmentation_pct',
+                  'compaction_window_start', 'compaction_window_end', 'abort_outside_window'},
+    'memcached': set()
+}
+
+TIME_OF_DAY_REGEX = r'([01][0-9]|2[0-3]):[0-5][0-9]$'
+
+# oldest couchbase-cli whose bucket-create takes each setting, and the editions that
+# have it (None for all)
+BUCKET_SETTING_REQUIREMENTS = {
+    'eviction_policy': ('3.0.0', None),
+    'io_priority': ('3.0.0', None),
+    'compression_mode': ('5.5.0', {'enterprise'}),
+    'max_ttl': ('5.5.0', {'enterprise'})
+}
+
+COMPACTION_SETTINGS = ('db_fragmentation_pct', 'view_fragmentation_pct',
+                       'compaction_window_start', 'compaction_window_end', 'abort_outside_window')
+
+# older servers only take compaction settings cluster-wide, through setting-compaction
+PER_BUCKET_COMPACTION_VERSION = '7.1.0'
+
+
+def version_tuple(version):
+    '''(major, minor, patch) of a Couchbase version string such as "6.6.0-7909".'''
+
+    numbers = [int(n) for n in re.findall(r'[0-9]+', version.split('-')[0])[:3]]
+    return tuple(numbers + [0] * (3 - len(numbers)))
+
+
+def setting_unsupported_reason(setting, couchbase_version, couchbase_edition):
+    '''Why bucket-create on the given server cannot take <setting>, or None if it can.'''
+
+    if setting not in BUCKET_SETTING_REQUIREMENTS:
+        return None
+    min_version, editions = BUCKET_SETTING_REQUIREMENTS[setting]
+    if version_tuple(couchbase_version) < version_tuple(min_version):
+        return 'requires Couchbase %s or later (cluster runs %s)' % (min_version, couchbase_version)
+    if editions and couchbase_edition not in editions:
+        return 'requires the %s edition (cluster runs %s)' % (' or '.join(sorted(editions)), couchbase_edition)
+    return None
+
+
+def per_bucket_compaction(couchbase_version):
+    return version_tuple(couchbase_version) >= version_tuple(PER_BUCKET_COMPACTION_VERSION)
+
+
+def bucket_compaction(bucket_spec):
+    '''The compaction settings a bucket asks for, leaving out the unset ones.'''
+
+    return {setting: getattr(bucket_spec, setting) for setting in COMPACTION_SETTINGS
+            if getattr(bucket_spec, setting) not in (None, '', False)}
+
+
+def cluster_compaction(bucket_specs):
+    '''Returns the compaction settings to apply cluster-wide and a list of problems;
+    every bucket that sets compaction must ask for the same settings.
+    '''
+
+    compaction = {}
+    requested_by = None
+    for bucket_spec in bucket_specs:
+        settings = bucket_compaction(bucket_spec)
+        if not settings:
+            continue
+        if requested_by is None:
+            compaction, requested_by = settings, bucket_spec.name
+        elif settings != compaction:
+            return compaction, ['buckets %s and %s ask for different compaction settings, but Couchbase '
+                                'before %s applies one set to the whole cluster'
+                                % (requested_by, bucket_spec.name, PER_BUCKET_COMPACTION_VERSION)]
+    return compaction, []
+
+
+def bucket_spec_errors(bucket_spec, couchbase_version=DEFAULT_COUCHBASE_VERSION,
+                       couchbase_edition=DEFAULT_COUCHBASE_EDITION):
+    '''Returns a list of problems with the bucket's performance settings for its type
+    and for the couchbase-cli of the cluster's server version and edition.
+    '''
+
+    errors = []
+    allowed = BUCKET_TYPE_SETTINGS.get(bucket_spec.type)
+    if allowed is None:
+        return ['unsupported bucket type "%s"' % bucket_spec.type]
+
+    for setting, value in bucket_spec._asdict().items():
+        if setting in ('name', 'type', 'ram_quota') or value in (None, '', '0', 0, False):
+            continue
+        if setting not in allowed:
+            errors.append('%s is not supported by %s buckets' % (setting, bucket_spec.type))
+            continue
+        reason = setting_unsupported_reason(setting, couchbase_version, couchbase_edition)
+        if reason:
+            errors.append('%s %s' % (setting, reason))
+
+    if bucket_spec.eviction_policy and bucket_spec.eviction_policy not in [o['value'] for o in EVICTION_POLICY_OPTIONS]:
+        errors.append('unknown eviction policy "%s"' % bucket_spec.eviction_policy)
+    for setting in ('db_fragmentation_pct', 'view_fragmentation_pct'):
+        value = getattr(bucket_spec, setting)
+        if value and not 2 <= int(value) <= 100:
+            errors.append('%s must be between 2 and 100' % setting)
+    if bool(bucket_spec.compaction_window_start) != bool(bucket_spec.compaction_window_end):
+        errors.append('a compaction window needs both a start and an end time')
+    if bucket_spec.abort_outside_window and not bucket_spec.compaction_window_start:
+        errors.append('abort_outside_window requires a compaction window')
+    return errors
+
+
+CouchbaseNodeSpec = namedtuple('CouchbaseNodeSpec', 'address port group')
+
+CouchbaseNodeGroupSpec = namedtuple('CouchbaseNodeGroupSpec',
+                                    'name services instance_type index_ram_quota fts_ram_quota')
+
+CouchbaseNodePlacement = namedtuple('CouchbaseNodePlacement', 'address port group services')
+
+COUCHBASE_SERVICES = ['data', 'index', 'query', 'fts']
+
+DEFAULT_NODE_GROUP = CouchbaseNodeGroupSpec(name='default',
+                                            services='data,index,query',
+                                            instance_type='',
+                                            index_ram_quota='',
+                                            fts_ram_quota='')
+
+# the smallest search service quota Couchbase accepts
+DEFAULT_FTS_RAM_QUOTA = 256
 
 BUCKET_TYPE_OPTIONS = [
     {'label': 'couchbase', 'value': 'couchbase'},
     {'label': 'memcache', 'value': 'memcached'}
 ]
+
+EDITION_OPTIONS = [
+    {'label': 'community', 'value': 'community'},
+    {'label': 'enterprise', 'value': 'enterprise'}
+]
     
 
 class MissingInput(Exception):
@@ -153,10 +350,17 @@ class MakeClusterCLI(Cmd):
         self.name = app_name
         self.project_name = kwargs['project_name']
         self.prompt = '%s [%s]> ' % (self.name, self.project_name)
+        self.tf_state_file = kwargs.get('tf_state') or os.path.join(TERRAFORM_DIR, 'terraform.tfstate')
         self.cluster_config = {
-            'buckets': []
+            'buckets': [],
+            'nodes': [],
+            'node_groups': []
         }
-        _ = os.system('clear')
+
+
+    def preloop(self):
+        # clear the terminal without spawning a shell
+        print('\033[H\033[2J', end='')
 
 
     def get_admin_username(self):
@@ -176,7 +380,7 @@ class MakeClusterCLI(Cmd):
 
     def get_cluster_ram_quota(self):
         with required_input_format(INT_REGEX,
-                                   cli.InputPrompt('cluster RAM quota (GB)'),
+                                   cli.InputPrompt('cluster RAM quota (MB)'),
                                    warning_message='cluster RAM quota must be an integer',
                                    failure_message='bad or missing cluster RAM quota') as input_result:
             return input_result.data
@@ -195,37 +399,366 @@ class MakeClusterCLI(Cmd):
         bucket_type = cli.MenuPrompt('bucket type', BUCKET_TYPE_OPTIONS).show()
 
         with required_input_format(INT_REGEX,
-                                   cli.InputPrompt('bucket RAM quota (GB)'),
+                                   cli.InputPrompt('bucket RAM quota (MB)'),
                                    warning_message='RAM quota must be a positive integer',
                                    failure_message='bad RAM quota value') as input_result:
             quota = input_result.data
         
-        value_test_func = lambda x: re.compile(INT_REGEX).match(x) and int(x) < 5
-        with constrained_input_value(value_test_func,
-                                     cli.InputPrompt('number of replicas'),
-                                     warning_message='# of replicas must be less than 5',
-                                     failure_message='# of replicas outside of allowed limits') as input_result:
-            num_replicas = input_result.data                                    
-
-        return CouchbaseBucketSpec(name=bucket_name,
-                                   type=bucket_type,
-                                   ram_quota=quota,
-                                   num_replicas=num_replicas)
+        # memcached buckets cannot be replicated
+        num_replicas = '0'
+        if bucket_type == 'couchbase':
+            value_test_func = lambda x: re.compile(INT_REGEX).match(x) and int(x) < 5
+            with constrained_input_value(value_test_func,
+                                         cli.InputPrompt('number of replicas'),
+                                         warning_message='# of replicas must be less than 5',
+                                         failure_message='# of replicas outside of allowed limits') as input_result:
+                num_replicas = input_result.data
+
+        bucket_spec = CouchbaseBucketSpec(name=bucket_name,
+                                          type=bucket_type,
+                                          ram_quota=quota,
+                                          num_replicas=num_replicas)
+
+        if bucket_type == 'couchbase':
+            should_tune = cli.InputPrompt('Set bucket performance settings (y/N)?', 'n').show()
+            if should_tune == 'y':
+                bucket_spec = bucket_spec._replace(**self.get_bucket_performance_settings())
+
+        errors = bucket_spec_errors(bucket_spec, self.couchbase_version(), self.couchbase_edition())
+        if errors:
+            print('\n### invalid settings for bucket %s:' % bucket_name)
+            for error in errors:
+                print('###   %s' % error)
+            print()
+            return None
+        return bucket_spec
+
+
+    def couchbase_version(self):
+        return self.cluster_config.get('couchbase_version') or DEFAULT_COUCHBASE_VERSION
+
+
+    def couchbase_edition(self):
+        return self.cluster_config.get('couchbase_edition') or DEFAULT_COUCHBASE_EDITION
+
+
+    def supports_setting(self, setting):
+        reason = setting_unsupported_reason(setting, self.couchbase_version(), self.couchbase_edition())
+        if reason:
+            print('### skipping %s: %s; the server default stays in place.' % (setting, reason))
+        return reason is None
+
+
+    def get_bucket_performance_settings(self):
+        '''Prompts only for the settings the cluster's Couchbase version and edition accept.'''
+
+        settings = {}
+        if self.supports_setting('eviction_policy'):
+            settings['eviction_policy'] = cli.MenuPrompt('eviction policy', EVICTION_POLICY_OPTIONS).show()
+        if self.supports_setting('compression_mode'):
+            settings['compression_mode'] = cli.MenuPrompt('compression mode', COMPRESSION_MODE_OPTIONS).show()
+        if self.supports_setting('io_priority'):
+            settings['io_priority'] = cli.MenuPrompt('IO priority', IO_PRIORITY_OPTIONS).show()
+        if self.supports_setting('max_ttl'):
+            # 0 keeps the server default of no expiry
+            max_ttl = self.get_integer('max TTL in seconds (0 for none)', '0')
+            settings['max_ttl'] = str(max_ttl) if max_ttl else None
+
+        if not per_bucket_compaction(self.couchbase_version()):
+            compaction, _ = cluster_compaction(self.cluster_config['buckets'])
+            if compaction:
+                print('### Couchbase %s applies compaction cluster-wide; reusing the settings of the existing buckets.'
+                      % self.couchbase_version())
+                settings.update(compaction)
+                return settings
+            print('### Couchbase %s applies compaction cluster-wide; these settings will cover every bucket.'
+                  % self.couchbase_version())
+
+        value_test_func = lambda x: re.compile(INT_REGEX).match(x) and 2 <= int(x) <= 100
+        for setting, label in (('db_fragmentation_pct', 'database'), ('view_fragmentation_pct', 'view')):
+            with constrained_input_value(value_test_func,
+                                         cli.InputPrompt('%s fragmentation %% that triggers compaction' % label, '30'),
+                                         warning_message='fragmentation threshold must be between 2 and 100',
+                                         failure_message='bad fragmentation threshold') as input_result:
+                settings[setting] = input_result.data
+
+        should_window = cli.InputPrompt('Restrict compaction to an off-peak window (Y/n)?', 'y').show()
+        if should_window != 'n':
+            for setting, label, default in (('compaction_window_start', 'start', '01:00'),
+                                            ('compaction_window_end', 'end', '05:00')):
+                with required_input_format(TIME_OF_DAY_REGEX,
+                                           cli.InputPrompt('compaction window %s (HH:MM)' % label, default),
+                                           warning_message='times must be given as HH:MM',
+                                           failure_message='bad compaction window time') as input_result:
+                    settings[setting] = input_result.data
+            should_abort = cli.InputPrompt('Abort compaction still running outside the window (Y/n)?', 'y').show()
+            settings['abort_outside_window'] = should_abort != 'n'
+        return settings
+
+    def get_integer(self, prompt_text, default_value=''):
+        with required_input_format(INT_REGEX,
+                                   cli.InputPrompt(prompt_text, default_value),
+                                   warning_message='%s must be a non-negative integer' % prompt_text,
+                                   failure_message='bad or missing value for %s' % prompt_text) as input_result:
+            return int(input_result.data)
+
+
+    def default_instance_type(self):
+        try:
+            blocks = tfparse.parse_tf_dir(TERRAFORM_DIR)
+            return tfparse.variable_defaults(blocks).get('instance_types', {}).get('couchbase', '')
+        except (OSError, tfparse.TerraformParseError):
+            return ''
+
+
+    def get_bucket_workload(self):
+        with mandatory_input(cli.InputPrompt('bucket name'),
+                             warning_message='a bucket must have a name',
+                             failure_message='bad or missing bucket name') as input_result:
+            bucket_name = input_result.data
+
+        bucket_type = cli.MenuPrompt('bucket type', BUCKET_TYPE_OPTIONS).show()
+        num_documents = self.get_integer('expected document count')
+        avg_doc_bytes = self.get_integer('average document size (bytes)', '1024')
+        avg_key_bytes = self.get_integer('average key size (bytes)', '36')
+
+        num_replicas = 0
+        resident_pct = 100
+        if bucket_type == 'couchbase':
+            num_replicas = self.get_integer('number of replicas', '1')
+            if num_replicas > 3:
+                raise Exception('# of replicas outside of allowed limits')
+            resident_pct = min(self.get_integer('target resident ratio (percent)', '100'), 100)
+
+        return bucketplanner.BucketWorkload(name=bucket_name,
+                                            type=bucket_type,
+                                            num_documents=num_documents,
+                                            avg_doc_bytes=avg_doc_bytes,
+                                            avg_key_bytes=avg_key_bytes,
+                                            num_replicas=num_replicas,
+                                            resident_ratio=resident_pct / 100.0)
+
+
+    @docopt_cmd
+    def do_plan(self, cmd_args):
+        '''Usage:
+                plan buckets
+        '''
+
+        num_nodes = self.get_integer('number of Couchbase nodes', '3')
+        type_name = cli.InputPrompt('Couchbase instance type', self.default_instance_type()).show()
+        try:
+            max_quota_mb = bucketplanner.max_cluster_ram_quota_mb(instances.memory_mb(type_name))
+        except instances.UnknownInstanceType as err:
+            print('\n### %s\n' % err)
+            return
+
+        default_quota = self.cluster_config.get('cluster_ram_quota') or str(max_quota_mb)
+        cluster_ram_quota_mb = self.get_integer('cluster RAM quota per node (MB)', default_quota)
+        if cluster_ram_quota_mb > max_quota_mb:
+            print('\n### a %d MB cluster RAM quota leaves too little memory for the OS on %s (max %d MB).\n'
+                  % (cluster_ram_quota_mb, type_name, max_quota_mb))
+
+        workloads = []
+        while True:
+            workloads.append(self.get_bucket_workload())
+            should_continue = cli.InputPrompt('Plan another bucket (Y/n)?', 'y').show()
+            if should_continue == 'n':
+                break
+
+        try:
+            plans = bucketplanner.plan_buckets(workloads, num_nodes, cluster_ram_quota_mb)
+        except bucketplanner.BucketPlanningError as err:
+            print('\n### %s\n' % err)
+            return
+
+        print('\n____ Bucket RAM plan for %d x %s, %d MB cluster quota per node:\n'
+              % (num_nodes, type_name, cluster_ram_quota_mb))
+        print('  %-20s %-10s %14s %12s %10s' % ('bucket', 'type', 'required MB', 'quota MB', 'resident'))
+        for plan in plans:
+            print('  %-20s %-10s %14d %12d %9.0f%%' % (plan.workload.name, plan.workload.type, plan.required_quota_mb,
+                                                      plan.quota_mb, plan.effective_resident_ratio * 100))
+            for warning in plan.warnings:
+                print('      ### %s' % warning)
+
+        self.cluster_config['cluster_ram_quota'] = str(cluster_ram_quota_mb)
+        for plan in plans:
+            existing = [b.name for b in self.cluster_config['buckets']]
+            if plan.workload.name in existing:
+                # keep any performance settings already chosen for the bucket
+                index = existing.index(plan.workload.name)
+                self.cluster_config['buckets'][index] = self.cluster_config['buckets'][index]._replace(
+                    type=plan.workload.type,
+                    ram_quota=str(plan.quota_mb),
+                    num_replicas=str(plan.workload.num_replicas))
+            else:
+                self.cluster_config['buckets'].append(CouchbaseBucketSpec(name=plan.workload.name,
+                                                                          type=plan.workload.type,
+                                                                          ram_quota=str(plan.quota_mb),
+                                                                          num_replicas=str(plan.workload.num_replicas)))
+
+        print('\n+++ %d bucket spec(s) written to cluster config.\n' % len(plans))
+
+
+    def node_groups(self):
+        return self.cluster_config.get('node_groups') or [DEFAULT_NODE_GROUP]
+
+
+    def get_node_group(self, group_name):
+        for group in self.node_groups():
+            if group.name == group_name:
+                return group
+        raise MissingInput('no node group named "%s".' % group_name)
+
+
+    def create_node_group(self):
+        with mandatory_input(cli.InputPrompt('node group name'),
+                             warning_message='a node group must have a name',
+                             failure_message='bad or missing node group name') as input_result:
+            group_name = input_result.data
+
+        is_valid_services = lambda x: x and set(s.strip() for s in x.split(',')) <= set(COUCHBASE_SERVICES)
+        with constrained_input_value(is_valid_services,
+                                     cli.InputPrompt('services (comma-separated: %s)' % ', '.join(COUCHBASE_SERVICES), 'data'),
+                                     warning_message='services must be drawn from %s' % ', '.join(COUCHBASE_SERVICES),
+                                     failure_message='bad or missing service list') as input_result:
+            services = [s.strip() for s in input_result.data.split(',')]
+
+        instance_type = cli.InputPrompt('instance type', self.default_instance_type()).show()
+        index_ram_quota = ''
+        if 'index' in services:
+            index_ram_quota = self.get_service_ram_quota('index', instance_type, '512')
+        fts_ram_quota = ''
+        if 'fts' in services:
+            fts_ram_quota = self.get_service_ram_quota('fts', instance_type, str(DEFAULT_FTS_RAM_QUOTA))
+
+        if 'data' in services and len(services) > 1:
+            print('\n### group "%s" co-locates data with %s; KV latency will compete with them for CPU and RAM.\n'
+                  % (group_name, ', '.join(s for s in services if s != 'data')))
+
+        return CouchbaseNodeGroupSpec(name=group_name,
+                                      services=','.join(s for s in COUCHBASE_SERVICES if s in services),
+                                      instance_type=instance_type,
+                                      index_ram_quota=index_ram_quota,
+                                      fts_ram_quota=fts_ram_quota)
+
+
+    def get_service_ram_quota(self, service, instance_type, default_value):
+        ram_quota = str(self.get_integer('%s RAM quota per node (MB)' % service, default_value))
+        try:
+            max_quota_mb = bucketplanner.max_cluster_ram_quota_mb(instances.memory_mb(instance_type))
+            if int(ram_quota) > max_quota_mb:
+                print('\n### %s RAM quota exceeds the %d MB usable on %s.\n' % (service, max_quota_mb, instance_type))
+        except instances.UnknownInstanceType as err:
+            print('\n### %s\n' % err)
+        return ram_quota
+
+
+    def create_node(self):
+        with mandatory_input(cli.InputPrompt('node address'),
+                             warning_message='a node must have an address',
+                             failure_message='bad or missing node address') as input_result:
+            address = input_result.data
+
+        port = cli.InputPrompt('node port', DEFAULT_NODE_PORT).show()
+        group_options = [{'label': '%s (%s)' % (g.name, g.services), 'value': g.name} for g in self.node_groups()]
+        group_name = group_options[0]['value']
+        if len(group_options) > 1:
+            group_name = cli.MenuPrompt('node group', group_options).show()
+        return CouchbaseNodeSpec(address=address, port=port, group=group_name)
+
+
+    def terraform_nodes(self):
+        '''Reads the Couchbase instance IPs Terraform already knows. The first instance
+        is couchbase-main, which initializes the cluster; the others join it, each in
+        the first node group its Groups tag names (else the first node group).
+        '''
+
+        data = tfstate.load_json(self.tf_state_file)
+        group_names = [g.name for g in self.node_groups()]
+        if not tfstate.is_state(data):
+            # "terraform output -json" carries no tags
+            addresses = tfstate.private_ips(data, 'aws_instance', 'couchbase_cluster', 'couchbase_private_ips')
+            return [CouchbaseNodeSpec(address=address, port=DEFAULT_NODE_PORT, group=group_names[0])
+                    for address in addresses[1:]]
+
+        nodes = []
+        cluster_instances = [i for i in tfstate.instances_of(data, 'aws_instance', 'couchbase_cluster') if i.private_ip]
+        for instance in cluster_instances[1:]:
+            groups = [g for g in tfinventory.tagged_groups(instance) if g in group_names]
+            nodes.append(CouchbaseNodeSpec(address=instance.private_ip,
+                                           port=DEFAULT_NODE_PORT,
+                                           group=groups[0] if groups else group_names[0]))
+        return nodes
+
+
+    @docopt_cmd
+    def do_import(self, cmd_args):
+        '''Usage:
+                import nodes
+        '''
+
+        try:
+            nodes = self.terraform_nodes()
+        except tfstate.TerraformStateError as err:
+            print('\n### %s\n' % err)
+            return
+
+        existing = [n.address for n in self.cluster_config['nodes']]
+        new_nodes = [n for n in nodes if n.address not in existing]
+        self.cluster_config['nodes'].extend(new_nodes)
+        print('\n+++ imported %d node(s) from %s.\n' % (len(new_nodes), self.tf_state_file))
+
+
+    def node_placements(self, nodes=None):
+        placements = []
+        for node in nodes if nodes is not None else self.cluster_config.get('nodes', []):
+            group = self.get_node_group(node.group)
+            placements.append(CouchbaseNodePlacement(node.address, node.port, group.name, group.services))
+        return placements
+
+
+    def render_spec(self):
+        '''Returns the cluster config plus the service placement settings the script templates need.'''
+
+        spec = dict(self.cluster_config)
+        groups = self.node_groups()
+        init_group = self.get_node_group(self.cluster_config.get('init_group') or groups[0].name)
+        spec['init_services'] = init_group.services
+        index_quotas = [int(g.index_ram_quota) for g in groups if 'index' in g.services and g.index_ram_quota]
+        spec['index_ram_quota'] = max(index_quotas) if index_quotas else ''
+        # the search service quota is cluster-wide too, and must be set once any node runs fts
+        fts_quotas = [int(g.fts_ram_quota or DEFAULT_FTS_RAM_QUOTA) for g in groups if 'fts' in g.services]
+        spec['fts_ram_quota'] = max(fts_quotas) if fts_quotas else ''
+        spec['couchbase_version'] = self.couchbase_version()
+        spec['couchbase_edition'] = self.couchbase_edition()
+        spec['compaction'] = None
+        if not per_bucket_compaction(spec['couchbase_version']):
+            # bucket-create would reject the per-bucket flags; apply them once for the cluster
+            spec['compaction'], _ = cluster_compaction(spec['buckets'])
+            unset = dict((setting, None) for setting in COMPACTION_SETTINGS)
+            spec['buckets'] = [b._replace(**unset) for b in spec['buckets']]
+        return spec
+
 
     @docopt_cmd
     def do_new(self, cmd_args):
         '''Usage:
-                new (cluster | bucket | node)
+                new (cluster | bucket | node | group)
         '''
 
         if cmd_args['cluster']:
             admin_username = self.get_admin_username()
             admin_password = self.get_admin_password()
             cluster_ram_quota = self.get_cluster_ram_quota()
+            couchbase_version = cli.InputPrompt('Couchbase server version', DEFAULT_COUCHBASE_VERSION).show()
+            couchbase_edition = cli.MenuPrompt('Couchbase edition', EDITION_OPTIONS).show()
 
             self.cluster_config['admin_username'] = admin_username
             self.cluster_config['admin_password'] = admin_password
             self.cluster_config['cluster_ram_quota'] = cluster_ram_quota
+            self.cluster_config['couchbase_version'] = couchbase_version
+            self.cluster_config['couchbase_edition'] = couchbase_edition
 
             print('\n+++ Couchbase cluster settings specified.\n')
             buckets = []
@@ -245,14 +778,32 @@ class MakeClusterCLI(Cmd):
             return
 
         elif cmd_args['bucket']:
-            bucket_spec = self.create_bucket()
             while True:
+                bucket_spec = self.create_bucket()
                 if bucket_spec:
                     self.cluster_config['buckets'].append(bucket_spec)
                     print('\n+++added bucket "%s" to cluster config\n' % bucket_spec.name)
-                    should_continue = cli.InputPrompt('Create another bucket (Y/n)?', 'y').show()
-                    if should_continue == 'n':
-                        break
+                should_continue = cli.InputPrompt('Create another bucket (Y/n)?', 'y').show()
+                if should_continue == 'n':
+                    break
+
+        elif cmd_args['group']:
+            group_spec = self.create_node_group()
+            groups = [g for g in self.cluster_config.setdefault('node_groups', []) if g.name != group_spec.name]
+            groups.append(group_spec)
+            self.cluster_config['node_groups'] = groups
+            if not self.cluster_config.get('init_group'):
+                self.cluster_config['init_group'] = group_spec.name
+            print('\n+++added node group "%s" (%s) to cluster config\n' % (group_spec.name, group_spec.services))
+
+        elif cmd_args['node']:
+            while True:
+                node_spec = self.create_node()
+                self.cluster_config.setdefault('nodes', []).append(node_spec)
+                print('\n+++added node %s:%s to cluster config\n' % (node_spec.address, node_spec.port))
+                should_continue = cli.InputPrompt('Add another node (Y/n)?', 'y').show()
+                if should_continue == 'n':
+                    break
 
 
     def generate_bucket_options(self):
@@ -303,7 +854,78 @@ class MakeClusterCLI(Cmd):
 
 
     def generate_addnode_script_filename(self):
-        return 'couchbase_%s_add_node.sh'
+        return 'couchbase_%s_add_node.sh' % self.project_name
+
+
+    def generate_config_filename(self):
+        return 'couchbase_%s_cluster.yml' % self.project_name
+
+
+    def generate_playbook_filename(self, section):
+        return 'couchbase_%s_%s_playbook.yml' % (self.project_name, section)
+
+
+    def ansible_forks(self):
+        '''One fork per host, so every node is handled in the same pass, within sane bounds.'''
+
+        num_hosts = len(self.cluster_config.get('nodes', [])) + 1
+        return min(max(num_hosts, MIN_ANSIBLE_FORKS), MAX_ANSIBLE_FORKS)
+
+
+    def ansible_inventory(self):
+        '''Uses the Terraform-backed dynamic inventory once there is state to read.'''
+
+        if os.path.isfile(self.tf_state_file):
+            return ANSIBLE_DYNAMIC_INVENTORY
+        return ANSIBLE_INVENTORY_FILENAME
+
+
+    def save_tuning_role(self):
+        role_dir, changed = hosttuning.write_role('couchbase')
+        if changed:
+            print('generated host tuning role %s.' % role_dir)
+        else:
+            print('host tuning role %s is unchanged.' % role_dir)
+
+
+    def save_ansible_cfg(self):
+        cfg_data = templating.render('ansible_cfg',
+                                     project_name=self.project_name,
+                                     inventory=self.ansible_inventory(),
+                                     forks=self.ansible_forks(),
+                                     fact_cache_dir=ANSIBLE_FACT_CACHE_DIR,
+                                     fact_cache_timeout_secs=ANSIBLE_FACT_CACHE_TIMEOUT_SECS,
+                                     control_persist=ANSIBLE_CONTROL_PERSIST)
+        if artifacts.write_artifact(ANSIBLE_CFG_FILENAME, cfg_data):
+            print('generated %s.' % ANSIBLE_CFG_FILENAME)
+
+
+    def invalid_bucket_specs(self):
+        '''Prints the buckets whose settings the cluster's couchbase-cli cannot take;
+        the version or edition may have changed since they were created.
+        '''
+
+        invalid = []
+        for bucket_spec in self.cluster_config['buckets']:
+            errors = bucket_spec_errors(bucket_spec, self.couchbase_version(), self.couchbase_edition())
+            if errors:
+                print('\n### invalid settings for bucket %s: %s' % (bucket_spec.name, '; '.join(errors)))
+                invalid.append(bucket_spec.name)
+        if not per_bucket_compaction(self.couchbase_version()):
+            _, errors = cluster_compaction(self.cluster_config['buckets'])
+            for error in errors:
+                print('\n### invalid compaction settings: %s' % error)
+                invalid.append(error)
+        if invalid:
+            print('### delete and re-create the bucket(s) before saving.\n')
+        return invalid
+
+
+    def serializable_config(self):
+        config = dict(self.cluster_config)
+        for key in ('buckets', 'nodes', 'node_groups'):
+            config[key] = [dict(item._asdict()) for item in self.cluster_config.get(key, [])]
+        return config
 
 
     def do_quit(self, cmd_args):
@@ -316,6 +938,7 @@ class MakeClusterCLI(Cmd):
     def do_save(self, cmd_args):
         '''Usage:
                 save [cluster | buckets | nodes] as (script | playbook)
+                save tuning
                 save config            
         '''
 
@@ -334,36 +957,95 @@ class MakeClusterCLI(Cmd):
             else:
                 return
 
-        j2env = jinja2.Environment()
-
         if cmd_args['config']:
-            print('\n### Placeholder for save-to-YAML functionality\n')
+            config_filename = self.generate_config_filename()
+            config_data = yaml.safe_dump(self.serializable_config(), default_flow_style=False)
+            artifacts.write_artifact(config_filename, config_data)
+            print('saved cluster config to %s.' % config_filename)
+            return
+
+        if cmd_args['tuning']:
+            self.save_tuning_role()
+            return
+
+        # the cluster and bucket scripts and playbooks run bucket-create
+        if not cmd_args['nodes'] and self.invalid_bucket_specs():
+            return
+
+        if cmd_args['script'] and cmd_args['nodes']:
+            if not self.cluster_config.get('nodes'):
+                print('\n### No nodes have been added to the cluster config. Use "new node" first.\n')
+                return
+
+            script_filename = self.generate_addnode_script_filename()
+            script_data = templating.render('couchbase_join_nodes_script',
+                                            cluster_spec=self.render_spec(),
+                                            nodes=self.node_placements(),
+                                            rebalance_timeout_secs=DEFAULT_REBALANCE_TIMEOUT_SECS,
+                                            poll_interval_secs=DEFAULT_REBALANCE_POLL_INTERVAL_SECS)
+            if artifacts.write_artifact(script_filename, script_data, mode=SCRIPT_FILE_MODE):
+                print('generated script %s.' % script_filename)
+            else:
+                print('script %s is unchanged.' % script_filename)
             return
 
         if cmd_args['script']:
-            template_string = None
+            template_name = None
             if cmd_args['cluster']:
-                template_string = templates.COUCHBASE_SETUP_SHELL_SCRIPT
+                template_name = 'couchbase_cluster_script'
                 script_filename = self.generate_cluster_script_filename()
             elif cmd_args['buckets']:
-                template_string = '#!/bin/bash\n%s' % templates.COUCHBASE_BUCKETS_ONLY_SHELL_SCRIPT
+                template_name = 'couchbase_buckets_script'
                 script_filename = self.generate_bucket_script_filename()
 
-            script_template = j2env.from_string(template_string)
-            
-            with open(script_filename, 'w+') as f:
-                f.write(script_template.render(cluster_spec=self.cluster_config))
+            script_data = templating.render(template_name, cluster_spec=self.render_spec())
+            if artifacts.write_artifact(script_filename, script_data):
                 print('generated script %s.' % script_filename)
+            else:
+                print('script %s is unchanged.' % script_filename)
 
         if cmd_args['playbook']:
-            print('\n### Placeholder for save-to-Ansible-playbook functionality\n')
-                        
+            section = 'cluster'
+            if cmd_args['buckets']:
+                section = 'buckets'
+            elif cmd_args['nodes']:
+                section = 'nodes'
+
+            # node addresses are rendered into the playbook, so the join
+            # play never needs to gather facts from the nodes
+            nodes = self.node_placements()
+            if not nodes and section != 'buckets' and os.path.isfile(self.tf_state_file):
+                try:
+                    nodes = self.node_placements(self.terraform_nodes())
+                    print('using %d node address(es) from %s.' % (len(nodes), self.tf_state_file))
+                except tfstate.TerraformStateError as err:
+                    print('\n### %s\n' % err)
+                    return
+
+            playbook_filename = self.generate_playbook_filename(section)
+            playbook_data = templating.render('couchbase_%s_playbook' % section,
+                                              project_name=self.project_name,
+                                              cluster_spec=self.render_spec(),
+                                              nodes=[dict(n._asdict()) for n in nodes],
+                                              tuning_role=hosttuning.role_name('couchbase'),
+                                              rebalance_timeout_secs=DEFAULT_REBALANCE_TIMEOUT_SECS,
+                                              poll_interval_secs=DEFAULT_REBALANCE_POLL_INTERVAL_SECS)
+            if artifacts.write_artifact(playbook_filename, playbook_data):
+                print('generated playbook %s.' % playbook_filename)
+            else:
+                print('playbook %s is unchanged.' % playbook_filename)
+            if section == 'cluster':
+                self.save_tuning_role()
+            self.save_ansible_cfg()
+
+
 def main(args):
 
     project = args['<project_name>']
-    cli_app = MakeClusterCLI(project_name=project)
+    cli_app = MakeClusterCLI(project_name=project, tf_state=args['--tf-state'])
     cli_app.cmdloop('''Welcome to the mkcluster interactive shell.
     Type "new" to provision a new Couchbase cluster against a virgin instance.
+    Type "import nodes" to add the Couchbase instances from the Terraform state.
     Type "help" or "?" to list commands.''')
 
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    mkelastic.py <project_name> --index=<name> --index-gb=<gb> [options]
+
+Options:
+    --nodes=<n>                      Elasticsearch node count (default: elasticsearch_cluster_size in the .tf files)
+    --instance-type=<type>           EC2 instance type (default: the elasticsearch entry of instance_types)
+    --replicas=<n>                   steady-state replica count [default: 1]
+    --refresh-interval=<interval>    steady-state refresh interval [default: 30s]
+    --es-url=<url>                   Elasticsearch endpoint for the bulk-load script [default: http://localhost:9200]
+    --tf-dir=<dir>                   directory holding the generated .tf files [default: ../terraform]
+
+Generates the Elasticsearch performance profile for a project: a tuning playbook
+that applies the host tuning role and sets the JVM heap from the instance memory,
+an index template with primary shards sized from the expected index size, and a
+bulk-load script that installs the template and switches the index into ingest
+mode ("begin") and back ("end").
+'''
+
+
+import json
+import artifacts
+import esplanner
+import hosttuning
+import instances
+import templates
+import templating
+import tfparse
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+
+
+templating.register('elasticsearch_tuning_playbook', templates.ELASTICSEARCH_TUNING_PLAYBOOK)
+templating.register('elasticsearch_bulk_load_script', templates.ELASTICSEARCH_BULK_LOAD_SCRIPT)
+
+SCRIPT_FILE_MODE = 0o755
+
+# time the "end" step waits for the restored replicas to be allocated
+RESTORE_TIMEOUT = '30m'
+
+
+def terraform_settings(tf_dir):
+    '''Returns (cluster size, instance type) for Elasticsearch from the Terraform variables.'''
+
+    variables = tfparse.variable_defaults(tfparse.parse_tf_dir(tf_dir))
+    instance_types = variables.get('instance_types') or {}
+    return int(variables.get('elasticsearch_cluster_size') or 0), instance_types.get('elasticsearch')
+
+
+def write_generated(filename, data, mode=None):
+    if artifacts.write_artifact(filename, data, mode=mode):
+        print('generated %s.' % filename)
+    else:
+        print('%s is unchanged.' % filename)
+
+
+def main(args):
+    project_name = args['<project_name>']
+    try:
+        nodes_arg = int(args['--nodes']) if args['--nodes'] else None
+        index_gb = float(args['--index-gb'])
+        num_replicas = int(args['--replicas'])
+    except ValueError:
+        print('### --nodes and --replicas must be whole numbers and --index-gb a number.')
+        raise SystemExit(1)
+
+    num_nodes, type_name = terraform_settings(args['--tf-dir'])
+    num_nodes = nodes_arg or num_nodes
+    type_name = args['--instance-type'] or type_name
+    if not num_nodes or not type_name:
+        print('### No Elasticsearch cluster size or instance type found; pass --nodes and --instance-type.')
+        raise SystemExit(1)
+
+    try:
+        heap_mb = esplanner.heap_size_mb(instances.memory_mb(type_name))
+        plan = esplanner.plan_index(args['--index'], index_gb, num_nodes,
+                                    num_replicas, args['--refresh-interval'])
+    except (instances.UnknownInstanceType, esplanner.IndexPlanningError) as err:
+        print('### %s' % err)
+        raise SystemExit(1)
+
+    print('\n____ Elasticsearch profile for %d x %s:\n' % (num_nodes, type_name))
+    print('  JVM heap:          %d MB per node' % heap_mb)
+    print('  index %s: %d primary shard(s) of ~%.1f GB, %d replica(s), refresh %s'
+          % (plan.name, plan.num_shards, plan.shard_gb, plan.num_replicas, plan.refresh_interval))
+    for warning in plan.warnings:
+        print('      ### %s' % warning)
+    print()
+
+    role_dir, _ = hosttuning.write_role('elasticsearch')
+    print('host tuning role in %s.' % role_dir)
+
+    write_generated('elasticsearch_%s_tuning_playbook.yml' % project_name,
+                    templating.render('elasticsearch_tuning_playbook',
+                                      project_name=project_name,
+                                      tuning_role=hosttuning.role_name('elasticsearch'),
+                                      heap_mb=heap_mb))
+
+    template_filename = 'elasticsearch_%s_%s_template.json' % (project_name, plan.name)
+    write_generated(template_filename, json.dumps(esplanner.index_template(plan), indent=2, sort_keys=True) + '\n')
+
+    write_generated('elasticsearch_%s_%s_bulk_load.sh' % (project_name, plan.name),
+                    templating.render('elasticsearch_bulk_load_script',
+                                      plan=plan,
+                                      template_filename=template_filename,
+                                      es_url=args['--es-url'],
+                                      bulk_settings=esplanner.bulk_load_settings(),
+                                      restore_settings=esplanner.restore_settings(plan),
+                                      restore_timeout=RESTORE_TIMEOUT),
+                    mode=SCRIPT_FILE_MODE)
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    pkgcache.py fetch --version=<version> [options]
+    pkgcache.py filename --version=<version> [options]
+
+Options:
+    --edition=<edition>         Couchbase edition [default: community]
+    --platform=<platform>       package platform [default: ubuntu14.04]
+    --sha256=<hex_digest>       expected package checksum (else read from <source>.sha256)
+    --source=<url_or_file>      package URL or local file (else the Couchbase release URL)
+    --cache-dir=<dir>           controller-side package cache [default: .package_cache]
+
+Fetches a Couchbase server package once into a controller-side cache and verifies
+its SHA-256 checksum. A cached package whose checksum still matches is never
+downloaded again, so the playbooks push it to the nodes from the controller
+instead of having every node download it. "fetch" prints a JSON description of
+the cached package for the playbook to register.
+'''
+
+
+import os
+import json
+import hashlib
+import tempfile
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+urlrequest = lazy_import('urllib.request')
+
+
+RELEASES_URL = 'https://packages.couchbase.com/releases'
+DEFAULT_CACHE_DIR = '.package_cache'
+CHUNK_SIZE = 1024 * 1024
+
+
+class PackageCacheError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def package_filename(version, edition='community', platform='ubuntu14.04'):
+    # releases before 3.0 used the <edition>_<arch>_<version> naming scheme
+    if int(version.split('.')[0]) < 3:
+        return 'couchbase-server-%s_x86_64_%s.deb' % (edition, version)
+    return 'couchbase-server-%s_%s-%s_amd64.deb' % (edition, version, platform)
+
+
+def package_url(version, edition='community', platform='ubuntu14.04'):
+    return '%s/%s/%s' % (RELEASES_URL, version, package_filename(version, edition, platform))
+
+
+def open_source(source):
+    '''Opens a URL (http, https or file) or a local path for binary reading.'''
+
+    try:
+        if '://' not in source:
+            return open(source, 'rb')
+        return urlrequest.urlopen(source)
+    except (IOError, OSError, ValueError) as err:
+        raise PackageCacheError('cannot open %s: %s' % (source, err))
+
+
+def read_published_checksum(source):
+    '''Reads the checksum published next to the package, as "<digest>" or "<digest>  <filename>".'''
+
+    try:
+        with open_source(source + '.sha256') as f:
+            text = f.read().decode('ascii').split()
+    except (IOError, OSError, PackageCacheError):
+        raise PackageCacheError('no checksum given and none published at %s.sha256.' % source)
+    if not text:
+        raise PackageCacheError('empty checksum file %s.sha256.' % source)
+    return text[0].lower()
+
+
+def file_sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download(source, filename, expected_sha256):
+    '''Streams <source> into <filename>, hashing on the way, and only renames it into
+    place once the checksum matches.
+    '''
+
+    target_dir = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=target_dir, prefix='.%s.' % os.path.basename(filename))
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as output, open_source(source) as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                output.write(chunk)
+        if digest.hexdigest() != expected_sha256:
+            raise PackageCacheError('checksum mismatch for %s: expected %s, got %s.'
+                                    % (source, expected_sha256, digest.hexdigest()))
+        os.chmod(tmp_filename, 0o644)
+        os.replace(tmp_filename, filename)
+    except (IOError, OSError) as err:
+        raise PackageCacheError('cannot fetch %s: %s' % (source, err))
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def fetch_package(version, edition='community', platform='ubuntu14.04', sha256=None, source=None,
+                  cache_dir=DEFAULT_CACHE_DIR):
+    '''Returns {path, filename, sha256, fetched} for the cached package, downloading
+    it only if the cache does not already hold a copy with the expected checksum.
+    '''
+
+    filename = package_filename(version, edition, platform)
+    source = source or package_url(version, edition, platform)
+    cached_file = os.path.join(cache_dir, filename)
+    checksum_file = cached_file + '.sha256'
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # a checksum recorded by an earlier fetch lets re-runs work offline
+    if not sha256 and os.path.isfile(checksum_file):
+        with open(checksum_file, 'r') as f:
+            sha256 = f.read().strip()
+    sha256 = (sha256 or read_published_checksum(source)).lower()
+
+    fetched = False
+    if not os.path.isfile(cached_file) or file_sha256(cached_file) != sha256:
+        download(source, cached_file, sha256)
+        fetched = True
+    with open(checksum_file, 'w') as f:
+        f.write(sha256 + '\n')
+
+    return {'path': os.path.abspath(cached_file), 'filename': filename, 'sha256': sha256, 'fetched': fetched}
+
+
+def main(args):
+    if args['filename']:
+        print(package_filename(args['--version'], args['--edition'], args['--platform']))
+        return
+
+    try:
+        package = fetch_package(args['--version'], args['--edition'], args['--platform'],
+                                sha256=args['--sha256'],
+                                source=args['--source'],
+                                cache_dir=args['--cache-dir'])
+    except PackageCacheError as err:
+        print('### %s' % err)
+        raise SystemExit(1)
+    print(json.dumps(package, sort_keys=True))
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
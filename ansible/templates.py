@@ -1,65 +1,326 @@
 #!/usr/bin/env python
 
 
-couchbase_setup_ansible_command = '''
----
-# 
-# Set up Couchbase cluster from a single command
+COUCHBASE_JOIN_NODES_SHELL_SCRIPT = r'''#!/bin/bash
+#
+# Adds {{ nodes|length }} node(s) to the cluster in parallel, then runs a single rebalance.
 #
-     
-- name: Initialize the cluster and add the nodes to the cluster
-  hosts: couchbase-main
-  user: root 
-
-  tasks:
-  - name: Configure main node
-    shell: /opt/couchbase/bin/couchbase-cli cluster-init -c 127.0.0.1:8091  --cluster-init-username={{cluster_spec.admin_username}} --cluster-init-password={{cluster_spec.admin_password}} --cluster-init-port=8091 --cluster-init-ramsize={{cluster_spec.cluster_ram_quota}} 
 
-  - name: Create shell script for configuring main node
-    action: template src=couchbase-add-node.j2 dest=/tmp/addnodes.sh mode=750
-  
-  - name: Launch config script
-    action: shell /tmp/addnodes.sh
-  
-  - name: Rebalance the cluster
-    shell: /opt/couchbase/bin/couchbase-cli rebalance -c 127.0.0.1:8091 -u ${admin_user} -p ${admin_password}      
+CB_CLI=/opt/couchbase/bin/couchbase-cli
+CLUSTER=127.0.0.1:8091
+ADMIN_USER={{ cluster_spec.admin_username }}
+ADMIN_PASSWORD={{ cluster_spec.admin_password }}
+REBALANCE_TIMEOUT_SECS={{ rebalance_timeout_secs }}
+POLL_INTERVAL_SECS={{ poll_interval_secs }}
 
-{% for bucket in cluster_spec.buckets %}
-  - name: create bucket {{bucket.name}} with {{bucket.num_replicas}} replicas
-    shell: /opt/couchbase/bin/couchbase-cli bucket-create -c 127.0.0.1:8091 --bucket={{bucket.name}} --bucket-type={{bucket.type}} --bucket-port=11211 --bucket-ramsize={{bucket.ram_quota}}  --bucket-replica={{bucket.num_replicas}} -u {{cluster_spec.admin_user}} -p {{cluster_spec.admin_password}}
-{% endfor %}  
-
-'''
+script_start=$(date +%s)
+phase_start=$script_start
+pids=""
+{% for node in nodes %}
+$CB_CLI server-add -c $CLUSTER -u $ADMIN_USER -p $ADMIN_PASSWORD \
+--server-add={{ node.address }}:{{ node.port }} \
+--server-add-username=$ADMIN_USER --server-add-password=$ADMIN_PASSWORD \
+--services "{{ node.services }}" &
+pids="$pids $!"
+{% endfor %}
 
-COUCHBASE_ADD_NODE_SHELL_SCRIPT = '''
-/opt/couchbase/bin/couchbase-cli server-add -c 127.0.0.1:8091 -u ${admin_user} -p ${admin_password} \
---server-add={{ node_address }}:{{ node_port }} \
---server-add-username=${admin_user} --server-add-password=${admin_password} \
---services "data, index, query" 
+failed=0
+for pid in $pids; do
+    wait $pid || failed=$((failed + 1))
+done
+echo "phase server-add: {{ nodes|length }} node(s) in $(( $(date +%s) - phase_start ))s, $failed failed"
+if [ $failed -gt 0 ]; then
+    exit 1
+fi
 
+phase_start=$(date +%s)
+$CB_CLI rebalance -c $CLUSTER -u $ADMIN_USER -p $ADMIN_PASSWORD > /tmp/couchbase_rebalance.log 2>&1 &
+rebalance_pid=$!
+while kill -0 $rebalance_pid 2>/dev/null; do
+    elapsed=$(( $(date +%s) - phase_start ))
+    if [ $elapsed -ge $REBALANCE_TIMEOUT_SECS ]; then
+        echo "phase rebalance: timed out after ${elapsed}s, stopping rebalance"
+        $CB_CLI rebalance-stop -c $CLUSTER -u $ADMIN_USER -p $ADMIN_PASSWORD
+        kill $rebalance_pid 2>/dev/null
+        exit 1
+    fi
+    echo "phase rebalance: ${elapsed}s elapsed, $($CB_CLI rebalance-status -c $CLUSTER -u $ADMIN_USER -p $ADMIN_PASSWORD | tr '\n' ' ')"
+    sleep $POLL_INTERVAL_SECS
+done
+wait $rebalance_pid
+rebalance_status=$?
+echo "phase rebalance: finished in $(( $(date +%s) - phase_start ))s with status $rebalance_status"
+echo "total: $(( $(date +%s) - script_start ))s"
+exit $rebalance_status
 '''
 
-COUCHBASE_BUCKETS_ONLY_SHELL_SCRIPT = '''
-{% for bucket in cluster_spec.buckets %}
-/opt/couchbase/bin/couchbase-cli bucket-create -c 127.0.0.1:8091 \
+COUCHBASE_BUCKET_CREATE_COMMAND = '''/opt/couchbase/bin/couchbase-cli bucket-create -c 127.0.0.1:8091 \
 --bucket={{bucket.name}} \
 --bucket-type={{bucket.type}} \
 --bucket-ramsize={{bucket.ram_quota}}  \
 --bucket-replica={{bucket.num_replicas}} \
+{% if bucket.eviction_policy %}--bucket-eviction-policy={{bucket.eviction_policy}} {% endif %}\
+{% if bucket.compression_mode %}--compression-mode={{bucket.compression_mode}} {% endif %}\
+{% if bucket.max_ttl %}--max-ttl={{bucket.max_ttl}} {% endif %}\
+{% if bucket.io_priority %}--bucket-priority={{bucket.io_priority}} {% endif %}\
+{% if bucket.db_fragmentation_pct %}--database-fragmentation-threshold-percentage={{bucket.db_fragmentation_pct}} {% endif %}\
+{% if bucket.view_fragmentation_pct %}--view-fragmentation-threshold-percentage={{bucket.view_fragmentation_pct}} {% endif %}\
+{% if bucket.compaction_window_start %}--from-hour={{bucket.compaction_window_start.split(':')[0]|int}} \
+--from-minute={{bucket.compaction_window_start.split(':')[1]|int}} \
+--to-hour={{bucket.compaction_window_end.split(':')[0]|int}} \
+--to-minute={{bucket.compaction_window_end.split(':')[1]|int}} \
+{% if bucket.abort_outside_window %}--abort-outside=1 {% endif %}{% endif %}\
 -u {{cluster_spec.admin_username}} -p {{cluster_spec.admin_password}} \
---wait
+--wait'''
+
+COUCHBASE_CLUSTER_INIT_COMMAND = '''/opt/couchbase/bin/couchbase-cli cluster-init -c 127.0.0.1:8091  \
+--cluster-username={{cluster_spec.admin_username}} \
+--cluster-password={{cluster_spec.admin_password}} \
+--cluster-port=8091 \
+--cluster-ramsize={{cluster_spec.cluster_ram_quota}} \
+{% if cluster_spec.index_ram_quota %}--cluster-index-ramsize={{cluster_spec.index_ram_quota}} \
+{% endif %}{% if cluster_spec.fts_ram_quota %}--cluster-fts-ramsize={{cluster_spec.fts_ram_quota}} \
+{% endif %}--services "{{cluster_spec.init_services}}"'''
+
+# servers before 7.1 only take compaction settings cluster-wide
+COUCHBASE_SETTING_COMPACTION_COMMAND = '''/opt/couchbase/bin/couchbase-cli setting-compaction -c 127.0.0.1:8091 \
+{% set compaction = cluster_spec.compaction %}\
+{% if compaction.db_fragmentation_pct %}--compaction-db-percentage={{compaction.db_fragmentation_pct}} {% endif %}\
+{% if compaction.view_fragmentation_pct %}--compaction-view-percentage={{compaction.view_fragmentation_pct}} {% endif %}\
+{% if compaction.compaction_window_start %}--compaction-period-from={{compaction.compaction_window_start}} \
+--compaction-period-to={{compaction.compaction_window_end}} \
+--enable-compaction-abort={{1 if compaction.abort_outside_window else 0}} {% endif %}\
+-u {{cluster_spec.admin_username}} -p {{cluster_spec.admin_password}}'''
+
+COUCHBASE_BUCKETS_ONLY_SHELL_SCRIPT = '''
+{% if cluster_spec.compaction %}
+''' + COUCHBASE_SETTING_COMPACTION_COMMAND + '''
+{% endif %}
+{% for bucket in cluster_spec.buckets %}
+''' + COUCHBASE_BUCKET_CREATE_COMMAND + '''
 {% endfor %}
 '''
 
 COUCHBASE_SETUP_SHELL_SCRIPT = '''
 #!/bin/bash
 
-/opt/couchbase/bin/couchbase-cli cluster-init -c 127.0.0.1:8091  \
---cluster-username={{cluster_spec.admin_username}} \
---cluster-password={{cluster_spec.admin_password}} \
---cluster-port=8091 \
---cluster-ramsize={{cluster_spec.cluster_ram_quota}} \
---services "data, index, query"
-%s
-''' % COUCHBASE_BUCKETS_ONLY_SHELL_SCRIPT
+''' + COUCHBASE_CLUSTER_INIT_COMMAND + '''
+''' + COUCHBASE_BUCKETS_ONLY_SHELL_SCRIPT
+
+
+# Playbooks generated by "mkcluster save ... as playbook". Values that end up in
+# YAML are emitted as JSON strings, which YAML reads verbatim.
+
+ANSIBLE_CFG_TEMPLATE = '''# Generated by mkcluster for project {{ project_name }}.
+[defaults]
+inventory = {{ inventory }}
+forks = {{ forks }}
+host_key_checking = False
+retry_files_enabled = False
+gathering = smart
+fact_caching = jsonfile
+fact_caching_connection = {{ fact_cache_dir }}
+fact_caching_timeout = {{ fact_cache_timeout_secs }}
+callback_whitelist = profile_tasks
+
+[ssh_connection]
+pipelining = True
+ssh_args = -o ControlMaster=auto -o ControlPersist={{ control_persist }} -o PreferredAuthentications=publickey
+control_path = %(directory)s/%%h-%%p-%%r
+'''
+
+COUCHBASE_HOST_TUNING_PLAY = '''
+- name: Tune the Couchbase hosts before the server is installed
+  hosts: couchbase
+  user: root
+  gather_facts: no
+  roles:
+    - {{ tuning_role }}
+'''
+
+COUCHBASE_INSTALL_PLAYS = '''
+- name: Fetch the Couchbase package once into the controller cache
+  hosts: localhost
+  connection: local
+  gather_facts: no
+
+  tasks:
+  - name: fetch and verify Couchbase {{ cluster_spec.couchbase_edition }} {{ cluster_spec.couchbase_version }}
+    command: "{% raw %}{{ playbook_dir }}{% endraw %}/pkgcache.py fetch --version={{ cluster_spec.couchbase_version }} --edition={{ cluster_spec.couchbase_edition }}"
+{% raw %}
+    register: package_fetch
+    changed_when: (package_fetch.stdout | from_json).fetched
+
+  - name: remember the cached package
+    set_fact:
+      couchbase_package: "{{ package_fetch.stdout | from_json }}"
+
+- name: Push the cached package to the Couchbase hosts and install it
+  hosts: couchbase
+  user: root
+  gather_facts: no
+  strategy: free
+  vars:
+    package: "{{ hostvars['localhost']['couchbase_package'] }}"
+
+  tasks:
+  - name: check for a copy of the package already on the host
+    stat: path=/tmp/{{ package.filename }} checksum_algorithm=sha256
+    register: remote_package
+
+  - name: push the package from the controller cache
+    copy: src={{ package.path }} dest=/tmp/{{ package.filename }}
+    when: not remote_package.stat.exists or remote_package.stat.checksum != package.sha256
+
+  - name: install the Couchbase package
+    apt: deb=/tmp/{{ package.filename }}
+{% endraw %}
+'''
+
+COUCHBASE_JOIN_NODES_TASKS = '''
+  - name: Create shell script for joining the nodes
+    template: src=couchbase-add-node.j2 dest=/tmp/addnodes.sh mode=750
 
+  - name: Add all nodes in parallel and rebalance once
+    shell: /tmp/addnodes.sh
+    register: join_result
+
+  - name: Report node join timings
+    debug: var=join_result.stdout_lines
+'''
+
+COUCHBASE_BUCKET_TASKS = '''
+{% if cluster_spec.compaction %}
+  - name: apply the cluster-wide compaction settings
+    shell: {% filter tojson %}''' + COUCHBASE_SETTING_COMPACTION_COMMAND + '''{% endfilter %}
+
+{% endif %}
+{% for bucket in cluster_spec.buckets %}
+  - name: create bucket {{bucket.name}} with {{bucket.num_replicas}} replicas
+    shell: {% filter tojson %}''' + COUCHBASE_BUCKET_CREATE_COMMAND + '''{% endfilter %}
+
+{% endfor %}'''
+
+COUCHBASE_MAIN_PLAY_HEADER = '''
+- name: Configure Couchbase cluster for {{ project_name }}
+  hosts: couchbase-main
+  user: root
+  gather_facts: no
+  vars:
+    admin_user: {{ cluster_spec.admin_username | tojson }}
+    admin_password: {{ cluster_spec.admin_password | tojson }}
+    rebalance_timeout_secs: {{ rebalance_timeout_secs }}
+    rebalance_poll_interval_secs: {{ poll_interval_secs }}
+{% if nodes %}
+    couchbase_nodes: {{ nodes | tojson }}
+{% endif %}
+
+  tasks:'''
+
+COUCHBASE_CLUSTER_PLAYBOOK = '''---
+#
+# Set up the Couchbase cluster for project {{ project_name }} (generated by mkcluster)
+#
+''' + COUCHBASE_HOST_TUNING_PLAY + COUCHBASE_INSTALL_PLAYS + COUCHBASE_MAIN_PLAY_HEADER + '''
+  - name: Configure main node
+    shell: {% filter tojson %}''' + COUCHBASE_CLUSTER_INIT_COMMAND + '''{% endfilter %}
+''' + COUCHBASE_JOIN_NODES_TASKS + COUCHBASE_BUCKET_TASKS
+
+COUCHBASE_NODES_PLAYBOOK = '''---
+#
+# Join the Couchbase nodes for project {{ project_name }} (generated by mkcluster)
+#
+''' + COUCHBASE_MAIN_PLAY_HEADER + COUCHBASE_JOIN_NODES_TASKS
+
+COUCHBASE_BUCKETS_PLAYBOOK = '''---
+#
+# Create the Couchbase buckets for project {{ project_name }} (generated by mkcluster)
+#
+''' + COUCHBASE_MAIN_PLAY_HEADER + COUCHBASE_BUCKET_TASKS
+
+
+ELASTICSEARCH_TUNING_PLAYBOOK = '''---
+#
+# Tune the Elasticsearch nodes for project {{ project_name }} (generated by mkelastic)
+#
+
+- name: Apply host tuning and JVM settings to the Elasticsearch nodes
+  hosts: elasticsearch
+  user: root
+  gather_facts: no
+  roles:
+    - {{ tuning_role }}
+
+  tasks:
+  - name: set the initial heap to {{ heap_mb }} MB
+    lineinfile: dest=/etc/elasticsearch/jvm.options regexp='^-Xms' line='-Xms{{ heap_mb }}m'
+    notify: restart elasticsearch
+
+  - name: set the maximum heap to {{ heap_mb }} MB
+    lineinfile: dest=/etc/elasticsearch/jvm.options regexp='^-Xmx' line='-Xmx{{ heap_mb }}m'
+    notify: restart elasticsearch
+
+  - name: lock the heap in memory
+    lineinfile:
+      dest: /etc/elasticsearch/elasticsearch.yml
+      regexp: '^bootstrap.memory_lock'
+      line: 'bootstrap.memory_lock: true'
+    notify: restart elasticsearch
+
+  - name: allow the service to lock memory (init script)
+    lineinfile: dest=/etc/default/elasticsearch regexp='^MAX_LOCKED_MEMORY' line='MAX_LOCKED_MEMORY=unlimited' create=yes
+    notify: restart elasticsearch
+
+  - name: create the systemd drop-in directory
+    file: path=/etc/systemd/system/elasticsearch.service.d state=directory
+
+  - name: allow the service to lock memory (systemd)
+    copy:
+      dest: /etc/systemd/system/elasticsearch.service.d/memlock.conf
+      content: "[Service]\\nLimitMEMLOCK=infinity\\n"
+    notify: restart elasticsearch
+
+  handlers:
+  - name: restart elasticsearch
+    service: name=elasticsearch state=restarted
+'''
+
+ELASTICSEARCH_BULK_LOAD_SCRIPT = r'''#!/bin/bash
+#
+# Manages index {{ plan.name }} for bulk loads (generated by mkelastic).
+#
+#   template: install the index template, before the index is first created
+#   begin: disable refresh, drop replicas, make translog fsyncs asynchronous
+#   end:   restore the steady-state settings, refresh, and wait for the replicas
+#
+
+ES_URL=${ES_URL:-{{ es_url }}}
+INDEX={{ plan.name }}
+
+put_settings() {
+    curl -sS -f -XPUT "$ES_URL/$INDEX/_settings" -H 'Content-Type: application/json' -d "$1" || exit 1
+    echo
+}
+
+case "$1" in
+    template)
+        curl -sS -f -XPUT "$ES_URL/_template/$INDEX" -H 'Content-Type: application/json' \
+            -d @"$(dirname "$0")/{{ template_filename }}" || exit 1
+        echo
+        ;;
+    begin)
+        put_settings '{{ bulk_settings | tojson }}'
+        ;;
+    end)
+        put_settings '{{ restore_settings | tojson }}'
+        curl -sS -f -XPOST "$ES_URL/$INDEX/_refresh" || exit 1
+        echo
+        curl -sS -f "$ES_URL/_cluster/health/$INDEX?wait_for_status=green&timeout={{ restore_timeout }}" || exit 1
+        echo
+        ;;
+    *)
+        echo "usage: $0 (template | begin | end)"
+        exit 1
+        ;;
+esac
+'''
@@ -0,0 +1 @@
+../terraform/templating.py
\ No newline at end of file
@@ -0,0 +1,50 @@
+import hashlib
+import pytest
+import pkgcache
+
+
+PACKAGE_DATA = b'couchbase server package'
+PACKAGE_SHA256 = hashlib.sha256(PACKAGE_DATA).hexdigest()
+
+
+def local_source(tmp_path, data=PACKAGE_DATA):
+    source = tmp_path / 'couchbase-server.deb'
+    source.write_bytes(data)
+    return str(source)
+
+
+def fetch(tmp_path, source, sha256=PACKAGE_SHA256):
+    return pkgcache.fetch_package('4.5.0', sha256=sha256, source=source, cache_dir=str(tmp_path / 'cache'))
+
+
+def test_fetch_copies_the_package_into_the_cache(tmp_path):
+    package = fetch(tmp_path, local_source(tmp_path))
+
+    assert package['fetched']
+    assert package['filename'] == pkgcache.package_filename('4.5.0')
+    assert pkgcache.file_sha256(package['path']) == PACKAGE_SHA256
+
+
+def test_cached_package_is_not_fetched_again(tmp_path):
+    source = local_source(tmp_path)
+    fetch(tmp_path, source)
+
+    # the recorded checksum is enough on a re-run
+    package = fetch(tmp_path, source, sha256=None)
+
+    assert not package['fetched']
+    assert package['sha256'] == PACKAGE_SHA256
+
+
+def test_checksum_mismatch_leaves_nothing_in_the_cache(tmp_path):
+    source = local_source(tmp_path, b'truncated')
+
+    with pytest.raises(pkgcache.PackageCacheError, match='checksum mismatch'):
+        fetch(tmp_path, source)
+    assert not (tmp_path / 'cache' / pkgcache.package_filename('4.5.0')).exists()
+
+
+def test_missing_source_is_reported_like_a_failed_fetch(tmp_path):
+    with pytest.raises(pkgcache.PackageCacheError, match='cannot open'):
+        fetch(tmp_path, str(tmp_path / 'missing.deb'))
+    assert list((tmp_path / 'cache').iterdir()) == []
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    tfinventory.py --list
+    tfinventory.py --host <hostname>
+
+Ansible dynamic inventory built from the Terraform state. The EC2 instances are
+grouped by resource name (the first couchbase_cluster instance is couchbase-main,
+the rest are couchbase-nodes; elasticsearch_cluster instances are elasticsearch;
+the Redis primary and replicas are redis-primary and redis-replicas) and by a
+comma-separated "Groups" tag, if present.
+
+The parsed inventory is cached together with the hash of the state file it came
+from, so the state is only re-read after Terraform has changed it. Set TF_STATE
+and TF_INVENTORY_CACHE to override the state and cache file locations.
+'''
+
+
+import os
+import sys
+import json
+import artifacts
+import tfstate
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STATE_FILE = os.path.join(SCRIPT_DIR, '..', 'terraform', 'terraform.tfstate')
+DEFAULT_CACHE_FILE = os.path.join(SCRIPT_DIR, '.tfinventory_cache.json')
+
+# aws_instance name -> (group of the first instance, group of the others)
+INSTANCE_GROUPS = {
+    'couchbase_cluster': ('couchbase-main', 'couchbase-nodes'),
+    'elasticsearch_cluster': ('elasticsearch', 'elasticsearch'),
+    'postgres': ('postgres', 'postgres'),
+    'redis_primary': ('redis-primary', 'redis-primary'),
+    'redis_replica': ('redis-replicas', 'redis-replicas')
+}
+
+PARENT_GROUPS = {
+    'couchbase': ['couchbase-main', 'couchbase-nodes'],
+    'redis': ['redis-primary', 'redis-replicas']
+}
+
+GROUPS_TAG = 'Groups'
+
+
+def tagged_groups(instance):
+    return [g.strip() for g in instance.tags.get(GROUPS_TAG, '').split(',') if g.strip()]
+
+
+def instance_groups(instance):
+    groups = []
+    if instance.name in INSTANCE_GROUPS:
+        first_group, other_group = INSTANCE_GROUPS[instance.name]
+        groups.append(first_group if instance.index == 0 else other_group)
+    groups.extend(tagged_groups(instance))
+    return groups
+
+
+def build_inventory(state):
+    inventory = {'_meta': {'hostvars': {}}}
+    for instance in sorted(tfstate.state_instances(state), key=lambda i: (i.name, i.index)):
+        if instance.resource_type != 'aws_instance':
+            continue
+        groups = instance_groups(instance)
+        if not groups:
+            continue
+
+        hostname = instance.tags.get('Name') or '%s_%d' % (instance.name, instance.index)
+        address = instance.public_ip or instance.private_ip
+        hostvars = {'private_ip': instance.private_ip,
+                    'terraform_resource': 'aws_instance.%s.%d' % (instance.name, instance.index)}
+        if address:
+            hostvars['ansible_host'] = address
+        inventory['_meta']['hostvars'][hostname] = hostvars
+
+        for group in groups:
+            inventory.setdefault(group, {'hosts': []})['hosts'].append(hostname)
+
+    for parent, children in PARENT_GROUPS.items():
+        present = [c for c in children if c in inventory]
+        if present:
+            inventory[parent] = {'children': present}
+    return inventory
+
+
+def load_inventory(state_file, cache_file):
+    '''Returns the inventory for <state_file>, from <cache_file> if the state is unchanged.'''
+
+    state_hash = artifacts.file_hash(state_file)
+    if state_hash is None:
+        return {'_meta': {'hostvars': {}}}
+
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+            if cache.get('state_hash') == state_hash:
+                return cache['inventory']
+        except (ValueError, KeyError):
+            pass
+
+    inventory = build_inventory(tfstate.load_json(state_file))
+    artifacts.atomic_write(cache_file, json.dumps({'state_hash': state_hash, 'inventory': inventory}))
+    return inventory
+
+
+def main(args):
+    state_file = os.environ.get('TF_STATE', DEFAULT_STATE_FILE)
+    cache_file = os.environ.get('TF_INVENTORY_CACHE', DEFAULT_CACHE_FILE)
+    try:
+        inventory = load_inventory(state_file, cache_file)
+    except tfstate.TerraformStateError as err:
+        # stdout belongs to Ansible, which expects JSON there
+        print('### cannot build the inventory: %s' % err, file=sys.stderr)
+        raise SystemExit(1)
+
+    if args['--list']:
+        print(json.dumps(inventory, indent=2, sort_keys=True))
+    else:
+        print(json.dumps(inventory['_meta']['hostvars'].get(args['<hostname>'], {})))
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -0,0 +1 @@
+../terraform/tfparse.py
\ No newline at end of file
@@ -0,0 +1 @@
+../terraform/tfstate.py
\ No newline at end of file
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    artifacts.py status [--manifest=<manifest_file>]
+
+Options:
+    --manifest=<manifest_file>  manifest of generated artifacts [default: artifact_manifest.json]
+
+Content-hashed writing of generated artifacts. A file is only rewritten (atomically)
+when its rendered content differs from what is on disk, so unchanged artifacts keep
+their mtimes and Make can skip the stages that depend on them. Every write records
+the content hash in a manifest; "status" reports artifacts that have since changed.
+'''
+
+
+import os
+import json
+import hashlib
+import tempfile
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+
+
+MANIFEST_FILENAME = 'artifact_manifest.json'
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(filename):
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as f:
+        return content_hash(f.read())
+
+
+def default_file_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def atomic_write(filename, data, mode=None):
+    '''Writes <data> to a temporary file next to <filename> and renames it into place,
+    so readers never observe a partially written artifact.
+    '''
+
+    target_dir = os.path.dirname(os.path.abspath(filename))
+    if mode is None:
+        mode = os.stat(filename).st_mode & 0o777 if os.path.isfile(filename) else default_file_mode()
+    fd, tmp_filename = tempfile.mkstemp(dir=target_dir, prefix='.%s.' % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.chmod(tmp_filename, mode)
+        os.replace(tmp_filename, filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def load_manifest(manifest_file=MANIFEST_FILENAME):
+    if not os.path.isfile(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def record_hash(filename, digest, manifest_file=MANIFEST_FILENAME):
+    '''Records <digest> for <filename> in the manifest; the manifest itself is only
+    rewritten when the recorded hash actually changes.
+    '''
+
+    manifest = load_manifest(manifest_file)
+    key = os.path.normpath(filename)
+    if manifest.get(key) == digest:
+        return
+    manifest[key] = digest
+    atomic_write(manifest_file, json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+
+
+def write_artifact(filename, data, manifest_file=MANIFEST_FILENAME, mode=None):
+    '''Writes rendered <data> to <filename> only if its content hash differs from the
+    file on disk. Returns True if the file was (re)written, False if it was unchanged.
+    '''
+
+    digest = content_hash(data)
+    changed = file_hash(filename) != digest
+    if changed:
+        atomic_write(filename, data, mode)
+    elif mode is not None and os.stat(filename).st_mode & 0o777 != mode:
+        os.chmod(filename, mode)
+    record_hash(filename, digest, manifest_file)
+    return changed
+
+
+def main(args):
+    manifest = load_manifest(args['--manifest'])
+    if not manifest:
+        print('No artifacts recorded in %s.' % args['--manifest'])
+        return
+
+    num_changed = 0
+    for filename, digest in sorted(manifest.items()):
+        current = file_hash(filename)
+        if current == digest:
+            status = 'unchanged'
+        else:
+            status = 'missing' if current is None else 'modified'
+            num_changed += 1
+        print('  %-10s %s' % (status, filename))
+
+    if num_changed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+'''Firehose delivery settings derived from the target delivery latency and the
+expected throughput.
+
+Firehose flushes a batch once either its buffer size or its buffer interval is
+reached. The interval is set to the latency target, within the limits Firehose
+accepts, and the size to what the stream carries in that interval, so at peak
+every flush is a full batch and off-peak data still arrives on time. Elasticsearch
+batches are capped further: bulk requests beyond ~15 MB stop getting faster and
+put pressure on the data node heap.
+'''
+
+
+import math
+from collections import namedtuple
+
+
+MIN_BUFFER_INTERVAL_SECS = 60
+MAX_BUFFER_INTERVAL_SECS = 900
+MIN_BUFFER_SIZE_MB = 1
+MAX_BUFFER_SIZE_MB = {'s3': 128, 'elasticsearch': 100}
+MAX_BULK_REQUEST_MB = 15
+
+# batches below this size gain little from compression and are cheaper to read plain
+GZIP_MIN_BATCH_MB = 1
+
+# Elasticsearch retries should ride out a node restart and a few latency targets
+DEFAULT_RETRY_DURATION_SECS = 300
+RETRY_LATENCY_MULTIPLE = 5
+MAX_RETRY_DURATION_SECS = 7200
+
+DESTINATIONS = ['s3', 'elasticsearch']
+
+
+DeliverySettings = namedtuple('DeliverySettings', 'buffer_size_mb buffer_interval_secs compression '
+                                                  'retry_duration_secs warnings')
+
+
+class UnknownDestination(Exception):
+    def __init__(self, destination):
+        Exception.__init__(self, 'unknown Firehose destination "%s" (known: %s).'
+                           % (destination, ', '.join(DESTINATIONS)))
+
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def plan_delivery(destination, target_latency_secs, throughput_mb_per_sec):
+    if destination not in DESTINATIONS:
+        raise UnknownDestination(destination)
+    if target_latency_secs <= 0 or throughput_mb_per_sec < 0:
+        raise ValueError('target latency must be positive and throughput non-negative.')
+
+    warnings = []
+    if target_latency_secs < MIN_BUFFER_INTERVAL_SECS:
+        warnings.append('Firehose buffers for at least %d seconds; off-peak deliveries lag up to that long.'
+                        % MIN_BUFFER_INTERVAL_SECS)
+    interval = int(clamp(target_latency_secs, MIN_BUFFER_INTERVAL_SECS, MAX_BUFFER_INTERVAL_SECS))
+
+    max_size = MAX_BUFFER_SIZE_MB[destination]
+    if destination == 'elasticsearch':
+        max_size = min(max_size, MAX_BULK_REQUEST_MB)
+    batch_mb = throughput_mb_per_sec * interval
+    buffer_size = int(clamp(int(math.ceil(batch_mb)), MIN_BUFFER_SIZE_MB, max_size))
+
+    if destination == 's3':
+        compression = 'GZIP' if batch_mb >= GZIP_MIN_BATCH_MB else 'UNCOMPRESSED'
+        retry_duration = None
+    else:
+        # Firehose does not compress what it indexes
+        compression = None
+        retry_duration = int(clamp(target_latency_secs * RETRY_LATENCY_MULTIPLE,
+                                   DEFAULT_RETRY_DURATION_SECS, MAX_RETRY_DURATION_SECS))
+
+    return DeliverySettings(buffer_size_mb=buffer_size,
+                            buffer_interval_secs=interval,
+                            compression=compression,
+                            retry_duration_secs=retry_duration,
+                            warnings=warnings)
+
+
+def role_policy(stream_arns, bucket_arn, domain_arn=None):
+    '''The IAM policy document that lets Firehose read the source streams, write
+    batches and failed documents to the bucket and index into the domain.
+    '''
+
+    statements = [
+        {
+            'Effect': 'Allow',
+            'Action': ['kinesis:DescribeStream', 'kinesis:GetShardIterator', 'kinesis:GetRecords',
+                       'kinesis:ListShards'],
+            'Resource': stream_arns
+        },
+        {
+            'Effect': 'Allow',
+            'Action': ['s3:AbortMultipartUpload', 's3:GetBucketLocation', 's3:GetObject', 's3:ListBucket',
+                       's3:ListBucketMultipartUploads', 's3:PutObject'],
+            'Resource': [bucket_arn, bucket_arn + '/*']
+        }
+    ]
+    if domain_arn:
+        statements.append({
+            'Effect': 'Allow',
+            'Action': ['es:DescribeElasticsearchDomain', 'es:DescribeElasticsearchDomains',
+                       'es:DescribeElasticsearchDomainConfig', 'es:ESHttpPost', 'es:ESHttpPut', 'es:ESHttpGet'],
+            'Resource': [domain_arn, domain_arn + '/*']
+        })
+    return {'Version': '2012-10-17', 'Statement': statements}
+
+
+def assume_role_policy():
+    return {
+        'Version': '2012-10-17',
+        'Statement': [{
+            'Action': 'sts:AssumeRole',
+            'Principal': {'Service': 'firehose.amazonaws.com'},
+            'Effect': 'Allow',
+            'Sid': ''
+        }]
+    }
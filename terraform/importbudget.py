@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    importbudget.py [--budget-ms=<ms>] <script>...
+
+Options:
+    --budget-ms=<ms>    maximum cumulative import time per script, in milliseconds [default: 50]
+
+Measures the startup import cost of each generator script with python -X importtime
+and exits non-zero if any of them goes over budget.
+'''
+
+
+import os
+import sys
+import subprocess
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+
+
+def measure_import_us(script_path):
+    '''Returns the cumulative import time of <script_path>, in microseconds, as
+    reported by python -X importtime in a fresh interpreter.
+    '''
+
+    script_dir, script_file = os.path.split(os.path.abspath(script_path))
+    module_name = os.path.splitext(script_file)[0]
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module_name],
+                            cwd=script_dir,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+
+    # lines have the form "import time: <self us> | <cumulative us> | <module>"
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module_name:
+            return int(fields[1])
+
+    raise Exception('no import timing reported for module %s.' % module_name)
+
+
+def main(args):
+    budget_us = int(args['--budget-ms']) * 1000
+    over_budget = []
+    for script in args['<script>']:
+        import_us = measure_import_us(script)
+        status = 'ok' if import_us <= budget_us else 'OVER BUDGET'
+        print('  %-30s %8.1f ms   %s' % (script, import_us / 1000.0, status))
+        if import_us > budget_us:
+            over_budget.append(script)
+
+    if over_budget:
+        print('\n### %d script(s) exceed the %s ms startup budget.' % (len(over_budget), args['--budget-ms']))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+'''EC2 instance type catalog used by the sizing and capacity generators.'''
+
+
+from collections import namedtuple
+
+
+InstanceType = namedtuple('InstanceType', 'name vcpus memory_gib')
+
+
+INSTANCE_TYPES = {i.name: i for i in [
+    InstanceType('t1.micro', 1, 0.613),
+    InstanceType('t2.micro', 1, 1),
+    InstanceType('t2.small', 1, 2),
+    InstanceType('t2.medium', 2, 4),
+    InstanceType('t2.large', 2, 8),
+    InstanceType('t2.xlarge', 4, 16),
+    InstanceType('t2.2xlarge', 8, 32),
+    InstanceType('m1.small', 1, 1.7),
+    InstanceType('m1.medium', 1, 3.75),
+    InstanceType('m1.large', 2, 7.5),
+    InstanceType('m1.xlarge', 4, 15),
+    InstanceType('m3.medium', 1, 3.75),
+    InstanceType('m3.large', 2, 7.5),
+    InstanceType('m3.xlarge', 4, 15),
+    InstanceType('m3.2xlarge', 8, 30),
+    InstanceType('m4.large', 2, 8),
+    InstanceType('m4.xlarge', 4, 16),
+    InstanceType('m4.2xlarge', 8, 32),
+    InstanceType('m4.4xlarge', 16, 64),
+    InstanceType('m5.large', 2, 8),
+    InstanceType('m5.xlarge', 4, 16),
+    InstanceType('m5.2xlarge', 8, 32),
+    InstanceType('m5.4xlarge', 16, 64),
+    InstanceType('c3.large', 2, 3.75),
+    InstanceType('c3.xlarge', 4, 7.5),
+    InstanceType('c3.2xlarge', 8, 15),
+    InstanceType('c4.large', 2, 3.75),
+    InstanceType('c4.xlarge', 4, 7.5),
+    InstanceType('c4.2xlarge', 8, 15),
+    InstanceType('c5.large', 2, 4),
+    InstanceType('c5.xlarge', 4, 8),
+    InstanceType('c5.2xlarge', 8, 16),
+    InstanceType('r3.large', 2, 15.25),
+    InstanceType('r3.xlarge', 4, 30.5),
+    InstanceType('r3.2xlarge', 8, 61),
+    InstanceType('r4.large', 2, 15.25),
+    InstanceType('r4.xlarge', 4, 30.5),
+    InstanceType('r4.2xlarge', 8, 61),
+    InstanceType('r4.4xlarge', 16, 122),
+    InstanceType('r5.large', 2, 16),
+    InstanceType('r5.xlarge', 4, 32),
+    InstanceType('r5.2xlarge', 8, 64),
+    InstanceType('r5.4xlarge', 16, 128),
+    InstanceType('i3.large', 2, 15.25),
+    InstanceType('i3.xlarge', 4, 30.5),
+    InstanceType('i3.2xlarge', 8, 61)
+]}
+
+
+class UnknownInstanceType(Exception):
+    def __init__(self, type_name):
+        Exception.__init__(self, 'no sizing data for EC2 instance type "%s".' % type_name)
+
+
+def lookup(type_name):
+    instance_type = INSTANCE_TYPES.get(type_name)
+    if instance_type is None:
+        raise UnknownInstanceType(type_name)
+    return instance_type
+
+
+def memory_mb(type_name):
+    return int(lookup(type_name).memory_gib * 1024)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+'''Kinesis service limits and shard sizing helpers shared by the stream generators.'''
+
+
+import math
+import hashlib
+from collections import namedtuple
+
+
+# per-shard limits as published by AWS
+SHARD_WRITE_RECORDS_PER_SEC = 1000
+SHARD_WRITE_BYTES_PER_SEC = 1024 * 1024
+SHARD_READ_BYTES_PER_SEC = 2 * 1024 * 1024
+
+SHARD_GET_RECORDS_CALLS_PER_SEC = 5
+
+DEFAULT_HEADROOM_PCT = 25
+
+SHARD_LEVEL_METRICS = [
+    'IncomingBytes',
+    'IncomingRecords',
+    'OutgoingBytes',
+    'OutgoingRecords',
+    'WriteProvisionedThroughputExceeded',
+    'ReadProvisionedThroughputExceeded',
+    'IteratorAgeMilliseconds'
+]
+
+DEFAULT_SHARD_LEVEL_METRICS = [
+    'IncomingRecords',
+    'WriteProvisionedThroughputExceeded',
+    'ReadProvisionedThroughputExceeded',
+    'IteratorAgeMilliseconds'
+]
+
+# alarm when throttling exceeds this share of the stream's capacity over a period
+ALARM_PERIOD_SECS = 60
+THROTTLE_ALARM_FRACTION = 0.01
+# consumers more than this far behind are lagging, but never more than a
+# quarter of the retention period, by which point data loss is close
+ITERATOR_AGE_ALARM_MS = 5 * 60 * 1000
+ITERATOR_AGE_RETENTION_FRACTION = 0.25
+
+# beyond this many shared-throughput consumers the 5 GetRecords calls/sec per shard
+# become the bottleneck; further consumers should use enhanced fan-out
+MAX_SHARED_CONSUMERS = 2
+
+# KCL workers renew each lease they hold every third of the failover time,
+# checkpoint every shard they process and scan the whole lease table every other
+# failover period to pick up expired leases
+KCL_FAILOVER_TIME_SECS = 10
+KCL_CHECKPOINT_INTERVAL_SECS = 60
+KCL_LEASES_PER_WORKER = 10
+LEASE_TABLE_HEADROOM = 2
+MIN_LEASE_TABLE_CAPACITY = 5
+
+# partition keys are MD5-hashed into an unsigned 128-bit hash key space
+HASH_KEY_SPACE = 2 ** 128
+
+
+HashKeyRange = namedtuple('HashKeyRange', 'starting_hash_key ending_hash_key')
+ShardSizing = namedtuple('ShardSizing', 'shard_count write_records_util write_bytes_util read_bytes_util')
+LeaseTableCapacity = namedtuple('LeaseTableCapacity', 'read_capacity write_capacity')
+AlarmThresholds = namedtuple('AlarmThresholds', 'write_throttled_records read_throttled_calls iterator_age_ms '
+                                                'shard_write_throttled_records')
+
+
+def shard_utilization(shard_count, records_per_sec, avg_record_kb, num_consumers):
+    '''Returns the fraction of each per-shard limit a stream with <shard_count> shards
+    would use under the given load, as (write records, write bytes, read bytes).
+    Consumers without enhanced fan-out all share the per-shard read limit.
+    '''
+
+    bytes_per_sec = records_per_sec * avg_record_kb * 1024
+    per_shard_records = records_per_sec / shard_count
+    per_shard_bytes = bytes_per_sec / shard_count
+
+    return (per_shard_records / SHARD_WRITE_RECORDS_PER_SEC,
+            per_shard_bytes / SHARD_WRITE_BYTES_PER_SEC,
+            per_shard_bytes * max(num_consumers, 1) / SHARD_READ_BYTES_PER_SEC)
+
+
+def size_stream_shards(records_per_sec, avg_record_kb, num_consumers, headroom_pct=DEFAULT_HEADROOM_PCT):
+    '''Computes the number of shards needed to carry <records_per_sec> records of
+    <avg_record_kb> KB to <num_consumers> consumer apps, keeping every per-shard limit
+    at or below (100 - headroom_pct) percent utilization.
+    '''
+
+    if records_per_sec < 0 or avg_record_kb < 0 or num_consumers < 0:
+        raise ValueError('stream throughput figures must be non-negative.')
+    if not 0 <= headroom_pct < 100:
+        raise ValueError('headroom must be a percentage in the range [0, 100).')
+
+    max_util = 1 - headroom_pct / 100.0
+    required = max(shard_utilization(1, records_per_sec, avg_record_kb, num_consumers))
+    shard_count = max(1, int(math.ceil(round(required / max_util, 9))))
+
+    return ShardSizing(shard_count,
+                       *shard_utilization(shard_count, records_per_sec, avg_record_kb, num_consumers))
+
+
+def partition_key_hash(partition_key):
+    '''Maps a partition key to its hash key the same way Kinesis does.'''
+
+    return int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+
+
+def even_hash_ranges(shard_count):
+    '''Returns the hash key ranges Kinesis assigns to the shards of a newly created
+    stream with <shard_count> shards (an even split of the hash key space).
+    '''
+
+    if shard_count < 1:
+        raise ValueError('a stream must have at least one shard.')
+
+    starts = [i * HASH_KEY_SPACE // shard_count for i in range(shard_count)]
+    ends = [s - 1 for s in starts[1:]] + [HASH_KEY_SPACE - 1]
+    return [HashKeyRange(s, e) for s, e in zip(starts, ends)]
+
+
+def alarm_thresholds(shard_count, retention_hours):
+    '''Thresholds for the stream alarms, scaled to what <shard_count> shards can carry
+    in one ALARM_PERIOD_SECS period. Throttle counts are sums over the period.
+    '''
+
+    shard_write_records = SHARD_WRITE_RECORDS_PER_SEC * ALARM_PERIOD_SECS
+    shard_read_calls = SHARD_GET_RECORDS_CALLS_PER_SEC * ALARM_PERIOD_SECS
+    retention_ms = retention_hours * 3600 * 1000
+    return AlarmThresholds(write_throttled_records=int(math.ceil(shard_count * shard_write_records
+                                                                 * THROTTLE_ALARM_FRACTION)),
+                           read_throttled_calls=int(math.ceil(shard_count * shard_read_calls
+                                                              * THROTTLE_ALARM_FRACTION)),
+                           iterator_age_ms=int(min(ITERATOR_AGE_ALARM_MS,
+                                                   retention_ms * ITERATOR_AGE_RETENTION_FRACTION)),
+                           shard_write_throttled_records=int(math.ceil(shard_write_records
+                                                                       * THROTTLE_ALARM_FRACTION)))
+
+
+def initial_shard_ids(shard_count):
+    '''The shard IDs Kinesis assigns to the shards of a newly created stream.'''
+
+    return ['shardId-%012d' % i for i in range(shard_count)]
+
+
+def dashboard_widgets(stream_names, region, period=ALARM_PERIOD_SECS):
+    '''CloudWatch dashboard widgets with the throttling and consumer lag metrics of each stream.'''
+
+    widgets = []
+    for row, stream_name in enumerate(stream_names):
+        widgets.append({
+            'type': 'metric', 'x': 0, 'y': row * 6, 'width': 12, 'height': 6,
+            'properties': {
+                'title': '%s throttling' % stream_name,
+                'region': region,
+                'stat': 'Sum',
+                'period': period,
+                'metrics': [
+                    ['AWS/Kinesis', 'WriteProvisionedThroughputExceeded', 'StreamName', stream_name],
+                    ['AWS/Kinesis', 'ReadProvisionedThroughputExceeded', 'StreamName', stream_name]
+                ]
+            }
+        })
+        widgets.append({
+            'type': 'metric', 'x': 12, 'y': row * 6, 'width': 12, 'height': 6,
+            'properties': {
+                'title': '%s iterator age (ms)' % stream_name,
+                'region': region,
+                'stat': 'Maximum',
+                'period': period,
+                'metrics': [
+                    ['AWS/Kinesis', 'GetRecords.IteratorAgeMilliseconds', 'StreamName', stream_name]
+                ]
+            }
+        })
+    return widgets
+
+
+def lease_table_capacity(shard_count):
+    '''Provisioned capacity of the DynamoDB table a KCL application keeps its shard
+    leases and checkpoints in. Every shard has one lease item of well under 1 KB.
+    '''
+
+    writes_per_sec = shard_count * (3.0 / KCL_FAILOVER_TIME_SECS + 1.0 / KCL_CHECKPOINT_INTERVAL_SECS)
+    num_workers = max(1, int(math.ceil(shard_count / float(KCL_LEASES_PER_WORKER))))
+    # eventually consistent scans cost half a read unit per item
+    reads_per_sec = num_workers * shard_count * 0.5 / (2 * KCL_FAILOVER_TIME_SECS)
+    return LeaseTableCapacity(
+        read_capacity=max(MIN_LEASE_TABLE_CAPACITY, int(math.ceil(reads_per_sec * LEASE_TABLE_HEADROOM))),
+        write_capacity=max(MIN_LEASE_TABLE_CAPACITY, int(math.ceil(writes_per_sec * LEASE_TABLE_HEADROOM))))
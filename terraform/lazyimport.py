@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+'''Deferred module imports for the generator scripts.
+
+Importing snap pulls in its whole web stack, which dwarfs the actual work of a
+scripted or --help invocation. A LazyModule stands in for the real module and
+only imports it on first attribute access.
+'''
+
+
+import importlib
+
+
+class LazyModule(object):
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, name)
+
+
+
+def lazy_import(module_name):
+    return LazyModule(module_name)
@@ -22,9 +22,42 @@ resource "aws_key_pair" "instance_key" {
 }
 
 
+# Producers write keys under a leading hash partition (see the KeyLayout tag and
+# s3planner.object_key) to spread the PUT load over several prefixes; mkproject sizes
+# the partitions, acceleration and lifecycle rules from the expected object rate and size.
 resource "aws_s3_bucket" "ingest_bucket" {
   bucket = "${var.ingest_bucket_name}"
   acl = "authenticated-read"
+  acceleration_status = "${var.ingest_acceleration_status}"
+
+  tags {
+    KeyLayout = "${var.ingest_key_layout}"
+    KeyPrefixCount = "${var.ingest_key_prefix_count}"
+  }
+
+  lifecycle_rule {
+    id = "abort-incomplete-multipart-uploads"
+    enabled = true
+    abort_incomplete_multipart_upload_days = "${var.ingest_abort_multipart_days}"
+  }
+
+  lifecycle_rule {
+    id = "cold-ingest-to-infrequent-access"
+    enabled = "${var.ingest_ia_transition_enabled}"
+    transition {
+      days = "${var.ingest_ia_transition_days}"
+      storage_class = "STANDARD_IA"
+    }
+  }
+
+  lifecycle_rule {
+    id = "archive-ingest"
+    enabled = "${var.ingest_archive_enabled}"
+    transition {
+      days = "${var.ingest_archive_days}"
+      storage_class = "GLACIER"
+    }
+  }
 }
 
 /*
@@ -72,4 +105,143 @@ resource "aws_instance" "couchbase_cluster" {
     Name = "${var.couchbase_cluster_basename}_${count.index}"
   }
   key_name = "keypair_1"
-}
\ No newline at end of file
+}
+
+variable "postgres_cluster_basename" {
+	 default = "mx_postgres_apollo"
+}
+
+
+# Postgres settings and the pgbouncer pool come from the project vars mkproject
+# derives from the instance type and the expected writer concurrency. Writers
+# connect to pgbouncer on 6432, never to Postgres directly.
+resource "aws_instance" "postgres" {
+  count = "${var.postgres_cluster_size}"
+  ami = "${lookup(var.amis, "postgres")}"
+  instance_type = "${var.postgres_instance_type}"
+  tags {
+    Name = "${var.postgres_cluster_basename}_${count.index}"
+  }
+  key_name = "keypair_1"
+  user_data = <<EOF
+#!/bin/bash
+cat >> /opt/bitnami/postgresql/conf/postgresql.conf <<CONF
+shared_buffers = ${var.postgres_shared_buffers}
+effective_cache_size = ${var.postgres_effective_cache_size}
+work_mem = ${var.postgres_work_mem}
+maintenance_work_mem = ${var.postgres_maintenance_work_mem}
+max_wal_size = ${var.postgres_max_wal_size}
+min_wal_size = ${var.postgres_min_wal_size}
+checkpoint_completion_target = 0.9
+max_connections = ${var.postgres_max_connections}
+CONF
+/opt/bitnami/ctlscript.sh restart postgresql
+
+# the writers' role; Postgres stores the md5 hash as given
+POSTGRES_PASSWORD="$(sed -n "s/.* and '\(.*\)'\.$/\1/p" /home/bitnami/bitnami_credentials)"
+PGPASSWORD="$POSTGRES_PASSWORD" /opt/bitnami/postgresql/bin/psql -h 127.0.0.1 -U postgres \
+  -c "CREATE ROLE ${var.postgres_pipeline_role} LOGIN PASSWORD '${var.postgres_pipeline_password_md5}'"
+
+apt-get update && apt-get install -y pgbouncer
+cat > /etc/pgbouncer/userlist.txt <<USERS
+"${var.postgres_pipeline_role}" "${var.postgres_pipeline_password_md5}"
+USERS
+chown postgres:postgres /etc/pgbouncer/userlist.txt
+chmod 600 /etc/pgbouncer/userlist.txt
+cat > /etc/pgbouncer/pgbouncer.ini <<INI
+[databases]
+* = host=127.0.0.1 port=5432
+
+[pgbouncer]
+listen_addr = *
+listen_port = 6432
+auth_type = md5
+auth_file = /etc/pgbouncer/userlist.txt
+pool_mode = ${var.pgbouncer_pool_mode}
+max_client_conn = ${var.pgbouncer_max_client_conn}
+default_pool_size = ${var.pgbouncer_default_pool_size}
+reserve_pool_size = ${var.pgbouncer_reserve_pool_size}
+server_reset_query =
+stats_users = ${var.postgres_pipeline_role}
+INI
+sed -i 's/^START=0/START=1/' /etc/default/pgbouncer
+service pgbouncer restart
+EOF
+}
+
+variable "redis_cluster_basename" {
+	 default = "mx_redis_apollo"
+}
+
+
+# Read-through cache in front of the terminal datastores. maxmemory and the
+# eviction policy come from the project vars mkproject derives from the instance
+# type and the consumers' access pattern; replicas follow the primary. The primary
+# and its replicas share one password, replacing the one the AMI generates for
+# each instance, so replicas can authenticate to the primary.
+resource "aws_instance" "redis_primary" {
+  count = "${var.redis_primary_count}"
+  ami = "${lookup(var.amis, "redis")}"
+  instance_type = "${var.redis_instance_type}"
+  tags {
+    Name = "${var.redis_cluster_basename}_primary"
+  }
+  key_name = "keypair_1"
+  user_data = <<EOF
+#!/bin/bash
+cat >> /opt/bitnami/redis/etc/redis.conf <<CONF
+maxmemory ${var.redis_maxmemory}
+maxmemory-policy ${var.redis_maxmemory_policy}
+requirepass ${var.redis_password}
+masterauth ${var.redis_password}
+CONF
+/opt/bitnami/ctlscript.sh restart redis
+EOF
+}
+
+
+resource "aws_instance" "redis_replica" {
+  count = "${var.redis_replica_count}"
+  ami = "${lookup(var.amis, "redis")}"
+  instance_type = "${var.redis_instance_type}"
+  tags {
+    Name = "${var.redis_cluster_basename}_replica_${count.index}"
+  }
+  key_name = "keypair_1"
+  user_data = <<EOF
+#!/bin/bash
+cat >> /opt/bitnami/redis/etc/redis.conf <<CONF
+maxmemory ${var.redis_maxmemory}
+maxmemory-policy ${var.redis_maxmemory_policy}
+requirepass ${var.redis_password}
+masterauth ${var.redis_password}
+slaveof ${element(concat(aws_instance.redis_primary.*.private_ip, list("")), 0)} 6379
+slave-read-only yes
+CONF
+/opt/bitnami/ctlscript.sh restart redis
+EOF
+}
+
+output "couchbase_private_ips" {
+  value = ["${aws_instance.couchbase_cluster.*.private_ip}"]
+}
+
+
+output "elasticsearch_private_ips" {
+  value = ["${aws_instance.elasticsearch_cluster.*.private_ip}"]
+}
+
+
+output "postgres_private_ips" {
+  value = ["${aws_instance.postgres.*.private_ip}"]
+}
+
+
+output "redis_primary_private_ips" {
+  value = ["${aws_instance.redis_primary.*.private_ip}"]
+}
+
+
+output "redis_replica_private_ips" {
+  value = ["${aws_instance.redis_replica.*.private_ip}"]
+}
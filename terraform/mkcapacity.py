@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    mkcapacity.py --rate=<records_per_sec> [options]
+
+Options:
+    --record-kb=<kb>                average record size in KB [default: 1]
+    --consumers=<n>                 consumer apps reading each Kinesis stream [default: 1]
+    --records-per-object=<n>        records batched into each S3 ingest object [default: 1]
+    --cluster-config=<yaml_file>    Couchbase cluster config saved by "mkcluster save config"
+    --tf-dir=<dir>                  directory holding the generated .tf files [default: .]
+
+Estimates the sustainable throughput of each pipeline tier (initial, core, terminal)
+from the generated Terraform and cluster specs, then reports the end-to-end ceiling
+and the tier that limits it. Exits non-zero if the target rate exceeds the ceiling.
+'''
+
+
+import os
+import math
+from collections import namedtuple
+import kinesis
+import instances
+import s3planner
+import tfparse
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+yaml = lazy_import('yaml')
+
+
+# rough per-vCPU throughput of the datastores for ~1 KB records; these are
+# planning heuristics, not benchmarks, and should be tuned from observed load
+COUCHBASE_WRITES_PER_VCPU = 5000
+ELASTICSEARCH_DOCS_PER_VCPU = 2000
+ELASTICSEARCH_DEFAULT_REPLICAS = 1
+
+# per-document metadata Couchbase keeps in RAM alongside each value
+COUCHBASE_METADATA_BYTES = 56
+
+
+TierCapacity = namedtuple('TierCapacity', 'tier datastore units ceiling notes')
+
+
+class PipelineSpecs(object):
+    '''The generated pipeline settings the capacity model reads.'''
+
+    def __init__(self, tf_dir='.', cluster_config=None):
+        blocks = tfparse.parse_tf_dir(tf_dir)
+        self.variables = tfparse.variable_defaults(blocks)
+        self.streams = tfparse.resources_of_type(blocks, 'aws_kinesis_stream')
+        self.instance_types = self.variables.get('instance_types') or {}
+        self.cluster_config = cluster_config or {}
+
+
+    def cluster_size(self, datastore):
+        return int(self.variables.get('%s_cluster_size' % datastore) or 0)
+
+
+    def instance_type(self, datastore):
+        return instances.lookup(self.instance_types.get(datastore, 't1.micro'))
+
+
+
+def initial_tier_capacity(specs, record_kb, records_per_object):
+    if not specs.variables.get('ingest_bucket_name'):
+        return None
+    num_prefixes = int(specs.variables.get('ingest_key_prefix_count') or 1)
+    ceiling = s3planner.PUTS_PER_PREFIX_PER_SEC * num_prefixes * records_per_object
+    return TierCapacity('initial', 's3', '%d prefix(es)' % num_prefixes, ceiling,
+                        ['%d records per object' % records_per_object])
+
+
+def kinesis_tier_capacity(specs, record_kb, num_consumers):
+    '''Every stream is treated as a pipeline stage carrying the full record flow,
+    so the tier ceiling is that of the smallest stream.
+    '''
+
+    if not specs.streams:
+        return None
+
+    # the per-shard ceiling is whichever limit a shard hits first at this record size
+    per_shard = 1.0 / max(kinesis.shard_utilization(1, 1, record_kb, num_consumers))
+    smallest_name, smallest = min(specs.streams.items(), key=lambda item: int(item[1]['shard_count']))
+    shard_count = int(smallest['shard_count'])
+    notes = ['limited by stream %s' % smallest_name] if len(specs.streams) > 1 else []
+    return TierCapacity('core', 'kinesis', '%d shard(s)' % shard_count, per_shard * shard_count, notes)
+
+
+def couchbase_tier_capacity(specs, rate, record_kb):
+    num_nodes = specs.cluster_size('couchbase')
+    if not num_nodes:
+        return None
+
+    instance_type = specs.instance_type('couchbase')
+    buckets = specs.cluster_config.get('buckets', [])
+    num_replicas = max([int(b['num_replicas']) for b in buckets] or [1])
+    ceiling = num_nodes * instance_type.vcpus * COUCHBASE_WRITES_PER_VCPU / (1 + num_replicas)
+    notes = ['%d replica(s)' % num_replicas]
+
+    bucket_ram_mb = sum(int(b['ram_quota']) for b in buckets)
+    if bucket_ram_mb:
+        if bucket_ram_mb > instances.memory_mb(instance_type.name):
+            notes.append('bucket quotas (%d MB) exceed %s memory' % (bucket_ram_mb, instance_type.name))
+        bytes_per_sec = rate * (record_kb * 1024 + COUCHBASE_METADATA_BYTES) * (1 + num_replicas)
+        if bytes_per_sec:
+            fill_minutes = bucket_ram_mb * 1024 * 1024 * num_nodes / bytes_per_sec / 60
+            notes.append('bucket RAM full after %.1f min at target rate' % fill_minutes)
+
+    return TierCapacity('core', 'couchbase', '%d x %s' % (num_nodes, instance_type.name), ceiling, notes)
+
+
+def elasticsearch_tier_capacity(specs, record_kb):
+    num_nodes = specs.cluster_size('elasticsearch')
+    if not num_nodes:
+        return None
+
+    instance_type = specs.instance_type('elasticsearch')
+    ceiling = num_nodes * instance_type.vcpus * ELASTICSEARCH_DOCS_PER_VCPU \
+              / max(record_kb, 1) / (1 + ELASTICSEARCH_DEFAULT_REPLICAS)
+    return TierCapacity('terminal', 'elasticsearch', '%d x %s' % (num_nodes, instance_type.name), ceiling,
+                        ['%d replica(s)' % ELASTICSEARCH_DEFAULT_REPLICAS])
+
+
+def estimate_tiers(specs, rate, record_kb, num_consumers, records_per_object):
+    tiers = [initial_tier_capacity(specs, record_kb, records_per_object),
+             kinesis_tier_capacity(specs, record_kb, num_consumers),
+             couchbase_tier_capacity(specs, rate, record_kb),
+             elasticsearch_tier_capacity(specs, record_kb)]
+    return [t for t in tiers if t is not None]
+
+
+def main(args):
+    rate = float(args['--rate'])
+    record_kb = float(args['--record-kb'])
+
+    cluster_config = None
+    if args['--cluster-config']:
+        with open(args['--cluster-config'], 'r') as f:
+            cluster_config = yaml.safe_load(f)
+
+    specs = PipelineSpecs(args['--tf-dir'], cluster_config)
+    tiers = estimate_tiers(specs, rate, record_kb, int(args['--consumers']), int(args['--records-per-object']))
+    if not tiers:
+        print('### No pipeline tiers found in %s.' % os.path.abspath(args['--tf-dir']))
+        raise SystemExit(1)
+
+    print('\n____ Tier capacity at %d records/sec of %.1f KB:\n' % (rate, record_kb))
+    print('  %-9s %-14s %-20s %14s %8s' % ('tier', 'datastore', 'provisioned', 'ceiling rec/s', 'util'))
+    for t in tiers:
+        print('  %-9s %-14s %-20s %14d %7.1f%%   %s' % (t.tier, t.datastore, t.units, math.floor(t.ceiling),
+                                                      rate / t.ceiling * 100, '; '.join(t.notes)))
+
+    bottleneck = min(tiers, key=lambda t: t.ceiling)
+    print('\n  end-to-end ceiling: %d records/sec, limited by the %s tier (%s).'
+          % (math.floor(bottleneck.ceiling), bottleneck.tier, bottleneck.datastore))
+
+    if rate > bottleneck.ceiling:
+        print('\n### Target rate exceeds the pipeline ceiling by %.1f%%.' % ((rate / bottleneck.ceiling - 1) * 100))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -2,21 +2,28 @@
 
 '''
 Usage:     
-    mkcreds.py -t (ssh | aws) --dir=<directory> (-l | -g)
+    mkcreds.py -t (ssh | aws) --dir=<directory> (-l | -g) [-o <output_terraform_file>]
 
 Options:
     -t --type
     -l --list
     -g --generate
+    -o --output
 '''
 
 
 import os
 import json
+import base64
+import binascii
+import hashlib
 from collections import namedtuple
-import jinja2
-import docopt
-from snap import common
+from concurrent.futures import ThreadPoolExecutor
+import templating
+import artifacts
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
 
 
 KEYRING_TEMPLATE = '''
@@ -32,23 +39,89 @@ variable "keyring" {
 '''
 
 
+templating.register('keyring', KEYRING_TEMPLATE)
+
 KeypairRecord = namedtuple('KeypairRecord', 'name public_key')
 
+KEY_INDEX_FILE = 'keyfiles.json'
+DEFAULT_READ_WORKERS = 8
 
-def find_keyfiles_in_dir(directory):    
-    files = os.listdir(directory)
+
+def find_keyfiles_in_dir(directory):
+    files = sorted(os.listdir(directory))
     return [f for f in files if f.endswith('.pub') or f.endswith('.pem')]
 
 
-def load_keys(pubkey_table, directory):
-    keydata = {}
-    for key_label in pubkey_table:
-        filepath = os.path.join(directory, pubkey_table[key_label])
-        pubkey = None
-        with open(filepath, 'r') as f:
-            pubkey = f.read()
-        keydata[key_label] = pubkey.lstrip().rstrip()
-    return keydata
+def key_fingerprint(key_text):
+    '''Returns the OpenSSH-style SHA256 fingerprint of a public key line, or a plain
+    content hash for key material that is not in OpenSSH public key format.
+    '''
+
+    fields = key_text.split()
+    if len(fields) >= 2:
+        try:
+            blob = base64.b64decode(fields[1], validate=True)
+            digest = base64.b64encode(hashlib.sha256(blob).digest()).decode('ascii')
+            return 'SHA256:%s' % digest.rstrip('=')
+        except (ValueError, binascii.Error):
+            pass
+    return 'sha256-content:%s' % hashlib.sha256(key_text.encode('utf-8')).hexdigest()
+
+
+def read_key_entry(filepath, stat_result):
+    with open(filepath, 'r') as f:
+        pubkey = f.read().lstrip().rstrip()
+    return {
+        'filename': os.path.basename(filepath),
+        'mtime_ns': stat_result.st_mtime_ns,
+        'size': stat_result.st_size,
+        'fingerprint': key_fingerprint(pubkey),
+        'public_key': pubkey
+    }
+
+
+def load_key_index(index_file=KEY_INDEX_FILE):
+    if not os.path.isfile(index_file):
+        return {}
+    with open(index_file, 'r') as f:
+        return json.loads(f.read())
+
+
+def update_key_index(key_index, directory, max_workers=DEFAULT_READ_WORKERS):
+    '''Returns a key index for <directory>, reusing entries from <key_index> whose
+    file mtime and size are unchanged and re-reading only new or changed key files
+    (concurrently). Entries for key files that no longer exist are dropped.
+    '''
+
+    cached_keys = {}
+    if key_index.get('location') == directory:
+        cached_keys = key_index.get('keys', {})
+
+    keys = {}
+    stale = {}
+    for kfile in find_keyfiles_in_dir(directory):
+        # TODO: add an interactive portion to allow users to label keys
+        label = kfile[0:-4]
+        filepath = os.path.join(directory, kfile)
+        stat_result = os.stat(filepath)
+        entry = cached_keys.get(label)
+        if entry and entry.get('filename') == kfile \
+           and entry.get('mtime_ns') == stat_result.st_mtime_ns \
+           and entry.get('size') == stat_result.st_size:
+            keys[label] = entry
+        else:
+            stale[label] = (filepath, stat_result)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {label: executor.submit(read_key_entry, *stale[label]) for label in stale}
+            for label, future in futures.items():
+                keys[label] = future.result()
+
+    return {
+        'location': directory,
+        'keys': {label: keys[label] for label in sorted(keys)}
+    }, len(stale)
 
 
 def main(args):
@@ -60,33 +133,29 @@ def main(args):
     elif args.get('aws'):
         credential_type = 'aws'
 
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-    keyring_varfile_template = j2env.from_string(KEYRING_TEMPLATE)
-
     keyfile_dir = os.path.expanduser(args['--dir'])
-    keyfiles = find_keyfiles_in_dir(keyfile_dir)
+    key_index, num_read = update_key_index(load_key_index(), keyfile_dir)
+    artifacts.write_artifact(KEY_INDEX_FILE, json.dumps(key_index, indent=2, sort_keys=True))
 
-    # TODO: add an interactive portion to allow users to label keys
-    key_table = {}
-    index = 0
-    for kfile in keyfiles:
-        label = kfile[0:-4]
-        key_table[label] = kfile
-        index += 1
+    if args.get('--list'):
+        print('\n____ %d SSH keys in %s (%d re-read):\n' % (len(key_index['keys']), keyfile_dir, num_read))
+        for label, entry in key_index['keys'].items():
+            print('  %-30s %s' % (label, entry['fingerprint']))
+        return
 
-    key_data = load_keys(key_table, keyfile_dir)
     keypair_records = []
-    for label, key in key_data.items():
-        keypair_records.append(KeypairRecord(name=label, public_key=key))
-
-    print(keyring_varfile_template.render(keypairs=keypair_records))
-
-    with open('keyfiles.json', 'w') as f:
-        keymap = {}
-        keymap['location'] = keyfile_dir
-        keymap['public_keys'] = key_data
-        f.write(json.dumps(keymap))
+    for label, entry in key_index['keys'].items():
+        keypair_records.append(KeypairRecord(name=label, public_key=entry['public_key']))
+
+    keyring_data = templating.render('keyring', keypairs=keypair_records)
+    output_file = args.get('<output_terraform_file>')
+    if output_file:
+        if artifacts.write_artifact(output_file, keyring_data):
+            print('+++ Terraform keyring written to %s.' % output_file)
+        else:
+            print('+++ Terraform keyring in %s is unchanged.' % output_file)
+    else:
+        print(keyring_data)
 
     #print(common.jsonpretty(key_data))
                                
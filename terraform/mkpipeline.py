@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    mkpipeline.py <pipeline_spec_file> [--settings=<settings_tf_file>] [--streams=<streams_tf_file>]
+
+Options:
+    --settings=<settings_tf_file>   output file for project variables [default: project_settings.tf]
+    --streams=<streams_tf_file>     output file for Kinesis streams [default: project_streams.tf]
+
+Non-interactive counterpart to mkproject.py and mkstream.py: renders both Terraform
+files from a single YAML (or JSON) pipeline spec.
+'''
+
+
+import json
+import kinesis
+import firehoseplanner
+import instances
+import pgplanner
+import redisplanner
+import s3planner
+import templating
+import artifacts
+from lazyimport import lazy_import
+from mkproject import TerraformVarSpec
+from mkstream import StreamSpec, AlarmNotification, ALARM_NOTIFICATION_PROTOCOLS, render_streams
+
+docopt = lazy_import('docopt')
+yaml = lazy_import('yaml')
+
+
+DEFAULT_POSTGRES_INSTANCE_TYPE = 't1.micro'
+DEFAULT_REDIS_INSTANCE_TYPE = 't1.micro'
+
+
+class PipelineSpecError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def load_pipeline_spec(filename):
+    with open(filename, 'r') as f:
+        if filename.endswith('.json'):
+            return json.load(f)
+        # prefer the libyaml-backed loader; the pure-Python one dominates run time on large specs
+        return yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def read_project_vars(pipeline_spec):
+    project = pipeline_spec.get('project') or {}
+    if not project.get('name'):
+        raise PipelineSpecError('the pipeline spec must specify a project name.')
+    if not project.get('ssh_keyname'):
+        raise PipelineSpecError('the pipeline spec must specify an ssh_keyname.')
+
+    var_specs = [TerraformVarSpec(name='project_name', value=project['name'])]
+    for role, bucket_name in (pipeline_spec.get('buckets') or {}).items():
+        var_specs.append(TerraformVarSpec(name='%s_bucket_name' % role, value=bucket_name))
+
+    ingest = project.get('ingest') or {}
+    ingest_bucket_name = (pipeline_spec.get('buckets') or {}).get('ingest') or ''
+    try:
+        layout = s3planner.plan_ingest_layout(ingest_bucket_name,
+                                              float(ingest.get('objects_per_sec', 0)),
+                                              float(ingest.get('avg_object_kb', 0)),
+                                              bool(ingest.get('remote_producers', False)),
+                                              int(ingest.get('cold_after_days', s3planner.DEFAULT_COLD_AFTER_DAYS)),
+                                              int(ingest.get('archive_after_days',
+                                                             s3planner.DEFAULT_ARCHIVE_AFTER_DAYS)))
+    except ValueError as err:
+        raise PipelineSpecError('bad ingest settings: %s' % err)
+    for name, value in s3planner.terraform_vars(layout):
+        var_specs.append(TerraformVarSpec(name=name, value=value))
+
+    var_specs.append(TerraformVarSpec(name='elasticsearch_cluster_size',
+                                      value=int(project.get('elasticsearch_cluster_size', 0))))
+    var_specs.append(TerraformVarSpec(name='couchbase_cluster_size',
+                                      value=int(project.get('couchbase_cluster_size', 0))))
+    postgres = project.get('postgres') or {}
+    if postgres and not postgres.get('password'):
+        raise PipelineSpecError('the postgres tier requires a password for the %s role.' % pgplanner.PIPELINE_ROLE)
+    try:
+        for name, value in pgplanner.terraform_vars(postgres.get('instance_type', DEFAULT_POSTGRES_INSTANCE_TYPE),
+                                                    int(postgres.get('consumer_concurrency', 1)),
+                                                    1 if postgres else 0,
+                                                    postgres.get('password', '')):
+            var_specs.append(TerraformVarSpec(name=name, value=value))
+    except instances.UnknownInstanceType as err:
+        raise PipelineSpecError('bad postgres settings: %s' % err)
+
+    redis = project.get('redis') or {}
+    if redis and not redis.get('password'):
+        raise PipelineSpecError('the redis tier requires a password.')
+    try:
+        for name, value in redisplanner.terraform_vars(redis.get('instance_type', DEFAULT_REDIS_INSTANCE_TYPE),
+                                                       redis.get('access_pattern',
+                                                                 redisplanner.DEFAULT_ACCESS_PATTERN),
+                                                       int(redis.get('replicas', 0)),
+                                                       bool(redis),
+                                                       redis.get('password', ''),
+                                                       str(redis.get('version', redisplanner.DEFAULT_REDIS_VERSION))):
+            var_specs.append(TerraformVarSpec(name=name, value=value))
+    except (instances.UnknownInstanceType, redisplanner.UnknownAccessPattern, ValueError) as err:
+        raise PipelineSpecError('bad redis settings: %s' % err)
+
+    var_specs.append(TerraformVarSpec(name='ssh_keyname', value=project['ssh_keyname']))
+    return var_specs
+
+
+def read_consumers(stream_data):
+    '''Returns the consumer apps of a stream as (name, enhanced fan-out, KCL) tuples.'''
+
+    consumers = []
+    for consumer_data in stream_data.get('consumers') or []:
+        if not consumer_data.get('name'):
+            raise PipelineSpecError('every consumer of stream %s requires a name.' % stream_data['name'])
+        consumers.append((consumer_data['name'],
+                          bool(consumer_data.get('enhanced_fan_out', False)),
+                          bool(consumer_data.get('kcl', True))))
+
+    names = [c[0] for c in consumers]
+    if len(set(names)) < len(names):
+        raise PipelineSpecError('duplicate consumer names for stream %s.' % stream_data['name'])
+    return consumers
+
+
+def read_stream_spec(stream_data):
+    for field in ('name', 'resource_name'):
+        if not stream_data.get(field):
+            raise PipelineSpecError('every stream in the pipeline spec requires a %s.' % field)
+
+    consumers = read_consumers(stream_data)
+    throughput = stream_data.get('throughput')
+    if throughput:
+        # enhanced fan-out consumers do not count against the shared read limit; Firehose
+        # deliveries read the stream like any other shared consumer, with or without
+        # consumers alongside. A stream that declares no readers at all is sized for one
+        num_deliveries = len(stream_data.get('deliveries') or [])
+        default_consumers = 1
+        if consumers or num_deliveries:
+            default_consumers = len([c for c in consumers if not c[1]]) + num_deliveries
+        try:
+            sizing = kinesis.size_stream_shards(float(throughput['records_per_sec']),
+                                                float(throughput.get('avg_record_kb', 1)),
+                                                int(throughput.get('consumers', default_consumers)),
+                                                int(throughput.get('headroom_pct', kinesis.DEFAULT_HEADROOM_PCT)))
+        except (KeyError, ValueError) as err:
+            raise PipelineSpecError('bad throughput settings for stream %s: %s' % (stream_data['name'], err))
+        shard_count = sizing.shard_count
+    else:
+        shard_count = stream_data.get('shard_count', 1)
+
+    stream_spec = StreamSpec(stream_data['name'],
+                             stream_data['resource_name'],
+                             shard_count,
+                             stream_data.get('retention_hours', 24))
+
+    shard_metrics = stream_data.get('shard_level_metrics', kinesis.DEFAULT_SHARD_LEVEL_METRICS)
+    for metric_name in shard_metrics or []:
+        if metric_name not in kinesis.SHARD_LEVEL_METRICS:
+            raise PipelineSpecError('unknown shard-level metric "%s" for stream %s.' % (metric_name, stream_data['name']))
+        stream_spec.add_shard_metric(metric_name)
+    for consumer_name, enhanced_fan_out, kcl in consumers:
+        stream_spec.add_consumer(consumer_name, enhanced_fan_out, kcl)
+
+    destinations = set()
+    for delivery_data in stream_data.get('deliveries') or []:
+        destination = delivery_data.get('destination')
+        if destination in destinations:
+            raise PipelineSpecError('stream %s has more than one %s delivery.' % (stream_data['name'], destination))
+        try:
+            settings = firehoseplanner.plan_delivery(destination,
+                                                     float(delivery_data.get('target_latency_secs', 300)),
+                                                     float(delivery_data.get('throughput_mb_per_sec',
+                                                                             stream_spec.shard_count)))
+        except (firehoseplanner.UnknownDestination, ValueError) as err:
+            raise PipelineSpecError('bad delivery settings for stream %s: %s' % (stream_data['name'], err))
+        destinations.add(destination)
+        stream_spec.add_delivery(destination, settings, delivery_data.get('index', stream_data['name']))
+    return stream_spec
+
+
+def read_stream_specs(pipeline_spec):
+    stream_specs = [read_stream_spec(s) for s in pipeline_spec.get('streams') or []]
+    resource_names = set()
+    for spec in stream_specs:
+        if spec.tf_resource_name in resource_names:
+            raise PipelineSpecError('duplicate Terraform resource name "%s".' % spec.tf_resource_name)
+        resource_names.add(spec.tf_resource_name)
+
+    # a KCL app names its lease table after itself, so it can only read one stream
+    kcl_apps = set()
+    for spec in stream_specs:
+        for consumer in spec.consumers:
+            if consumer.kcl and consumer.name in kcl_apps:
+                raise PipelineSpecError('KCL app %s reads more than one stream; its lease tables would collide.'
+                                        % consumer.name)
+            if consumer.kcl:
+                kcl_apps.add(consumer.name)
+    return stream_specs
+
+
+def read_alarm_notification(pipeline_spec):
+    notification = pipeline_spec.get('alarm_notification')
+    if not notification:
+        return None
+    protocol = notification.get('protocol', ALARM_NOTIFICATION_PROTOCOLS[0])
+    if protocol not in ALARM_NOTIFICATION_PROTOCOLS:
+        raise PipelineSpecError('unknown alarm notification protocol "%s" (known: %s).'
+                                % (protocol, ', '.join(ALARM_NOTIFICATION_PROTOCOLS)))
+    if not notification.get('endpoint'):
+        raise PipelineSpecError('the alarm notification requires an endpoint.')
+    return AlarmNotification(protocol=protocol, endpoint=notification['endpoint'])
+
+
+def render_pipeline(pipeline_spec):
+    '''Returns the rendered (project settings, project streams) Terraform sources.'''
+
+    project_vars = read_project_vars(pipeline_spec)
+    stream_specs = read_stream_specs(pipeline_spec)
+
+    settings_data = templating.render('project_vars', project_vars=project_vars)
+    if stream_specs:
+        streams_data = render_streams(project_vars[0].value, stream_specs, read_alarm_notification(pipeline_spec))
+    else:
+        project_name = project_vars[0].value
+        streams_data = '# Intentionally empty file. No Kinesis streams defined for project %s.' % project_name
+
+    return settings_data, streams_data
+
+
+def main(args):
+    try:
+        pipeline_spec = load_pipeline_spec(args['<pipeline_spec_file>'])
+        settings_data, streams_data = render_pipeline(pipeline_spec or {})
+    except PipelineSpecError as err:
+        print('### %s' % err)
+        raise SystemExit(1)
+
+    for filename, data in ((args['--settings'], settings_data), (args['--streams'], streams_data)):
+        if artifacts.write_artifact(filename, data):
+            print('+++ wrote %s.' % filename)
+        else:
+            print('+++ %s is unchanged.' % filename)
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -14,17 +14,36 @@ import json
 from collections import namedtuple
 from cmd import Cmd
 from contextlib import ContextDecorator
-import jinja2
-import docopt
-from snap import common
-from snap import cli_tools as cli
+import templating
+import artifacts
+import instances
+import pgplanner
+import redisplanner
+import s3planner
+import tfparse
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+common = lazy_import('snap.common')
+cli = lazy_import('snap.cli_tools')
 
 
 PROJECT_VAR_NAMES = [
     'project_name',
     'ingest_bucket_name',
     'elasticsearch_cluster_size',
-    'couchbase_cluster_size'
+    'couchbase_cluster_size',
+    'postgres_cluster_size',
+    'redis_primary_count'
+]
+
+DEFAULT_POSTGRES_CONCURRENCY = 100
+
+ACCESS_PATTERN_OPTIONS = [
+    {'label': 'a few hot keys read over and over', 'value': 'hot-keys'},
+    {'label': 'mostly recently written keys', 'value': 'recent'},
+    {'label': 'keys with TTLs; keep the others', 'value': 'expiring'},
+    {'label': 'uniform over the key space', 'value': 'uniform'}
 ]
 
 PROJECT_VAR_TEMPLATE = '''
@@ -48,6 +67,8 @@ variable "profile" {
 
 '''
 
+templating.register('project_vars', PROJECT_VAR_TEMPLATE)
+
 TerraformVarSpec = namedtuple('TerraformVarSpec', 'name value')
 
 
@@ -68,13 +89,23 @@ class MakeProjectCLI(Cmd):
 
         Cmd.__init__(self)
         self.prompt = '%s [%s] > ' % (self.name, self.project_name)
-        _ = os.system('clear')
-        
+
+
+    def preloop(self):
+        # clear the terminal without spawning a shell
+        print('\033[H\033[2J', end='')
+
 
     def generate_key_options(self, keyset_dict):
         options = []
-        for key in keyset_dict['public_keys']:
-            options.append({'label': key, 'value': key})
+        if 'keys' not in keyset_dict:
+            # keyfiles.json from before the key index only lists the key names
+            print('### keyfiles.json has no key fingerprints; re-run mkcreds.py to index the keys.')
+            for key in keyset_dict.get('public_keys') or []:
+                options.append({'label': key, 'value': key})
+            return options
+        for key, entry in keyset_dict['keys'].items():
+            options.append({'label': '%s (%s)' % (key, entry['fingerprint']), 'value': key})
         return options
 
 
@@ -87,6 +118,34 @@ class MakeProjectCLI(Cmd):
         return bucket_name
 
 
+    def get_ingest_layout(self, bucket_name):
+        '''Returns the ingest bucket project vars, sized from the expected object rate and size.'''
+
+        if not bucket_name:
+            return s3planner.terraform_vars(s3planner.plan_ingest_layout('', 0, 0))
+
+        objects_per_sec = self.get_numeric_input('Expected peak ingest objects/sec', '100', float)
+        avg_object_kb = self.get_numeric_input('Average ingest object size (KB)', '256', float)
+        remote = cli.InputPrompt('Do producers upload from outside the bucket region (y/N)?', 'n').show()
+        cold_days = self.get_numeric_input('Move ingest data to STANDARD_IA after days (0: never)',
+                                           str(s3planner.DEFAULT_COLD_AFTER_DAYS))
+        archive_days = self.get_numeric_input('Archive ingest data to GLACIER after days (0: never)',
+                                              str(s3planner.DEFAULT_ARCHIVE_AFTER_DAYS))
+        layout = s3planner.plan_ingest_layout(bucket_name, objects_per_sec, avg_object_kb, remote == 'y',
+                                              cold_days, archive_days)
+
+        print('\n____ Ingest bucket %s: %d key prefix(es) at %.0f%% of the PUT limit each, keys %s'
+              % (bucket_name, layout.prefix_count, layout.put_utilization * 100, s3planner.KEY_LAYOUT))
+        print('____ transfer acceleration %s, incomplete multipart uploads aborted after %d days'
+              % ('on' if layout.accelerate else 'off', layout.abort_multipart_days))
+        if layout.part_size_mb:
+            print('____ upload objects in parts of %d MB' % layout.part_size_mb)
+        for warning in layout.warnings:
+            print('### %s' % warning)
+        print()
+        return s3planner.terraform_vars(layout)
+
+
     def get_es_cluster_size(self):
         should_create = cli.InputPrompt('Create Elasticsearch cluster (Y/n)?', 'y').show()
         if should_create == 'n':
@@ -102,7 +161,94 @@ class MakeProjectCLI(Cmd):
         cluster_size = cli.InputPrompt('Please enter the desired Couchbase cluster size').show()
         return int(cluster_size)
 
-    
+
+    def get_numeric_input(self, prompt_text, default_value, value_type=int, min_value=0):
+        while True:
+            raw_value = cli.InputPrompt(prompt_text, default_value).show()
+            try:
+                value = value_type(raw_value)
+            except (TypeError, ValueError):
+                print('### "%s" is not a valid value for %s.' % (raw_value, prompt_text))
+                continue
+            if value < min_value:
+                print('### %s must be at least %s.' % (prompt_text, min_value))
+                continue
+            return value
+
+
+    def get_password(self, label):
+        password = cli.InputPrompt('Password for %s (blank to generate one)' % label).show()
+        if not password:
+            password = pgplanner.generate_password()
+            print('+++ generated password for %s: %s\n' % (label, password))
+        return password
+
+
+    def default_instance_type(self, datastore):
+        try:
+            instance_types = tfparse.variable_defaults(tfparse.parse_tf_dir('.')).get('instance_types') or {}
+        except (OSError, tfparse.TerraformParseError) as err:
+            print('### cannot read the instance types from the .tf files here (%s); defaulting to t1.micro.' % err)
+            return 't1.micro'
+        return instance_types.get(datastore, 't1.micro')
+
+
+    def get_postgres_tier(self):
+        '''Returns the Postgres tier project vars; the tier is sized but not launched if declined.'''
+
+        type_name = self.default_instance_type('postgres')
+        should_create = cli.InputPrompt('Create Postgres terminal datastore (y/N)?', 'n').show()
+        if should_create != 'y':
+            return pgplanner.terraform_vars(type_name, 1, 0)
+
+        while True:
+            selected_type = cli.InputPrompt('Postgres instance type', type_name).show()
+            try:
+                type_name = instances.lookup(selected_type).name
+                break
+            except instances.UnknownInstanceType as err:
+                print('### %s' % err)
+
+        concurrency = self.get_numeric_input('Expected concurrent writer connections',
+                                             str(DEFAULT_POSTGRES_CONCURRENCY), min_value=1)
+        postgres, bouncer = pgplanner.plan_postgres_tier(type_name, concurrency)
+        print('\n____ Postgres on %s: shared_buffers %d MB, effective_cache_size %d MB, work_mem %d kB, '
+              'max_wal_size %d MB, max_connections %d' % (type_name, postgres.shared_buffers_mb,
+                                                          postgres.effective_cache_size_mb, postgres.work_mem_kb,
+                                                          postgres.max_wal_size_mb, postgres.max_connections))
+        print('____ pgbouncer (%s pooling): %d client connections onto a pool of %d (+%d reserve)\n'
+              % (bouncer.pool_mode, bouncer.max_client_conn, bouncer.default_pool_size, bouncer.reserve_pool_size))
+
+        password = self.get_password('the Postgres %s role' % pgplanner.PIPELINE_ROLE)
+        return pgplanner.terraform_vars(type_name, concurrency, 1, password)
+
+
+    def get_redis_tier(self):
+        '''Returns the Redis cache tier project vars; the tier is sized but not launched if declined.'''
+
+        type_name = self.default_instance_type('redis')
+        should_create = cli.InputPrompt('Create Redis cache in front of the terminal datastores (y/N)?', 'n').show()
+        if should_create != 'y':
+            return redisplanner.terraform_vars(type_name, redisplanner.DEFAULT_ACCESS_PATTERN, 0, False)
+
+        while True:
+            selected_type = cli.InputPrompt('Redis instance type', type_name).show()
+            try:
+                type_name = instances.lookup(selected_type).name
+                break
+            except instances.UnknownInstanceType as err:
+                print('### %s' % err)
+
+        access_pattern = cli.MenuPrompt('Query consumer access pattern', ACCESS_PATTERN_OPTIONS).show()
+        num_replicas = self.get_numeric_input('Number of Redis replicas', '0')
+        redis = redisplanner.plan_redis_tier(type_name, access_pattern, num_replicas)
+        print('\n____ Redis %s on %s: maxmemory %d MB, %s eviction, %d replica(s)\n'
+              % (redisplanner.DEFAULT_REDIS_VERSION, type_name, redis.maxmemory_mb, redis.maxmemory_policy,
+                 redis.num_replicas))
+        password = self.get_password('the Redis primary and replicas')
+        return redisplanner.terraform_vars(type_name, access_pattern, num_replicas, True, password)
+
+
     def select_ssh_key(self, keyset_dict):
         print('\n____ SSH keys in target directory %s:\n' % keyset_dict['location'])
         key_options = self.generate_key_options(keyset_dict)
@@ -118,6 +264,9 @@ class MakeProjectCLI(Cmd):
         if ingest_bucket_name:
             self.project_var_specs.append(TerraformVarSpec(name='ingest_bucket_name',
                                                            value=ingest_bucket_name))
+
+        for name, value in self.get_ingest_layout(ingest_bucket_name):
+            self.project_var_specs.append(TerraformVarSpec(name=name, value=value))
         
         es_cluster_size = self.get_es_cluster_size()
         self.project_var_specs.append(TerraformVarSpec(name='elasticsearch_cluster_size',
@@ -127,6 +276,12 @@ class MakeProjectCLI(Cmd):
         self.project_var_specs.append(TerraformVarSpec(name='couchbase_cluster_size',
                                                        value=cb_cluster_size))
 
+        for name, value in self.get_postgres_tier():
+            self.project_var_specs.append(TerraformVarSpec(name=name, value=value))
+
+        for name, value in self.get_redis_tier():
+            self.project_var_specs.append(TerraformVarSpec(name=name, value=value))
+
         with open('keyfiles.json', 'r') as f:
             keyset = json.loads(f.read())
 
@@ -147,15 +302,12 @@ class MakeProjectCLI(Cmd):
             if should_overwrite == 'n':
                 return
 
-        j2env = jinja2.Environment()
-        template_mgr = common.JinjaTemplateManager(j2env)        
-        var_template = j2env.from_string(PROJECT_VAR_TEMPLATE)
-        output_data = var_template.render(project_vars=self.project_var_specs)
-
-        with open(self.output_file, 'w') as f:
-            f.write(output_data)
+        output_data = templating.render('project_vars', project_vars=self.project_var_specs)
 
-        print('\n+++ Terraform project vars written to %s.\n' % self.output_file)
+        if artifacts.write_artifact(self.output_file, output_data):
+            print('\n+++ Terraform project vars written to %s.\n' % self.output_file)
+        else:
+            print('\n+++ Terraform project vars in %s are unchanged.\n' % self.output_file)
 
         
     def do_quit(self, cmd_args):
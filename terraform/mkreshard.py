@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    mkreshard.py <stream_resource_name> <metrics_file> [options]
+
+Options:
+    --streams=<tf_file>         streams file generated by mkstream or mkpipeline [default: project_streams.tf]
+    --project=<project_name>    project name (default: project_name in the .tf files next to the streams file)
+    --shard-map=<json_file>     "aws kinesis list-shards" output for the stream (default: the shards
+                                of a stream that was never resharded)
+    --target-util=<pct>         per-shard write utilization to stay below [default: 80]
+    --percentile=<p>            percentile of the per-period rates taken as the peak [default: 100]
+    --period=<secs>             length of the export periods in seconds [default: 60]
+    --plan-file=<json_file>     also write the resharding plan as JSON
+    --apply                     write the new shard count back to the streams file
+
+Plans a resharding of a live Kinesis stream from a CSV or JSON export of its
+per-shard IncomingBytes and IncomingRecords sums (columns: timestamp, shard ID,
+incoming bytes, incoming records; one row per shard and period). Prints the shard
+loads and the AWS CLI commands of the plan.
+
+With --apply the streams file declares the planned shard count, so that Terraform
+finds the stream already at that count once the commands have run.
+'''
+
+
+import os
+import re
+import json
+import artifacts
+import firehoseplanner
+import reshardplanner
+import tfparse
+from lazyimport import lazy_import
+from mkstream import StreamSpec, MAX_HOT_SHARD_ALARMS, alarm_notification_from_vars, render_streams
+
+docopt = lazy_import('docopt')
+
+
+def shard_alarm_ids(alarms, resource_name):
+    stream_ref = '${aws_kinesis_stream.%s.name}' % resource_name
+    return [alarm['dimensions']['ShardId'] for alarm in alarms.values()
+            if (alarm.get('dimensions') or {}).get('StreamName') == stream_ref
+            and 'ShardId' in alarm['dimensions']]
+
+
+def stream_consumers(blocks, resource_name):
+    '''The consumers rendered for a stream, in file order, as (name, enhanced fan-out, KCL).
+    Shared-throughput consumers outside the KCL leave no resources behind.
+    '''
+
+    arn_ref = '${aws_kinesis_stream.%s.arn}' % resource_name
+    name_ref = '${aws_kinesis_stream.%s.name}' % resource_name
+    consumers = {}
+    for block in blocks:
+        if block.block_type != 'resource':
+            continue
+        if block.labels[0] == 'aws_kinesis_stream_consumer' and block.body.get('stream_arn') == arn_ref:
+            consumers.setdefault(block.body['name'], [False, False])[0] = True
+        elif block.labels[0] == 'aws_dynamodb_table' and (block.body.get('tags') or {}).get('Stream') == name_ref:
+            consumers.setdefault(block.body['name'], [False, False])[1] = True
+    return [(name, enhanced_fan_out, kcl) for name, (enhanced_fan_out, kcl) in consumers.items()]
+
+
+def stream_deliveries(blocks, resource_name):
+    '''The Firehose deliveries rendered for a stream, as (destination, DeliverySettings, index name).'''
+
+    arn_ref = '${aws_kinesis_stream.%s.arn}' % resource_name
+    deliveries = []
+    for attrs in tfparse.resources_of_type(blocks, 'aws_kinesis_firehose_delivery_stream').values():
+        if (attrs.get('kinesis_source_configuration') or {}).get('kinesis_stream_arn') != arn_ref:
+            continue
+        if attrs['destination'] == 'extended_s3':
+            s3 = attrs['extended_s3_configuration']
+            settings = firehoseplanner.DeliverySettings(buffer_size_mb=int(s3['buffer_size']),
+                                                        buffer_interval_secs=int(s3['buffer_interval']),
+                                                        compression=s3['compression_format'],
+                                                        retry_duration_secs=None,
+                                                        warnings=[])
+            deliveries.append(('s3', settings, None))
+        else:
+            es = attrs['elasticsearch_configuration']
+            settings = firehoseplanner.DeliverySettings(buffer_size_mb=int(es['buffering_size']),
+                                                        buffer_interval_secs=int(es['buffering_interval']),
+                                                        compression=None,
+                                                        retry_duration_secs=int(es['retry_duration']),
+                                                        warnings=[])
+            deliveries.append(('elasticsearch', settings, es['index_name']))
+    return deliveries
+
+
+def load_stream_specs(blocks):
+    '''Rebuilds the StreamSpecs a streams file was rendered from.'''
+
+    alarms = tfparse.resources_of_type(blocks, 'aws_cloudwatch_metric_alarm')
+    stream_specs = []
+    for resource_name, attrs in tfparse.resources_of_type(blocks, 'aws_kinesis_stream').items():
+        spec = StreamSpec(attrs['name'], resource_name, attrs['shard_count'], attrs.get('retention_period', 24))
+        for metric_name in re.findall(r'"([^"]+)"', attrs.get('shard_level_metrics') or ''):
+            spec.add_shard_metric(metric_name)
+        if 'WriteProvisionedThroughputExceeded' in spec.shard_metrics and spec.shard_count <= MAX_HOT_SHARD_ALARMS:
+            spec.shard_ids = shard_alarm_ids(alarms, resource_name)
+        for consumer_name, enhanced_fan_out, kcl in stream_consumers(blocks, resource_name):
+            spec.add_consumer(consumer_name, enhanced_fan_out, kcl)
+        for destination, settings, index_name in stream_deliveries(blocks, resource_name):
+            spec.add_delivery(destination, settings, index_name)
+        stream_specs.append(spec)
+    return stream_specs
+
+
+def print_plan(stream_spec, plan):
+    print('\n____ Shard write load of %s at the peak:\n' % stream_spec.name)
+    print('  %-22s %12s %12s %8s' % ('shard', 'KB/sec', 'records/sec', 'util'))
+    for load in plan.shard_loads:
+        print('  %-22s %12.1f %12.1f %7.1f%%' % (load.shard_id, load.peak_bytes_per_sec / 1024,
+                                                  load.peak_records_per_sec, load.utilization * 100))
+    print('\n  stream utilization: %.1f%% of %d shard(s), max/mean skew %.2f'
+          % (plan.stream_utilization * 100, plan.current_shard_count, plan.skew))
+    for warning in plan.warnings:
+        print('  ### %s' % warning)
+
+    if plan.strategy == 'none':
+        print('\n+++ %d shard(s) carry the observed peak; no resharding needed.\n' % plan.current_shard_count)
+        return
+
+    print('\n+++ %s plan, %d -> %d shard(s):\n' % (plan.strategy, plan.current_shard_count, plan.target_shard_count))
+    for command in reshardplanner.cli_commands(stream_spec.name, plan):
+        print('    %s' % command)
+    print()
+
+
+def main(args):
+    streams_file = args['--streams']
+    tf_dir = os.path.dirname(streams_file) or '.'
+    try:
+        with open(streams_file, 'r') as f:
+            blocks = tfparse.parse_tf(f.read())
+        stream_specs = load_stream_specs(blocks)
+        alarm_notification = alarm_notification_from_vars(tfparse.variable_defaults(blocks))
+    except (IOError, tfparse.TerraformParseError) as err:
+        print('### cannot read the streams file: %s' % err)
+        raise SystemExit(1)
+
+    specs_by_resource = {spec.tf_resource_name: spec for spec in stream_specs}
+    stream_spec = specs_by_resource.get(args['<stream_resource_name>'])
+    if stream_spec is None:
+        print('### no stream with Terraform resource name "%s" in %s.' % (args['<stream_resource_name>'], streams_file))
+        raise SystemExit(1)
+
+    try:
+        target_util_pct = float(args['--target-util'])
+        period_secs = float(args['--period'])
+        peak_percentile = float(args['--percentile'])
+    except ValueError:
+        print('### --target-util, --period and --percentile must be numbers.')
+        raise SystemExit(1)
+
+    try:
+        if args['--shard-map']:
+            shard_map = reshardplanner.shard_map_from_list_shards(args['--shard-map'])
+        else:
+            shard_map = reshardplanner.initial_shard_map(stream_spec.shard_count)
+        metrics = reshardplanner.load_shard_metrics(args['<metrics_file>'])
+        plan = reshardplanner.plan_resharding(metrics, shard_map,
+                                              target_util_pct=target_util_pct,
+                                              period_secs=period_secs,
+                                              peak_percentile=peak_percentile)
+    except (IOError, reshardplanner.ReshardPlanningError) as err:
+        print('### %s' % err)
+        raise SystemExit(1)
+
+    print('+++ read %d period(s) of metrics for %d shard(s).' % (metrics.num_periods, len(metrics.shard_ids)))
+    print_plan(stream_spec, plan)
+
+    if args['--plan-file']:
+        plan_data = {
+            'stream_name': stream_spec.name,
+            'strategy': plan.strategy,
+            'current_shard_count': plan.current_shard_count,
+            'target_shard_count': plan.target_shard_count,
+            'operations': [dict(op.args, action=op.action) for op in plan.operations],
+            'warnings': plan.warnings
+        }
+        artifacts.write_artifact(args['--plan-file'], json.dumps(plan_data, indent=2, sort_keys=True) + '\n')
+        print('+++ wrote the plan to %s.' % args['--plan-file'])
+
+    if not args['--apply'] or plan.target_shard_count == stream_spec.shard_count:
+        return
+
+    project_name = args['--project'] or tfparse.variable_defaults(tfparse.parse_tf_dir(tf_dir)).get('project_name')
+    if not project_name:
+        print('### no project_name variable found next to %s; pass --project.' % streams_file)
+        raise SystemExit(1)
+
+    stream_spec.shard_count = plan.target_shard_count
+    if stream_spec.hot_shard_alarm_ids:
+        # child shard IDs are only known once the resharding has run
+        print('### per-shard alarms of %s are dropped; the resharded stream has new shard IDs.' % stream_spec.name)
+        stream_spec.shard_ids = []
+
+    if artifacts.write_artifact(streams_file, render_streams(project_name, stream_specs, alarm_notification)):
+        print('+++ %s now declares %d shard(s) for %s.' % (streams_file, stream_spec.shard_count, stream_spec.name))
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
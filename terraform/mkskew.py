@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    mkskew.py --shards=<shard_count> <keyfile> [--resolution=<bits>] [--top=<num_keys>]
+
+Options:
+    --resolution=<bits>     histogram resolution, in leading bits of the hash key space [default: 16]
+    --top=<num_keys>        number of heavy-hitter partition keys to track [default: 10]
+
+<keyfile> holds one partition key per line, one line per record; use - to read from stdin.
+'''
+
+
+import sys
+import bisect
+import kinesis
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+
+
+class HeavyHitterCounter(object):
+    '''Misra-Gries summary: tracks the most frequent keys of a stream using at most
+    <capacity> counters. Reported counts are lower bounds on the true counts.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+
+
+    def add(self, key):
+        if key in self.counters:
+            self.counters[key] += 1
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = 1
+        else:
+            for k in list(self.counters):
+                self.counters[k] -= 1
+                if not self.counters[k]:
+                    del self.counters[k]
+
+
+    def top(self, num_keys):
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[0:num_keys]
+
+
+
+class KeySkewSimulator(object):
+    '''Distributes partition keys over the shards of a stream the way Kinesis would,
+    in constant memory: per-shard counters, a fixed-resolution histogram of the hash
+    key space and a bounded heavy-hitter summary.
+    '''
+
+    def __init__(self, shard_count, resolution_bits=16, num_top_keys=10):
+        self.shard_count = shard_count
+        self.hash_ranges = kinesis.even_hash_ranges(shard_count)
+        self.range_starts = [r.starting_hash_key for r in self.hash_ranges]
+        self.resolution_bits = resolution_bits
+        self.histogram = [0] * (2 ** resolution_bits)
+        self.shard_counts = [0] * shard_count
+        self.heavy_hitters = HeavyHitterCounter(num_top_keys * 4)
+        self.num_top_keys = num_top_keys
+        self.total = 0
+
+
+    @property
+    def bucket_width(self):
+        return kinesis.HASH_KEY_SPACE >> self.resolution_bits
+
+
+    def add_key(self, partition_key):
+        hash_key = kinesis.partition_key_hash(partition_key)
+        self.shard_counts[bisect.bisect_right(self.range_starts, hash_key) - 1] += 1
+        self.histogram[hash_key >> (128 - self.resolution_bits)] += 1
+        self.heavy_hitters.add(partition_key)
+        self.total += 1
+
+
+    def read(self, key_stream):
+        for line in key_stream:
+            key = line.rstrip('\r\n')
+            if key:
+                self.add_key(key)
+        return self
+
+
+    @property
+    def mean_shard_load(self):
+        return self.total / self.shard_count
+
+
+    def skew(self, loads):
+        if not self.total:
+            return 0.0
+        return max(loads) / self.mean_shard_load
+
+
+    def balanced_boundaries(self):
+        '''Returns the starting hash keys that would give each shard an equal share of
+        the sampled load, interpolating linearly inside histogram buckets.
+        '''
+
+        width = self.bucket_width
+        boundaries = [0]
+        cumulative = 0
+        shard_index = 1
+        for bucket, count in enumerate(self.histogram):
+            while shard_index < self.shard_count and count \
+                  and cumulative + count >= self.total * shard_index / self.shard_count:
+                target = self.total * shard_index / self.shard_count
+                offset = int(width * (target - cumulative) / count)
+                boundaries.append(max(bucket * width + offset, boundaries[-1] + 1))
+                shard_index += 1
+            cumulative += count
+
+        # an empty sample gives no guidance; fall back to the even split
+        if len(boundaries) < self.shard_count:
+            return list(self.range_starts)
+        return boundaries
+
+
+    def projected_loads(self, boundaries):
+        '''Estimates per-shard load for the given starting hash keys from the histogram.'''
+
+        width = self.bucket_width
+        ends = boundaries[1:] + [kinesis.HASH_KEY_SPACE]
+        loads = []
+        for start, end in zip(boundaries, ends):
+            load = 0.0
+            first_bucket = start // width
+            last_bucket = min((end - 1) // width, len(self.histogram) - 1)
+            for bucket in range(first_bucket, last_bucket + 1):
+                bucket_start = bucket * width
+                overlap = min(end, bucket_start + width) - max(start, bucket_start)
+                load += self.histogram[bucket] * overlap / width
+            loads.append(load)
+        return loads
+
+
+
+def print_loads(title, simulator, hash_keys, loads):
+    print('\n____ %s:\n' % title)
+    print('  %-6s %-40s %12s %8s' % ('shard', 'starting hash key', 'records', 'share'))
+    for index, (hash_key, load) in enumerate(zip(hash_keys, loads)):
+        share = load / simulator.total * 100 if simulator.total else 0.0
+        print('  %-6d %-40d %12d %7.2f%%' % (index, hash_key, round(load), share))
+    print('\n  max/mean skew: %.3f' % simulator.skew(loads))
+
+
+def main(args):
+    shard_count = int(args['--shards'])
+    simulator = KeySkewSimulator(shard_count,
+                                 resolution_bits=int(args['--resolution']),
+                                 num_top_keys=int(args['--top']))
+
+    if args['<keyfile>'] == '-':
+        simulator.read(sys.stdin)
+    else:
+        with open(args['<keyfile>'], 'r') as f:
+            simulator.read(f)
+
+    print('+++ read %d partition keys for a %d-shard stream.' % (simulator.total, shard_count))
+    print_loads('Load under even hash key split', simulator, simulator.range_starts, simulator.shard_counts)
+
+    boundaries = simulator.balanced_boundaries()
+    print_loads('Estimated load under balanced hash key boundaries',
+                simulator, boundaries, simulator.projected_loads(boundaries))
+
+    hot_keys = [(k, c) for k, c in simulator.heavy_hitters.top(simulator.num_top_keys)
+                if c > simulator.mean_shard_load]
+    if hot_keys:
+        print('\n### These keys alone exceed a mean shard load and cannot be flattened by re-splitting:')
+        for key, count in hot_keys:
+            print('    %s (at least %d records)' % (key, count))
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -10,17 +10,53 @@ Options:
 
 
 import os
+import json
 from collections import namedtuple
 from cmd import Cmd
 from contextlib import ContextDecorator
-import jinja2
-import docopt
-from snap import common
-from snap import cli_tools as cli
+import kinesis
+import firehoseplanner
+import templating
+import artifacts
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+common = lazy_import('snap.common')
+cli = lazy_import('snap.cli_tools')
 
 
 KINESIS_STREAM_TEMPLATE = '''
+{% if streams %}
+resource "aws_sns_topic" "{{ project_resource_name }}_stream_alarms" {
+  name = "{{ project_resource_name }}-stream-alarms"
+}
+
+output "{{ project_resource_name }}_stream_alarms_topic_arn" {
+  value = "${aws_sns_topic.{{ project_resource_name }}_stream_alarms.arn}"
+}
+
+{% if alarm_notification %}
+variable "alarm_notification_protocol" {
+  description = "SNS protocol the stream alarms are delivered with (https or sms)"
+  default = "{{ alarm_notification.protocol }}"
+}
+
+variable "alarm_notification_endpoint" {
+  description = "where the stream alarms page, e.g. a PagerDuty or Opsgenie SNS integration URL"
+  default = "{{ alarm_notification.endpoint }}"
+}
+
+resource "aws_sns_topic_subscription" "{{ project_resource_name }}_stream_alarms" {
+  topic_arn = "${aws_sns_topic.{{ project_resource_name }}_stream_alarms.arn}"
+  protocol = "${var.alarm_notification_protocol}"
+  endpoint = "${var.alarm_notification_endpoint}"
+  endpoint_auto_confirms = true
+}
+
+{% endif %}
+{% endif %}
 {% for stream in streams %}
+{% set thresholds = stream.alarm_thresholds %}
 resource "aws_kinesis_stream" "{{ stream.tf_resource_name }}" {
   name = "{{ stream.name }}"
   shard_count = {{ stream.shard_count }}
@@ -28,14 +64,236 @@ resource "aws_kinesis_stream" "{{ stream.tf_resource_name }}" {
   tags {
       Name = "{{ stream.name }}"
   }
+{% if stream.shard_metrics %}
   shard_level_metrics = [
     {{ stream.formatted_shard_metrics_list }}
   ]
+{% endif %}
+}
+
+resource "aws_cloudwatch_metric_alarm" "{{ stream.tf_resource_name }}_iterator_age" {
+  alarm_name = "{{ stream.name }}-iterator-age"
+  alarm_description = "consumers of {{ stream.name }} are more than {{ thresholds.iterator_age_ms // 1000 }}s behind"
+  namespace = "AWS/Kinesis"
+  metric_name = "GetRecords.IteratorAgeMilliseconds"
+  dimensions {
+    StreamName = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.name}"
+  }
+  statistic = "Maximum"
+  period = {{ alarm_period_secs }}
+  evaluation_periods = {{ alarm_evaluation_periods }}
+  comparison_operator = "GreaterThanThreshold"
+  threshold = {{ thresholds.iterator_age_ms }}
+  treat_missing_data = "notBreaching"
+  alarm_actions = ["${aws_sns_topic.{{ project_resource_name }}_stream_alarms.arn}"]
+}
+
+resource "aws_cloudwatch_metric_alarm" "{{ stream.tf_resource_name }}_write_throttled" {
+  alarm_name = "{{ stream.name }}-write-throttled"
+  alarm_description = "writes to {{ stream.name }} are throttled; {{ stream.shard_count }} shard(s) are not enough or a shard is hot"
+  namespace = "AWS/Kinesis"
+  metric_name = "WriteProvisionedThroughputExceeded"
+  dimensions {
+    StreamName = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.name}"
+  }
+  statistic = "Sum"
+  period = {{ alarm_period_secs }}
+  evaluation_periods = {{ alarm_evaluation_periods }}
+  comparison_operator = "GreaterThanThreshold"
+  threshold = {{ thresholds.write_throttled_records }}
+  treat_missing_data = "notBreaching"
+  alarm_actions = ["${aws_sns_topic.{{ project_resource_name }}_stream_alarms.arn}"]
+}
+
+resource "aws_cloudwatch_metric_alarm" "{{ stream.tf_resource_name }}_read_throttled" {
+  alarm_name = "{{ stream.name }}-read-throttled"
+  alarm_description = "reads from {{ stream.name }} are throttled; consumers share {{ stream.shard_count }} shard(s) of read capacity"
+  namespace = "AWS/Kinesis"
+  metric_name = "ReadProvisionedThroughputExceeded"
+  dimensions {
+    StreamName = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.name}"
+  }
+  statistic = "Sum"
+  period = {{ alarm_period_secs }}
+  evaluation_periods = {{ alarm_evaluation_periods }}
+  comparison_operator = "GreaterThanThreshold"
+  threshold = {{ thresholds.read_throttled_calls }}
+  treat_missing_data = "notBreaching"
+  alarm_actions = ["${aws_sns_topic.{{ project_resource_name }}_stream_alarms.arn}"]
+}
+{% for shard_id in stream.hot_shard_alarm_ids %}
+
+resource "aws_cloudwatch_metric_alarm" "{{ stream.tf_resource_name }}_hot_shard_{{ loop.index0 }}" {
+  alarm_name = "{{ stream.name }}-hot-{{ shard_id }}"
+  alarm_description = "{{ shard_id }} of {{ stream.name }} is throttling writes; check partition key skew"
+  namespace = "AWS/Kinesis"
+  metric_name = "WriteProvisionedThroughputExceeded"
+  dimensions {
+    StreamName = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.name}"
+    ShardId = "{{ shard_id }}"
+  }
+  statistic = "Sum"
+  period = {{ alarm_period_secs }}
+  evaluation_periods = {{ alarm_evaluation_periods }}
+  comparison_operator = "GreaterThanThreshold"
+  threshold = {{ thresholds.shard_write_throttled_records }}
+  treat_missing_data = "notBreaching"
+  alarm_actions = ["${aws_sns_topic.{{ project_resource_name }}_stream_alarms.arn}"]
 }
+{% endfor %}
+{% for consumer in stream.consumers %}
+{% if consumer.enhanced_fan_out %}
+
+# {{ consumer.name }} reads through its own 2 MB/s per shard pipe
+resource "aws_kinesis_stream_consumer" "{{ stream.tf_resource_name }}_{{ consumer.resource_name }}" {
+  name = "{{ consumer.name }}"
+  stream_arn = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.arn}"
+}
+
+resource "aws_cloudwatch_metric_alarm" "{{ stream.tf_resource_name }}_{{ consumer.resource_name }}_behind" {
+  alarm_name = "{{ stream.name }}-{{ consumer.name }}-behind"
+  alarm_description = "{{ consumer.name }} is more than {{ thresholds.iterator_age_ms // 1000 }}s behind on {{ stream.name }}"
+  namespace = "AWS/Kinesis"
+  metric_name = "SubscribeToShardEvent.MillisBehindLatest"
+  dimensions {
+    StreamName = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.name}"
+    ConsumerName = "${aws_kinesis_stream_consumer.{{ stream.tf_resource_name }}_{{ consumer.resource_name }}.name}"
+  }
+  statistic = "Maximum"
+  period = {{ alarm_period_secs }}
+  evaluation_periods = {{ alarm_evaluation_periods }}
+  comparison_operator = "GreaterThanThreshold"
+  threshold = {{ thresholds.iterator_age_ms }}
+  treat_missing_data = "notBreaching"
+  alarm_actions = ["${aws_sns_topic.{{ project_resource_name }}_stream_alarms.arn}"]
+}
+{% endif %}
+{% if consumer.kcl %}
+{% set capacity = stream.lease_table_capacity %}
+
+# KCL lease and checkpoint table of {{ consumer.name }}; KCL names it after the application
+resource "aws_dynamodb_table" "{{ stream.tf_resource_name }}_{{ consumer.resource_name }}_leases" {
+  name = "{{ consumer.name }}"
+  read_capacity = {{ capacity.read_capacity }}
+  write_capacity = {{ capacity.write_capacity }}
+  hash_key = "leaseKey"
+  attribute {
+    name = "leaseKey"
+    type = "S"
+  }
+  tags {
+    Name = "{{ consumer.name }}"
+    Stream = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.name}"
+    EnhancedFanOut = "{{ 'true' if consumer.enhanced_fan_out else 'false' }}"
+  }
+}
+{% endif %}
+{% endfor %}
+{% for delivery in stream.deliveries %}
+{% set settings = delivery.settings %}
+{% if delivery.destination == 's3' %}
+
+# batches {{ stream.name }} into the ingest bucket; Firehose appends yyyy/mm/dd/hh/ to the prefix
+resource "aws_kinesis_firehose_delivery_stream" "{{ stream.tf_resource_name }}_to_s3" {
+  name = "{{ stream.name }}-to-s3"
+  destination = "extended_s3"
+  kinesis_source_configuration {
+    kinesis_stream_arn = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.arn}"
+    role_arn = "${aws_iam_role.{{ project_resource_name }}_firehose.arn}"
+  }
+  extended_s3_configuration {
+    role_arn = "${aws_iam_role.{{ project_resource_name }}_firehose.arn}"
+    bucket_arn = "${aws_s3_bucket.ingest_bucket.arn}"
+    prefix = "firehose/{{ stream.name }}/"
+    buffer_size = {{ settings.buffer_size_mb }}
+    buffer_interval = {{ settings.buffer_interval_secs }}
+    compression_format = "{{ settings.compression }}"
+  }
+}
+{% else %}
+
+# bulk-indexes {{ stream.name }}; documents Elasticsearch rejects are kept in the ingest bucket
+resource "aws_kinesis_firehose_delivery_stream" "{{ stream.tf_resource_name }}_to_elasticsearch" {
+  name = "{{ stream.name }}-to-elasticsearch"
+  destination = "elasticsearch"
+  kinesis_source_configuration {
+    kinesis_stream_arn = "${aws_kinesis_stream.{{ stream.tf_resource_name }}.arn}"
+    role_arn = "${aws_iam_role.{{ project_resource_name }}_firehose.arn}"
+  }
+  s3_configuration {
+    role_arn = "${aws_iam_role.{{ project_resource_name }}_firehose.arn}"
+    bucket_arn = "${aws_s3_bucket.ingest_bucket.arn}"
+    prefix = "firehose/{{ stream.name }}-failed/"
+    buffer_size = {{ settings.buffer_size_mb }}
+    buffer_interval = {{ settings.buffer_interval_secs }}
+    compression_format = "GZIP"
+  }
+  elasticsearch_configuration {
+    domain_arn = "${var.firehose_elasticsearch_domain_arn}"
+    role_arn = "${aws_iam_role.{{ project_resource_name }}_firehose.arn}"
+    index_name = "{{ delivery.index_name }}"
+    type_name = "doc"
+    index_rotation_period = "OneDay"
+    buffering_size = {{ settings.buffer_size_mb }}
+    buffering_interval = {{ settings.buffer_interval_secs }}
+    retry_duration = {{ settings.retry_duration_secs }}
+    s3_backup_mode = "FailedDocumentsOnly"
+  }
+}
+{% endif %}
+{% endfor %}
 
 {% endfor %}
+{% if firehose_role_policy %}
+resource "aws_iam_role" "{{ project_resource_name }}_firehose" {
+  name = "{{ project_resource_name }}-firehose-delivery"
+  assume_role_policy = <<EOF
+{{ firehose_assume_role_policy }}
+EOF
+}
+
+resource "aws_iam_role_policy" "{{ project_resource_name }}_firehose" {
+  name = "{{ project_resource_name }}-firehose-delivery"
+  role = "${aws_iam_role.{{ project_resource_name }}_firehose.id}"
+  policy = <<EOF
+{{ firehose_role_policy }}
+EOF
+}
+
+{% endif %}
+{% if firehose_elasticsearch %}
+# Firehose only delivers to Amazon Elasticsearch Service domains, not to the
+# self-managed cluster in main.tf
+variable "firehose_elasticsearch_domain_arn" {
+  description = "ARN of the Amazon Elasticsearch Service domain Firehose indexes into"
+}
+
+{% endif %}
+{% if streams %}
+resource "aws_cloudwatch_dashboard" "{{ project_resource_name }}_streams" {
+  dashboard_name = "{{ project_resource_name }}-streams"
+  dashboard_body = <<EOF
+{{ dashboard_body }}
+EOF
+}
+{% endif %}
 '''
 
+templating.register('kinesis_stream', KINESIS_STREAM_TEMPLATE)
+
+ALARM_EVALUATION_PERIODS = 3
+
+StreamConsumer = namedtuple('StreamConsumer', 'name resource_name enhanced_fan_out kcl')
+FirehoseDelivery = namedtuple('FirehoseDelivery', 'destination index_name settings')
+AlarmNotification = namedtuple('AlarmNotification', 'protocol endpoint')
+
+# SNS protocols Terraform can subscribe without a manual confirmation step; paging
+# services such as PagerDuty and Opsgenie take alarms over HTTPS
+ALARM_NOTIFICATION_PROTOCOLS = ['https', 'sms']
+
+# per-shard alarms need one alarm per shard; above this many shards only the
+# stream-level alarms are generated
+MAX_HOT_SHARD_ALARMS = 32
 
 
 class StreamSpec(object):
@@ -46,11 +304,34 @@ class StreamSpec(object):
         self.retention_period_hours = int(retention_hrs)
         self.stream_metrics = []
         self.shard_metrics = []
+        # open shard IDs, when they are no longer those of a newly created stream
+        self.shard_ids = None
+        self.consumers = []
+        self.deliveries = []
 
 
     def add_shard_metric(self, metric_name):
         self.shard_metrics.append(metric_name)
 
+    def add_consumer(self, consumer_name, enhanced_fan_out=False, kcl=True):
+        self.consumers.append(StreamConsumer(name=consumer_name,
+                                             resource_name=terraform_identifier(consumer_name),
+                                             enhanced_fan_out=enhanced_fan_out,
+                                             kcl=kcl))
+
+    def add_delivery(self, destination, settings, index_name=None):
+        self.deliveries.append(FirehoseDelivery(destination=destination, index_name=index_name, settings=settings))
+
+    @property
+    def shared_consumer_count(self):
+        '''Consumers that split the 2 MB/s per shard read limit between them, Firehose deliveries included.'''
+
+        return len([c for c in self.consumers if not c.enhanced_fan_out]) + len(self.deliveries)
+
+    @property
+    def lease_table_capacity(self):
+        return kinesis.lease_table_capacity(self.shard_count)
+
     def add_stream_metric(self, metric_name):
         self.stream_metrics.append(metric_name)
 
@@ -58,12 +339,78 @@ class StreamSpec(object):
     def compiled_shard_metrics_list(self):
         return ',\n'.join(self.shard_metrics)
 
+    @property
+    def formatted_shard_metrics_list(self):
+        return ',\n    '.join('"%s"' % m for m in self.shard_metrics)
+
+    @property
+    def alarm_thresholds(self):
+        return kinesis.alarm_thresholds(self.shard_count, self.retention_period_hours)
+
+    @property
+    def hot_shard_alarm_ids(self):
+        '''Shards that get their own write-throttling alarm; these need the shard-level metric.'''
+
+        if 'WriteProvisionedThroughputExceeded' not in self.shard_metrics or self.shard_count > MAX_HOT_SHARD_ALARMS:
+            return []
+        if self.shard_ids is not None:
+            return self.shard_ids
+        return kinesis.initial_shard_ids(self.shard_count)
+
     @property
     def compiled_stream_metrics_list(self):
         return ',\n'.join(self.stream_metrics)
 
 
 
+def terraform_identifier(name):
+    return ''.join(c if c.isalnum() or c == '_' else '_' for c in name)
+
+
+def stream_template_vars(project_name, stream_specs, alarm_notification=None):
+    '''Template variables for rendering the stream specs of a project, alarms and dashboard
+    included. Without an AlarmNotification the alarm topic has no subscription.
+    '''
+
+    widgets = kinesis.dashboard_widgets([s.name for s in stream_specs], '${var.region}')
+    template_vars = dict(streams=stream_specs,
+                         project_resource_name=terraform_identifier(project_name),
+                         alarm_notification=alarm_notification,
+                         alarm_period_secs=kinesis.ALARM_PERIOD_SECS,
+                         alarm_evaluation_periods=ALARM_EVALUATION_PERIODS,
+                         dashboard_body=json.dumps({'widgets': widgets}, indent=2),
+                         firehose_role_policy=None,
+                         firehose_elasticsearch=False)
+
+    # one Firehose role per project, scoped to the streams that have deliveries
+    delivering_specs = [s for s in stream_specs if s.deliveries]
+    if delivering_specs:
+        firehose_elasticsearch = any(d.destination == 'elasticsearch' for s in delivering_specs for d in s.deliveries)
+        domain_arn = '${var.firehose_elasticsearch_domain_arn}' if firehose_elasticsearch else None
+        policy = firehoseplanner.role_policy(['${aws_kinesis_stream.%s.arn}' % s.tf_resource_name
+                                              for s in delivering_specs],
+                                             '${aws_s3_bucket.ingest_bucket.arn}',
+                                             domain_arn)
+        template_vars.update(firehose_role_policy=json.dumps(policy, indent=2),
+                             firehose_assume_role_policy=json.dumps(firehoseplanner.assume_role_policy(), indent=2),
+                             firehose_elasticsearch=firehose_elasticsearch)
+    return template_vars
+
+
+def render_streams(project_name, stream_specs, alarm_notification=None):
+    return templating.render('kinesis_stream', **stream_template_vars(project_name, stream_specs,
+                                                                       alarm_notification))
+
+
+def alarm_notification_from_vars(variable_defaults):
+    '''The AlarmNotification a streams file was rendered with, from its variable defaults.'''
+
+    if not variable_defaults.get('alarm_notification_endpoint'):
+        return None
+    return AlarmNotification(protocol=variable_defaults.get('alarm_notification_protocol'),
+                             endpoint=variable_defaults['alarm_notification_endpoint'])
+
+
 def docopt_cmd(func):
     """
     This decorator is used to simplify the try/except block and pass the result
@@ -139,10 +486,140 @@ class MakeStreamCLI(Cmd):
         Cmd.__init__(self)
         self.prompt = '%s [%s] > ' % (self.name, self.project_name)
         self.stream_specs = []
-        _ = os.system('clear')
+        self.alarm_notification = None
         #self.do_new({})
 
 
+    def preloop(self):
+        # clear the terminal without spawning a shell
+        print('\033[H\033[2J', end='')
+
+
+    def get_numeric_input(self, prompt_text, default_value, value_type=int):
+        raw_value = cli.InputPrompt(prompt_text, default_value).show()
+        try:
+            return value_type(raw_value)
+        except (TypeError, ValueError):
+            raise MissingInput('"%s" is not a valid value for %s.' % (raw_value, prompt_text))
+
+
+    def get_consumers(self):
+        '''Returns the consumer apps of a stream as (name, enhanced fan-out, KCL) tuples.'''
+
+        consumers = []
+        names = set()
+        # a KCL app names its lease table after itself, so it can only read one stream
+        kcl_apps = set(c.name for spec in self.stream_specs for c in spec.consumers if c.kcl)
+        while True:
+            consumer_name = cli.InputPrompt('consumer app name (blank when done)').show()
+            if not consumer_name:
+                return consumers
+            if consumer_name in names:
+                print('### consumer %s is already defined for this stream.' % consumer_name)
+                continue
+
+            # past the shared-consumer limit, enhanced fan-out becomes the default
+            num_shared = len([c for c in consumers if not c[1]])
+            fan_out_default = 'y' if num_shared >= kinesis.MAX_SHARED_CONSUMERS else 'n'
+            enhanced_fan_out = cli.InputPrompt('use enhanced fan-out (y/n)?', fan_out_default).show() == 'y'
+            kcl = cli.InputPrompt('does it read through the KCL (Y/n)?', 'y').show() != 'n'
+            if kcl and consumer_name in kcl_apps:
+                print('### KCL app %s already keeps its leases for another stream; pick another name.' % consumer_name)
+                continue
+            consumers.append((consumer_name, enhanced_fan_out, kcl))
+            names.add(consumer_name)
+
+
+    def get_shard_count(self, num_shared_consumers=None):
+        should_size = cli.InputPrompt('Size shards from expected throughput (Y/n)?', 'y').show()
+        if should_size == 'n':
+            return cli.InputPrompt('shard count', '1').show()
+
+        records_per_sec = self.get_numeric_input('expected peak records/sec', '1000', float)
+        avg_record_kb = self.get_numeric_input('average record size (KB)', '1', float)
+        if num_shared_consumers is None:
+            num_consumers = self.get_numeric_input('number of consumer apps', '1')
+        else:
+            # enhanced fan-out consumers do not count against the shared read limit
+            num_consumers = num_shared_consumers
+        headroom_pct = self.get_numeric_input('headroom (percent)', str(kinesis.DEFAULT_HEADROOM_PCT))
+
+        try:
+            sizing = kinesis.size_stream_shards(records_per_sec, avg_record_kb, num_consumers, headroom_pct)
+        except ValueError as err:
+            raise MissingInput(str(err))
+
+        print('\n+++ %d shard(s) required. Per-shard utilization at peak:' % sizing.shard_count)
+        print('    write records: %5.1f%%' % (sizing.write_records_util * 100))
+        print('    write bytes:   %5.1f%%' % (sizing.write_bytes_util * 100))
+        print('    read bytes:    %5.1f%% (%d shared consumer(s))\n' % (sizing.read_bytes_util * 100, num_consumers))
+        return sizing.shard_count
+
+
+    def get_deliveries(self, stream_name):
+        '''Returns the Firehose deliveries of a stream as (destination, DeliverySettings, index name) tuples.'''
+
+        deliveries = []
+        for destination, prompt_text in (('s3', 'Batch the stream into the ingest bucket with Firehose (y/N)?'),
+                                         ('elasticsearch', 'Index the stream into Elasticsearch with Firehose (y/N)?')):
+            if cli.InputPrompt(prompt_text, 'n').show() != 'y':
+                continue
+
+            index_name = None
+            if destination == 'elasticsearch':
+                index_name = cli.InputPrompt('Elasticsearch index name', stream_name).show()
+            latency = self.get_numeric_input('target delivery latency (seconds)', '300', float)
+            throughput = self.get_numeric_input('expected throughput (MB/sec)', '1', float)
+            try:
+                settings = firehoseplanner.plan_delivery(destination, latency, throughput)
+            except ValueError as err:
+                raise MissingInput(str(err))
+
+            print('\n+++ %s delivery: flush every %d MB or %d seconds%s'
+                  % (destination, settings.buffer_size_mb, settings.buffer_interval_secs,
+                     ', %s' % settings.compression if settings.compression else ''))
+            for warning in settings.warnings:
+                print('### %s' % warning)
+            print()
+            deliveries.append((destination, settings, index_name))
+        return deliveries
+
+
+    def get_shard_metrics(self):
+        should_enable = cli.InputPrompt('Enable shard-level metrics (Y/n)?', 'y').show()
+        if should_enable == 'n':
+            return []
+
+        raw_value = cli.InputPrompt('shard-level metrics (comma-separated)',
+                                    ','.join(kinesis.DEFAULT_SHARD_LEVEL_METRICS)).show()
+        metric_names = [m.strip() for m in (raw_value or '').split(',') if m.strip()]
+        unknown_metrics = [m for m in metric_names if m not in kinesis.SHARD_LEVEL_METRICS]
+        if unknown_metrics:
+            raise MissingInput('unknown shard-level metric(s) %s; choose from %s.'
+                               % (', '.join(unknown_metrics), ', '.join(kinesis.SHARD_LEVEL_METRICS)))
+        return metric_names
+
+
+    def get_alarm_notification(self):
+        should_page = cli.InputPrompt('Send the stream alarms to a pager or phone (Y/n)?', 'y').show()
+        if should_page == 'n':
+            print('### the alarms publish to an SNS topic with no subscribers; subscribe to its output ARN.')
+            return None
+
+        protocol = cli.InputPrompt('alarm notification protocol (%s)' % ' or '.join(ALARM_NOTIFICATION_PROTOCOLS),
+                                   ALARM_NOTIFICATION_PROTOCOLS[0]).show()
+        if protocol not in ALARM_NOTIFICATION_PROTOCOLS:
+            raise MissingInput('unknown alarm notification protocol "%s"; choose from %s.'
+                               % (protocol, ', '.join(ALARM_NOTIFICATION_PROTOCOLS)))
+
+        label = 'integration URL' if protocol == 'https' else 'phone number'
+        with mandatory_input(cli.InputPrompt('alarm notification %s' % label),
+                             max_retries=1,
+                             warning_message='the %s protocol requires an endpoint.' % protocol,
+                             failure_message='cancelling stream creation.') as input_result:
+            return AlarmNotification(protocol=protocol, endpoint=input_result.data)
+
+
     def do_new(self, cmd_args):
         '''Creates a new Kinesis stream spec for generating a Terraform file.
         '''
@@ -165,9 +642,27 @@ class MakeStreamCLI(Cmd):
 
             # TODO: add mandatory_type and mandatory_format context managers, factor into snap.cli module
 
-            shard_count = cli.InputPrompt('shard count', '1').show()
+            consumers = self.get_consumers()
+            deliveries = self.get_deliveries(stream_name)
+            # Firehose reads the stream like any other shared-throughput consumer
+            num_shared = None
+            if consumers or deliveries:
+                num_shared = len([c for c in consumers if not c[1]]) + len(deliveries)
+            if num_shared and num_shared > kinesis.MAX_SHARED_CONSUMERS:
+                print('### %d consumers share each shard\'s 5 reads/sec; consider enhanced fan-out.' % num_shared)
+
+            shard_count = self.get_shard_count(num_shared)
             retention_period = cli.InputPrompt('data retention period in hours', '24').show()
             stream_spec = StreamSpec(stream_name, resource_name, shard_count, retention_period)
+            for metric_name in self.get_shard_metrics():
+                stream_spec.add_shard_metric(metric_name)
+            for consumer_name, enhanced_fan_out, kcl in consumers:
+                stream_spec.add_consumer(consumer_name, enhanced_fan_out, kcl)
+            for destination, settings, index_name in deliveries:
+                stream_spec.add_delivery(destination, settings, index_name)
+            # all streams of the project alarm through one topic, so ask once
+            if not self.stream_specs:
+                self.alarm_notification = self.get_alarm_notification()
             self.stream_specs.append(stream_spec)
 
         except MissingInput as err:
@@ -179,10 +674,7 @@ class MakeStreamCLI(Cmd):
         '''Shows the created Kinesis stream specs.
         '''
 
-        j2env = jinja2.Environment()
-        template_mgr = common.JinjaTemplateManager(j2env)        
-        streamdef_template = j2env.from_string(KINESIS_STREAM_TEMPLATE)
-        output_data = streamdef_template.render(streams=self.stream_specs)
+        output_data = render_streams(self.project_name, self.stream_specs, self.alarm_notification)
         print(output_data)
         
 
@@ -203,14 +695,9 @@ class MakeStreamCLI(Cmd):
         if not len(self.stream_specs):
             output_data = '# Intentionally empty file. No Kinesis streams defined for project %s.'% self.project_name
         else:
-            j2env = jinja2.Environment()
-            template_mgr = common.JinjaTemplateManager(j2env)        
-            streamdef_template = j2env.from_string(KINESIS_STREAM_TEMPLATE)
-            output_data = streamdef_template.render(streams=self.stream_specs)
-
-        with open(self.output_file, 'w') as f:
-            f.write(output_data)
+            output_data = render_streams(self.project_name, self.stream_specs, self.alarm_notification)
 
+        artifacts.write_artifact(self.output_file, output_data)
         print('\nSaved Terraform resources to output file %s.\n' % self.output_file)
 
         
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+'''Postgres and pgbouncer settings derived from the instance type and writer concurrency.
+
+Postgres memory settings follow the usual tuning rules: a quarter of RAM for
+shared_buffers, the OS page cache counted into effective_cache_size, and work_mem
+split over the connections that can actually run queries at once. The writers
+talk to pgbouncer in transaction mode, so hundreds of short-lived client
+connections share a small server pool and Postgres does not pay for a backend
+start on every one of them.
+
+Writers log in to pgbouncer as PIPELINE_ROLE with md5 authentication. Only the md5
+hash of the role password reaches the Terraform files: the instance creates the
+role from it and writes it to the pgbouncer userlist. Once the instance is up,
+check both the pool and the server behind it:
+
+    psql -h <postgres private IP> -p 6432 -U pipeline -d postgres -c 'SELECT 1'
+    psql -h <postgres private IP> -p 6432 -U pipeline -d pgbouncer -c 'SHOW POOLS'
+'''
+
+
+import os
+import math
+import binascii
+import hashlib
+from collections import namedtuple
+import instances
+
+
+SHARED_BUFFERS_SHARE = 0.25
+EFFECTIVE_CACHE_SHARE = 0.75
+MAX_MAINTENANCE_WORK_MEM_MB = 2048
+MIN_WORK_MEM_KB = 4096
+MAX_WORK_MEM_KB = 256 * 1024
+# sorts and hashes a single query may run side by side
+WORK_MEM_OPERATIONS_PER_QUERY = 3
+
+MIN_WAL_SIZE_MB = 1024
+MAX_WAL_SIZE_MB = 16384
+
+# server connections worth running in parallel: ~2 per core plus one waiting on IO
+POOL_CONNECTIONS_PER_VCPU = 2
+MIN_POOL_SIZE = 5
+CLIENT_CONNECTION_HEADROOM = 0.25
+# connections kept free for superusers, maintenance and monitoring
+ADMIN_CONNECTIONS = 10
+
+PIPELINE_ROLE = 'pipeline'
+
+
+PostgresSettings = namedtuple('PostgresSettings', 'shared_buffers_mb effective_cache_size_mb work_mem_kb '
+                                                  'maintenance_work_mem_mb max_wal_size_mb min_wal_size_mb '
+                                                  'max_connections')
+
+PgBouncerSettings = namedtuple('PgBouncerSettings', 'pool_mode max_client_conn default_pool_size reserve_pool_size')
+
+
+def pgbouncer_settings(consumer_concurrency, vcpus):
+    default_pool_size = min(max(consumer_concurrency, 1), max(MIN_POOL_SIZE, vcpus * POOL_CONNECTIONS_PER_VCPU + 1))
+    return PgBouncerSettings(pool_mode='transaction',
+                             max_client_conn=int(math.ceil(consumer_concurrency * (1 + CLIENT_CONNECTION_HEADROOM))),
+                             default_pool_size=default_pool_size,
+                             reserve_pool_size=int(math.ceil(default_pool_size / 4.0)))
+
+
+def postgres_settings(memory_mb, max_connections):
+    shared_buffers_mb = int(memory_mb * SHARED_BUFFERS_SHARE)
+    work_mem_kb = (memory_mb - shared_buffers_mb) * 1024 // (max_connections * WORK_MEM_OPERATIONS_PER_QUERY)
+    # ingest is write-heavy: a larger WAL spreads checkpoints further apart
+    max_wal_size_mb = min(MAX_WAL_SIZE_MB, max(MIN_WAL_SIZE_MB, memory_mb // 2))
+    return PostgresSettings(shared_buffers_mb=shared_buffers_mb,
+                            effective_cache_size_mb=int(memory_mb * EFFECTIVE_CACHE_SHARE),
+                            work_mem_kb=min(MAX_WORK_MEM_KB, max(MIN_WORK_MEM_KB, work_mem_kb)),
+                            maintenance_work_mem_mb=min(MAX_MAINTENANCE_WORK_MEM_MB, memory_mb // 16),
+                            max_wal_size_mb=max_wal_size_mb,
+                            min_wal_size_mb=max_wal_size_mb // 4,
+                            max_connections=max_connections)
+
+
+def plan_postgres_tier(type_name, consumer_concurrency):
+    '''Returns (PostgresSettings, PgBouncerSettings). Postgres only needs connections
+    for the pgbouncer server pool, which leaves more memory to each of them.
+    '''
+
+    instance_type = instances.lookup(type_name)
+    bouncer = pgbouncer_settings(consumer_concurrency, instance_type.vcpus)
+    max_connections = bouncer.default_pool_size + bouncer.reserve_pool_size + ADMIN_CONNECTIONS
+    return postgres_settings(instances.memory_mb(type_name), max_connections), bouncer
+
+
+def generate_password():
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+def md5_password(role, password):
+    '''The md5 password hash that both CREATE ROLE and the pgbouncer userlist accept.'''
+
+    return 'md5' + hashlib.md5((password + role).encode('utf-8')).hexdigest()
+
+
+def terraform_vars(type_name, consumer_concurrency, cluster_size, password=''):
+    '''The (name, value) project variables for the Postgres tier in main.tf.'''
+
+    postgres, bouncer = plan_postgres_tier(type_name, consumer_concurrency)
+    return [
+        ('postgres_cluster_size', cluster_size),
+        ('postgres_instance_type', type_name),
+        ('postgres_shared_buffers', '%dMB' % postgres.shared_buffers_mb),
+        ('postgres_effective_cache_size', '%dMB' % postgres.effective_cache_size_mb),
+        ('postgres_work_mem', '%dkB' % postgres.work_mem_kb),
+        ('postgres_maintenance_work_mem', '%dMB' % postgres.maintenance_work_mem_mb),
+        ('postgres_max_wal_size', '%dMB' % postgres.max_wal_size_mb),
+        ('postgres_min_wal_size', '%dMB' % postgres.min_wal_size_mb),
+        ('postgres_max_connections', postgres.max_connections),
+        ('pgbouncer_pool_mode', bouncer.pool_mode),
+        ('pgbouncer_max_client_conn', bouncer.max_client_conn),
+        ('pgbouncer_default_pool_size', bouncer.default_pool_size),
+        ('pgbouncer_reserve_pool_size', bouncer.reserve_pool_size),
+        ('postgres_pipeline_role', PIPELINE_ROLE),
+        ('postgres_pipeline_password_md5', md5_password(PIPELINE_ROLE, password) if password else '')
+    ]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+'''Redis cache tier settings derived from the instance type and the read access pattern.
+
+maxmemory leaves room for the OS and for the copy-on-write pages of a background
+save or a replica resync, which can approach the dataset size under heavy writes.
+The eviction policy follows how the query consumers read: skewed hot-key reads
+keep the most frequently used keys, recency-driven reads the most recently used.
+'''
+
+
+from collections import namedtuple
+import instances
+
+
+# share of memory kept out of maxmemory, but never less than OS_RESERVED_MB
+MEMORY_OVERHEAD_SHARE = 0.25
+OS_RESERVED_MB = 256
+
+# access pattern -> maxmemory-policy
+EVICTION_POLICIES = {
+    'hot-keys': 'allkeys-lfu',
+    'recent': 'allkeys-lru',
+    'expiring': 'volatile-ttl',
+    'uniform': 'allkeys-random'
+}
+
+DEFAULT_ACCESS_PATTERN = 'hot-keys'
+
+# the Bitnami Redis AMI in machines.tf runs Redis 3.2, which refuses to start with
+# an LFU policy; LRU is the closest policy it has
+DEFAULT_REDIS_VERSION = '3.2'
+MIN_LFU_VERSION = (4, 0)
+LFU_FALLBACK_POLICIES = {'allkeys-lfu': 'allkeys-lru', 'volatile-lfu': 'volatile-lru'}
+
+
+RedisSettings = namedtuple('RedisSettings', 'maxmemory_mb maxmemory_policy num_replicas')
+
+
+class UnknownAccessPattern(Exception):
+    def __init__(self, access_pattern):
+        Exception.__init__(self, 'unknown access pattern "%s" (known: %s).'
+                           % (access_pattern, ', '.join(sorted(EVICTION_POLICIES))))
+
+
+def maxmemory_mb(memory_mb):
+    overhead_mb = max(OS_RESERVED_MB, int(memory_mb * MEMORY_OVERHEAD_SHARE))
+    return max(0, memory_mb - overhead_mb)
+
+
+def version_tuple(version):
+    return tuple(int(part) for part in str(version).split('.')[:2])
+
+
+def eviction_policy(access_pattern, redis_version=DEFAULT_REDIS_VERSION):
+    if access_pattern not in EVICTION_POLICIES:
+        raise UnknownAccessPattern(access_pattern)
+    policy = EVICTION_POLICIES[access_pattern]
+    if version_tuple(redis_version) < MIN_LFU_VERSION:
+        policy = LFU_FALLBACK_POLICIES.get(policy, policy)
+    return policy
+
+
+def plan_redis_tier(type_name, access_pattern=DEFAULT_ACCESS_PATTERN, num_replicas=0,
+                    redis_version=DEFAULT_REDIS_VERSION):
+    return RedisSettings(maxmemory_mb=maxmemory_mb(instances.memory_mb(type_name)),
+                         maxmemory_policy=eviction_policy(access_pattern, redis_version),
+                         num_replicas=num_replicas)
+
+
+def terraform_vars(type_name, access_pattern, num_replicas, enabled, password='',
+                   redis_version=DEFAULT_REDIS_VERSION):
+    '''The (name, value) project variables for the Redis tier in main.tf. The primary
+    and its replicas share <password> for both requirepass and masterauth.
+    '''
+
+    redis = plan_redis_tier(type_name, access_pattern, num_replicas, redis_version)
+    return [
+        ('redis_primary_count', 1 if enabled else 0),
+        ('redis_replica_count', redis.num_replicas if enabled else 0),
+        ('redis_instance_type', type_name),
+        ('redis_maxmemory', '%dmb' % redis.maxmemory_mb),
+        ('redis_maxmemory_policy', redis.maxmemory_policy),
+        ('redis_password', password)
+    ]
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+'''Kinesis resharding plans derived from exported per-shard write metrics.
+
+The export holds one row per shard and period, with the IncomingBytes and
+IncomingRecords sums CloudWatch reports for that period. Rows are pivoted into a
+(period x shard) grid with numpy, so a month of per-minute data for a large stream
+is reduced to per-shard and whole-stream peaks in a few array passes.
+
+When the load is spread evenly over the shards, the plan is a sequence of
+UpdateShardCount calls with uniform scaling. When a few shards run hot, uniform
+scaling would add shards everywhere to relieve a handful, so the plan splits the
+hot shards at the middle of their hash key range and merges adjacent cold pairs.
+'''
+
+
+import csv
+import json
+import math
+from collections import namedtuple
+import kinesis
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+
+
+DEFAULT_TARGET_UTILIZATION_PCT = 80
+DEFAULT_PERIOD_SECS = 60
+DEFAULT_PEAK_PERCENTILE = 100
+
+# max/mean ratio of the per-shard peaks below which the load counts as even
+SKEW_TOLERANCE = 1.25
+
+# UpdateShardCount can at most double or halve the open shards in a single call
+MAX_SCALING_FACTOR = 2
+
+# timestamps and shard IDs are factorized as short byte strings, which sort several
+# times faster than wide unicode arrays; 32 bytes hold an ISO 8601 timestamp with
+# microseconds and a UTC offset
+LABEL_DTYPE = 'S32'
+
+# export column -> accepted header names, compared lowercased without punctuation
+METRIC_COLUMNS = {
+    'timestamp': ('timestamp', 'time', 'period'),
+    'shard_id': ('shardid', 'shard'),
+    'incoming_bytes': ('incomingbytes', 'bytes'),
+    'incoming_records': ('incomingrecords', 'records')
+}
+
+
+ShardMetrics = namedtuple('ShardMetrics', 'shard_ids num_periods incoming_bytes incoming_records')
+ShardLoad = namedtuple('ShardLoad', 'shard_id hash_key_range peak_bytes_per_sec peak_records_per_sec utilization')
+ReshardOperation = namedtuple('ReshardOperation', 'action args')
+ReshardPlan = namedtuple('ReshardPlan', 'strategy current_shard_count target_shard_count stream_utilization '
+                                        'skew shard_loads operations warnings')
+
+
+class ReshardPlanningError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def normalize_header(name):
+    return ''.join(c for c in name.lower() if c.isalnum())
+
+
+def column_positions(header):
+    names = [normalize_header(h) for h in header]
+    positions = {}
+    for column, aliases in METRIC_COLUMNS.items():
+        matches = [i for i, name in enumerate(names) if name in aliases]
+        if not matches:
+            raise ReshardPlanningError('the metrics export has no %s column (header: %s).'
+                                       % (column, ', '.join(header)))
+        positions[column] = matches[0]
+    return positions
+
+
+def read_csv_columns(filename):
+    with open(filename, 'r', newline='') as f:
+        header = next(csv.reader(f), None)
+        if header is None:
+            raise ReshardPlanningError('the metrics export %s is empty.' % filename)
+        positions = column_positions(header)
+
+        # numpy's C reader parses the rows; fields come back in usecols order
+        ordered = sorted(positions, key=positions.get)
+        dtype = [(column, LABEL_DTYPE if column in ('timestamp', 'shard_id') else 'f8') for column in ordered]
+        try:
+            rows = np.loadtxt(f, delimiter=',', quotechar='"', dtype=dtype, ndmin=1,
+                              usecols=[positions[column] for column in ordered])
+        except ValueError as err:
+            raise ReshardPlanningError('bad row in the metrics export %s: %s' % (filename, err))
+
+    if not len(rows):
+        raise ReshardPlanningError('the metrics export %s has no data rows.' % filename)
+    return {column: rows[column] for column in ordered}
+
+
+def read_json_columns(filename):
+    '''Accepts either a list of row objects or an object of equal-length column lists.'''
+
+    with open(filename, 'r') as f:
+        data = json.load(f)
+
+    if isinstance(data, list):
+        if not data:
+            raise ReshardPlanningError('the metrics export %s has no data rows.' % filename)
+        keys = list(data[0].keys())
+        positions = column_positions(keys)
+        return {column: [row[keys[position]] for row in data] for column, position in positions.items()}
+
+    keys = list(data.keys())
+    positions = column_positions(keys)
+    return {column: data[keys[position]] for column, position in positions.items()}
+
+
+def load_shard_metrics(filename):
+    columns = read_json_columns(filename) if filename.endswith('.json') else read_csv_columns(filename)
+
+    try:
+        incoming_bytes = np.asarray(columns['incoming_bytes'], dtype=np.float64)
+        incoming_records = np.asarray(columns['incoming_records'], dtype=np.float64)
+    except ValueError as err:
+        raise ReshardPlanningError('bad metric value in %s: %s' % (filename, err))
+
+    period_keys, period_index = np.unique(np.asarray(columns['timestamp'], dtype=LABEL_DTYPE),
+                                          return_inverse=True)
+    shard_ids, shard_index = np.unique(np.asarray(columns['shard_id'], dtype=LABEL_DTYPE),
+                                       return_inverse=True)
+
+    # pivot into (period x shard) grids; duplicate rows for a period are summed
+    num_periods, num_shards = len(period_keys), len(shard_ids)
+    cells = period_index.ravel() * num_shards + shard_index.ravel()
+    grid_size = num_periods * num_shards
+    bytes_grid = np.bincount(cells, weights=incoming_bytes, minlength=grid_size).reshape(num_periods, num_shards)
+    records_grid = np.bincount(cells, weights=incoming_records, minlength=grid_size).reshape(num_periods, num_shards)
+
+    return ShardMetrics(shard_ids=[s.decode('ascii') for s in shard_ids],
+                        num_periods=num_periods,
+                        incoming_bytes=bytes_grid,
+                        incoming_records=records_grid)
+
+
+def required_shard_count(peak_bytes_per_sec, peak_records_per_sec, target_util):
+    required = max(peak_bytes_per_sec / (kinesis.SHARD_WRITE_BYTES_PER_SEC * target_util),
+                   peak_records_per_sec / (kinesis.SHARD_WRITE_RECORDS_PER_SEC * target_util))
+    return max(1, int(math.ceil(round(required, 9))))
+
+
+def update_shard_count_steps(current_count, target_count):
+    '''The shard counts to pass to successive UpdateShardCount calls.'''
+
+    steps = []
+    count = current_count
+    while count != target_count:
+        if target_count > count:
+            count = min(target_count, count * MAX_SCALING_FACTOR)
+        else:
+            count = max(target_count, int(math.ceil(count / float(MAX_SCALING_FACTOR))))
+        steps.append(count)
+    return steps
+
+
+def split_merge_operations(shard_loads, target_util):
+    '''Splits every shard above <target_util> in the middle of its hash key range and
+    merges adjacent pairs (in hash key order) that together stay below half of it,
+    so that merged shards keep room to grow.
+    '''
+
+    operations = []
+    for load in shard_loads:
+        if load.utilization > target_util:
+            r = load.hash_key_range
+            operations.append(ReshardOperation('split-shard', {
+                'shard-to-split': load.shard_id,
+                'new-starting-hash-key': str((r.starting_hash_key + r.ending_hash_key + 1) // 2)
+            }))
+
+    i = 0
+    while i < len(shard_loads) - 1:
+        first, second = shard_loads[i], shard_loads[i + 1]
+        adjacent = first.hash_key_range.ending_hash_key + 1 == second.hash_key_range.starting_hash_key
+        if adjacent and first.utilization + second.utilization < target_util / 2.0:
+            operations.append(ReshardOperation('merge-shards', {
+                'shard-to-merge': first.shard_id,
+                'adjacent-shard-to-merge': second.shard_id
+            }))
+            i += 2
+        else:
+            i += 1
+    return operations
+
+
+def plan_resharding(metrics, hash_key_ranges, target_util_pct=DEFAULT_TARGET_UTILIZATION_PCT,
+                    period_secs=DEFAULT_PERIOD_SECS, peak_percentile=DEFAULT_PEAK_PERCENTILE):
+    '''Returns a ReshardPlan for the stream whose open shards have the given
+    {shard ID: HashKeyRange} map.
+    '''
+
+    if not 0 < target_util_pct <= 100:
+        raise ReshardPlanningError('target utilization must be a percentage in the range (0, 100].')
+    if not 0 <= peak_percentile <= 100:
+        raise ReshardPlanningError('the peak percentile must be in the range [0, 100].')
+    if period_secs <= 0:
+        raise ReshardPlanningError('the metrics period must be a positive number of seconds.')
+
+    target_util = target_util_pct / 100.0
+    warnings = []
+
+    unknown_shards = [s for s in metrics.shard_ids if s not in hash_key_ranges]
+    if unknown_shards:
+        warnings.append('ignoring metrics for %d shard(s) that are not open in the shard map, e.g. %s.'
+                        % (len(unknown_shards), unknown_shards[0]))
+    columns = [i for i, s in enumerate(metrics.shard_ids) if s in hash_key_ranges]
+    if not columns:
+        raise ReshardPlanningError('none of the shards in the metrics export are in the shard map.')
+
+    bytes_per_sec = metrics.incoming_bytes[:, columns] / period_secs
+    records_per_sec = metrics.incoming_records[:, columns] / period_secs
+
+    shard_peak_bytes = np.percentile(bytes_per_sec, peak_percentile, axis=0)
+    shard_peak_records = np.percentile(records_per_sec, peak_percentile, axis=0)
+    shard_util = np.maximum(shard_peak_bytes / kinesis.SHARD_WRITE_BYTES_PER_SEC,
+                            shard_peak_records / kinesis.SHARD_WRITE_RECORDS_PER_SEC)
+
+    # the stream peak is taken over the summed rows: shards rarely all peak in the same period
+    stream_peak_bytes = float(np.percentile(bytes_per_sec.sum(axis=1), peak_percentile))
+    stream_peak_records = float(np.percentile(records_per_sec.sum(axis=1), peak_percentile))
+
+    shard_loads = [ShardLoad(shard_id=metrics.shard_ids[c],
+                             hash_key_range=hash_key_ranges[metrics.shard_ids[c]],
+                             peak_bytes_per_sec=float(shard_peak_bytes[i]),
+                             peak_records_per_sec=float(shard_peak_records[i]),
+                             utilization=float(shard_util[i]))
+                   for i, c in enumerate(columns)]
+
+    # idle shards still take part in merges with their neighbours
+    measured_shards = set(load.shard_id for load in shard_loads)
+    missing_shards = [s for s in hash_key_ranges if s not in measured_shards]
+    if missing_shards:
+        warnings.append('%d open shard(s) have no metrics and are treated as idle.' % len(missing_shards))
+    shard_loads.extend(ShardLoad(shard_id=shard_id,
+                                 hash_key_range=hash_key_ranges[shard_id],
+                                 peak_bytes_per_sec=0.0,
+                                 peak_records_per_sec=0.0,
+                                 utilization=0.0)
+                       for shard_id in missing_shards)
+    shard_loads.sort(key=lambda load: load.hash_key_range.starting_hash_key)
+
+    current_count = len(hash_key_ranges)
+    target_count = required_shard_count(stream_peak_bytes, stream_peak_records, target_util)
+    mean_util = float(shard_util.sum()) / current_count
+    skew = float(shard_util.max()) / mean_util if mean_util else 1.0
+    stream_util = max(stream_peak_bytes / (kinesis.SHARD_WRITE_BYTES_PER_SEC * current_count),
+                      stream_peak_records / (kinesis.SHARD_WRITE_RECORDS_PER_SEC * current_count))
+
+    if skew <= SKEW_TOLERANCE:
+        operations = [ReshardOperation('update-shard-count', {'target-shard-count': str(count),
+                                                              'scaling-type': 'UNIFORM_SCALING'})
+                      for count in update_shard_count_steps(current_count, target_count)]
+        strategy = 'uniform' if operations else 'none'
+    else:
+        operations = split_merge_operations(shard_loads, target_util)
+        strategy = 'split-merge' if operations else 'none'
+        target_count = current_count + sum(1 if op.action == 'split-shard' else -1 for op in operations)
+        too_hot = [load.shard_id for load in shard_loads if load.utilization > 2 * target_util]
+        if too_hot:
+            warnings.append('%s still exceed the target after one split; re-plan from fresh metrics '
+                            'once the split has finished.' % ', '.join(too_hot))
+
+    return ReshardPlan(strategy=strategy,
+                       current_shard_count=current_count,
+                       target_shard_count=target_count,
+                       stream_utilization=stream_util,
+                       skew=skew,
+                       shard_loads=shard_loads,
+                       operations=operations,
+                       warnings=warnings)
+
+
+def shard_map_from_list_shards(filename):
+    '''Reads the {shard ID: HashKeyRange} map of the open shards from the output of
+    "aws kinesis list-shards" (or describe-stream).
+    '''
+
+    with open(filename, 'r') as f:
+        data = json.load(f)
+
+    shards = data.get('Shards') or (data.get('StreamDescription') or {}).get('Shards') or []
+    shard_map = {}
+    for shard in shards:
+        # closed shards keep an ending sequence number and take no more writes
+        if (shard.get('SequenceNumberRange') or {}).get('EndingSequenceNumber'):
+            continue
+        hash_range = shard['HashKeyRange']
+        shard_map[shard['ShardId']] = kinesis.HashKeyRange(int(hash_range['StartingHashKey']),
+                                                           int(hash_range['EndingHashKey']))
+    if not shard_map:
+        raise ReshardPlanningError('no open shards found in %s.' % filename)
+    return shard_map
+
+
+def initial_shard_map(shard_count):
+    '''The shard map of a stream that has not been resharded since it was created.'''
+
+    return dict(zip(kinesis.initial_shard_ids(shard_count), kinesis.even_hash_ranges(shard_count)))
+
+
+def cli_commands(stream_name, plan):
+    return ['aws kinesis %s --stream-name %s %s'
+            % (op.action, stream_name, ' '.join('--%s %s' % item for item in sorted(op.args.items())))
+            for op in plan.operations]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+'''S3 ingest bucket layout and transfer settings derived from the expected object
+rate and size.
+
+S3 scales request capacity per key prefix, so a bucket written under a single
+prefix tops out at a few thousand PUTs per second no matter how many producers
+there are. Object keys therefore start with a hash partition, one of enough
+prefixes to keep each below PREFIX_TARGET_UTILIZATION of the published limit,
+followed by the hour the object was written. Lifecycle rules clean up the parts
+of abandoned multipart uploads and move ingest data to cheaper storage classes
+once the pipeline no longer reads it.
+'''
+
+
+import math
+import hashlib
+from collections import namedtuple
+
+
+# request rates per key prefix, as published by AWS
+PUTS_PER_PREFIX_PER_SEC = 3500
+GETS_PER_PREFIX_PER_SEC = 5500
+PREFIX_TARGET_UTILIZATION = 0.5
+
+# transfer acceleration only pays off for producers far from the bucket's region
+# and objects large enough for the transfer, not the request, to dominate
+ACCELERATION_MIN_OBJECT_KB = 1024
+
+# objects above this size should be uploaded in parts; S3 allows 10,000 parts per upload
+MULTIPART_THRESHOLD_MB = 100
+MIN_PART_SIZE_MB = 8
+MAX_PARTS = 10000
+
+DEFAULT_ABORT_MULTIPART_DAYS = 7
+DEFAULT_COLD_AFTER_DAYS = 30
+DEFAULT_ARCHIVE_AFTER_DAYS = 90
+# S3 accepts STANDARD_IA transitions only for objects at least this old, and bills
+# smaller objects there as if they were this large
+MIN_IA_TRANSITION_DAYS = 30
+MIN_IA_BILLABLE_KB = 128
+
+# also written to the bucket tags, which allow no placeholder brackets
+KEY_LAYOUT = 'partition/yyyy/mm/dd/hh/object'
+
+
+IngestLayout = namedtuple('IngestLayout', 'prefix_count prefix_width put_utilization accelerate part_size_mb '
+                                          'abort_multipart_days ia_days archive_days warnings')
+
+
+def prefix_count(objects_per_sec):
+    return max(1, int(math.ceil(objects_per_sec / (PUTS_PER_PREFIX_PER_SEC * PREFIX_TARGET_UTILIZATION))))
+
+
+def prefix_width(num_prefixes):
+    '''Hex digits needed to name <num_prefixes> partitions.'''
+
+    return max(1, int(math.ceil(math.log(num_prefixes, 16)))) if num_prefixes > 1 else 1
+
+
+def part_size_mb(avg_object_kb):
+    if avg_object_kb < MULTIPART_THRESHOLD_MB * 1024:
+        return None
+    return max(MIN_PART_SIZE_MB, int(math.ceil(avg_object_kb / 1024.0 / MAX_PARTS)))
+
+
+def plan_ingest_layout(bucket_name, objects_per_sec, avg_object_kb, remote_producers=False,
+                       cold_after_days=DEFAULT_COLD_AFTER_DAYS, archive_after_days=DEFAULT_ARCHIVE_AFTER_DAYS,
+                       abort_multipart_days=DEFAULT_ABORT_MULTIPART_DAYS):
+    '''Returns the IngestLayout for the ingest bucket. A cold_after_days or
+    archive_after_days of 0 leaves out the corresponding storage class transition.
+    '''
+
+    if objects_per_sec < 0 or avg_object_kb < 0:
+        raise ValueError('ingest object rate and size must be non-negative.')
+    if cold_after_days < 0 or archive_after_days < 0 or abort_multipart_days < 0:
+        raise ValueError('lifecycle transition days must be non-negative.')
+
+    warnings = []
+    num_prefixes = prefix_count(objects_per_sec)
+
+    accelerate = bool(remote_producers and avg_object_kb >= ACCELERATION_MIN_OBJECT_KB)
+    if accelerate and '.' in bucket_name:
+        warnings.append('bucket names with dots cannot use transfer acceleration; leaving it off.')
+        accelerate = False
+
+    ia_days = cold_after_days
+    if ia_days and ia_days < MIN_IA_TRANSITION_DAYS:
+        warnings.append('STANDARD_IA transitions need objects at least %d days old; using %d.'
+                        % (MIN_IA_TRANSITION_DAYS, MIN_IA_TRANSITION_DAYS))
+        ia_days = MIN_IA_TRANSITION_DAYS
+    if ia_days and avg_object_kb < MIN_IA_BILLABLE_KB:
+        warnings.append('objects average %.0f KB, below the %d KB STANDARD_IA minimum; skipping that transition.'
+                        % (avg_object_kb, MIN_IA_BILLABLE_KB))
+        ia_days = 0
+
+    archive_days = archive_after_days
+    if archive_days and ia_days and archive_days < ia_days + MIN_IA_TRANSITION_DAYS:
+        # objects must stay in STANDARD_IA for 30 days before moving on
+        archive_days = ia_days + MIN_IA_TRANSITION_DAYS
+        warnings.append('archiving after %d days, %d days after the STANDARD_IA transition.'
+                        % (archive_days, MIN_IA_TRANSITION_DAYS))
+
+    return IngestLayout(prefix_count=num_prefixes,
+                        prefix_width=prefix_width(num_prefixes),
+                        put_utilization=objects_per_sec / float(num_prefixes * PUTS_PER_PREFIX_PER_SEC),
+                        accelerate=accelerate,
+                        part_size_mb=part_size_mb(avg_object_kb),
+                        abort_multipart_days=abort_multipart_days,
+                        ia_days=ia_days,
+                        archive_days=archive_days,
+                        warnings=warnings)
+
+
+def object_key(object_name, timestamp, num_prefixes):
+    '''The key an ingest producer writes <object_name> under; <timestamp> is a datetime.'''
+
+    partition = int(hashlib.md5(object_name.encode('utf-8')).hexdigest(), 16) % num_prefixes
+    return '%0*x/%s/%s' % (prefix_width(num_prefixes), partition, timestamp.strftime('%Y/%m/%d/%H'), object_name)
+
+
+def terraform_vars(layout):
+    '''The (name, value) project variables for the ingest bucket in main.tf.'''
+
+    return [
+        ('ingest_key_prefix_count', layout.prefix_count),
+        ('ingest_key_layout', KEY_LAYOUT),
+        ('ingest_acceleration_status', 'Enabled' if layout.accelerate else 'Suspended'),
+        ('ingest_abort_multipart_days', layout.abort_multipart_days),
+        ('ingest_ia_transition_enabled', 'true' if layout.ia_days else 'false'),
+        ('ingest_ia_transition_days', layout.ia_days or MIN_IA_TRANSITION_DAYS),
+        ('ingest_archive_enabled', 'true' if layout.archive_days else 'false'),
+        ('ingest_archive_days', layout.archive_days or DEFAULT_ARCHIVE_AFTER_DAYS)
+    ]
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    templatebench.py [--iterations=<n>] [--streams=<n>]
+
+Options:
+    --iterations=<n>    number of renders to time for each strategy [default: 200]
+    --streams=<n>       number of stream specs to render per call [default: 10]
+
+Compares per-call template compilation (a fresh jinja2.Environment and from_string
+on every render) against the shared templating registry, with and without the
+on-disk bytecode cache.
+'''
+
+
+import tempfile
+import timeit
+import jinja2
+import templating
+from mkstream import KINESIS_STREAM_TEMPLATE, StreamSpec, stream_template_vars
+from lazyimport import lazy_import
+
+docopt = lazy_import('docopt')
+
+
+def render_per_call(streams):
+    j2env = jinja2.Environment()
+    return j2env.from_string(KINESIS_STREAM_TEMPLATE).render(**stream_template_vars('bench', streams))
+
+
+def cold_compile(bytecode_cache_dir=None):
+    registry = templating.TemplateRegistry(bytecode_cache_dir)
+    registry.register('kinesis_stream', KINESIS_STREAM_TEMPLATE)
+    return registry.get('kinesis_stream')
+
+
+def main(args):
+    iterations = int(args['--iterations'])
+    streams = [StreamSpec('stream_%d' % i, 'stream_%d' % i, 2) for i in range(int(args['--streams']))]
+
+    per_call = timeit.timeit(lambda: render_per_call(streams), number=iterations)
+    cached = timeit.timeit(lambda: templating.render('kinesis_stream', **stream_template_vars('bench', streams)), number=iterations)
+
+    print('____ %d renders of %d stream specs:\n' % (iterations, len(streams)))
+    print('  per-call compile:     %8.2f ms total, %7.3f ms/render' % (per_call * 1000, per_call * 1000 / iterations))
+    print('  shared registry:      %8.2f ms total, %7.3f ms/render' % (cached * 1000, cached * 1000 / iterations))
+    print('  speedup:              %8.1fx\n' % (per_call / cached))
+
+    # a cold start is modelled by a brand-new registry; the bytecode cache is warmed once first
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold_compile(cache_dir)
+        no_cache = timeit.timeit(cold_compile, number=iterations)
+        with_cache = timeit.timeit(lambda: cold_compile(cache_dir), number=iterations)
+
+    print('____ cold-start template load (new environment each time):\n')
+    print('  compile from source:  %7.3f ms' % (no_cache * 1000 / iterations))
+    print('  load from bytecode:   %7.3f ms' % (with_cache * 1000 / iterations))
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+'''Shared Jinja2 template registry for the generator scripts.
+
+Templates are registered once by name. They are compiled on first use by a single
+environment and the compiled template is reused for every later render. Setting
+MERCURY_TEMPLATE_CACHE to a directory also stores compiled bytecode on disk, so
+a fresh CLI process can skip compilation entirely.
+'''
+
+
+import os
+
+
+TEMPLATE_CACHE_ENV_VAR = 'MERCURY_TEMPLATE_CACHE'
+
+
+class UnregisteredTemplate(Exception):
+    def __init__(self, template_name):
+        Exception.__init__(self, 'no template registered under the name "%s".' % template_name)
+
+
+class TemplateRegistry(object):
+    def __init__(self, bytecode_cache_dir=None):
+        self.bytecode_cache_dir = bytecode_cache_dir
+        self._sources = {}
+        self._compiled = {}
+        self._environment = None
+
+
+    @property
+    def environment(self):
+        if self._environment is None:
+            import jinja2
+
+            bytecode_cache = None
+            if self.bytecode_cache_dir:
+                os.makedirs(self.bytecode_cache_dir, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(self.bytecode_cache_dir)
+            # _compiled is the only template cache, so register() can replace a template
+            self._environment = jinja2.Environment(loader=jinja2.FunctionLoader(self._load_source),
+                                                   bytecode_cache=bytecode_cache,
+                                                   cache_size=0,
+                                                   auto_reload=False)
+        return self._environment
+
+
+    def _load_source(self, template_name):
+        source = self._sources.get(template_name)
+        if source is None:
+            return None
+        return (source, None, lambda: True)
+
+
+    def register(self, template_name, template_source):
+        if self._sources.get(template_name) != template_source:
+            self._sources[template_name] = template_source
+            self._compiled.pop(template_name, None)
+
+
+    def get(self, template_name):
+        template = self._compiled.get(template_name)
+        if template is None:
+            if template_name not in self._sources:
+                raise UnregisteredTemplate(template_name)
+            template = self.environment.get_template(template_name)
+            self._compiled[template_name] = template
+        return template
+
+
+    def render(self, template_name, **context):
+        return self.get(template_name).render(**context)
+
+
+
+registry = TemplateRegistry(os.environ.get(TEMPLATE_CACHE_ENV_VAR))
+
+
+def register(template_name, template_source):
+    registry.register(template_name, template_source)
+
+
+def get(template_name):
+    return registry.get(template_name)
+
+
+def render(template_name, **context):
+    return registry.render(template_name, **context)
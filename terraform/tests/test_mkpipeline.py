@@ -0,0 +1,62 @@
+import kinesis
+import mkpipeline
+
+
+def stream_data(**fields):
+    data = {'name': 'test-stream',
+            'resource_name': 'test_stream',
+            'throughput': {'records_per_sec': 5000, 'avg_record_kb': 8}}
+    data.update(fields)
+    return data
+
+
+def sized_consumer_count(monkeypatch, data):
+    '''The number of shared readers read_stream_spec sizes the stream for.'''
+
+    sized_for = []
+    size_stream_shards = kinesis.size_stream_shards
+
+    def recording_size_stream_shards(records_per_sec, avg_record_kb, num_consumers, *args):
+        sized_for.append(num_consumers)
+        return size_stream_shards(records_per_sec, avg_record_kb, num_consumers, *args)
+
+    monkeypatch.setattr(kinesis, 'size_stream_shards', recording_size_stream_shards)
+    mkpipeline.read_stream_spec(data)
+    return sized_for[0]
+
+
+def test_stream_without_readers_is_sized_for_one_consumer(monkeypatch):
+    assert sized_consumer_count(monkeypatch, stream_data()) == 1
+
+
+def test_deliveries_without_consumers_count_as_shared_readers(monkeypatch):
+    deliveries = [{'destination': 's3'}, {'destination': 'elasticsearch'}]
+
+    assert sized_consumer_count(monkeypatch, stream_data(deliveries=deliveries)) == 2
+
+
+def test_deliveries_add_to_shared_consumers_but_not_enhanced_fan_out(monkeypatch):
+    consumers = [{'name': 'shared-app'}, {'name': 'efo-app', 'enhanced_fan_out': True}]
+    data = stream_data(consumers=consumers, deliveries=[{'destination': 's3'}])
+
+    assert sized_consumer_count(monkeypatch, data) == 2
+
+
+
+def test_alarm_notification_subscribes_the_alarm_topic():
+    pipeline_spec = {'project': {'name': 'apollo', 'ssh_keyname': 'id_rsa'},
+                     'streams': [{'name': 'test-stream', 'resource_name': 'test_stream'}],
+                     'alarm_notification': {'protocol': 'sms', 'endpoint': '+15555550100'}}
+    _, streams_data = mkpipeline.render_pipeline(pipeline_spec)
+
+    assert 'resource "aws_sns_topic_subscription" "apollo_stream_alarms"' in streams_data
+    assert 'default = "+15555550100"' in streams_data
+
+
+def test_alarm_topic_without_notification_is_only_output():
+    pipeline_spec = {'project': {'name': 'apollo', 'ssh_keyname': 'id_rsa'},
+                     'streams': [{'name': 'test-stream', 'resource_name': 'test_stream'}]}
+    _, streams_data = mkpipeline.render_pipeline(pipeline_spec)
+
+    assert 'aws_sns_topic_subscription' not in streams_data
+    assert 'output "apollo_stream_alarms_topic_arn"' in streams_data
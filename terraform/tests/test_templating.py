@@ -0,0 +1,11 @@
+import templating
+
+
+def test_reregistering_a_rendered_template_replaces_it():
+    registry = templating.TemplateRegistry()
+    registry.register('greeting', 'hello {{ name }}')
+    assert registry.render('greeting', name='apollo') == 'hello apollo'
+
+    registry.register('greeting', 'goodbye {{ name }}')
+
+    assert registry.render('greeting', name='apollo') == 'goodbye apollo'
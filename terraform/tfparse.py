@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+'''Minimal reader for the Terraform (HCL 1) files in this directory.
+
+Only what the generators need is supported: top-level blocks with quoted labels,
+attribute assignments, nested blocks and maps. Strings and heredocs keep their
+"${...}" interpolations verbatim, lists are returned as raw text and no
+expressions are evaluated.
+'''
+
+
+import os
+import glob
+from collections import namedtuple
+
+
+class TerraformParseError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+TerraformBlock = namedtuple('TerraformBlock', 'block_type labels body')
+
+
+def heredoc_end(source, start):
+    '''For a heredoc opening at <start> ("<<MARKER" or "<<-MARKER"), returns the offset
+    where its body starts, the offset just past its closing marker, and the body.
+    '''
+
+    header_end = source.find('\n', start)
+    if header_end < 0:
+        raise TerraformParseError('unterminated heredoc starting at offset %d.' % start)
+    marker = source[start + 2:header_end].strip().lstrip('-')
+    body_start = header_end + 1
+    pos = body_start
+    while pos < len(source):
+        line_end = source.find('\n', pos)
+        if line_end < 0:
+            line_end = len(source)
+        if source[pos:line_end].strip() == marker:
+            return body_start, line_end, source[body_start:pos]
+        pos = line_end + 1
+    raise TerraformParseError('heredoc %s starting at offset %d is never closed.' % (marker, start))
+
+
+def strip_comments(source):
+    '''Removes #, // and /* */ comments, leaving string and heredoc contents untouched.'''
+
+    output = []
+    i = 0
+    in_string = False
+    interpolation_depth = 0
+    while i < len(source):
+        c = source[i]
+        if in_string:
+            output.append(c)
+            if c == '\\':
+                output.append(source[i + 1:i + 2])
+                i += 2
+                continue
+            if source.startswith('${', i):
+                interpolation_depth += 1
+                output.append('{')
+                i += 2
+                continue
+            if c == '}' and interpolation_depth:
+                interpolation_depth -= 1
+            elif c == '"' and not interpolation_depth:
+                in_string = False
+            i += 1
+        elif c == '"':
+            in_string = True
+            output.append(c)
+            i += 1
+        elif source.startswith('<<', i):
+            _, end, _ = heredoc_end(source, i)
+            output.append(source[i:end])
+            i = end
+        elif c == '#' or source.startswith('//', i):
+            while i < len(source) and source[i] != '\n':
+                i += 1
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = len(source) if end < 0 else end + 2
+        else:
+            output.append(c)
+            i += 1
+    return ''.join(output)
+
+
+class HCLReader(object):
+    def __init__(self, source):
+        self.source = strip_comments(source)
+        self.pos = 0
+
+
+    def skip_space(self):
+        while self.pos < len(self.source) and self.source[self.pos] in ' \t\r\n,':
+            self.pos += 1
+
+
+    def peek(self):
+        self.skip_space()
+        return self.source[self.pos] if self.pos < len(self.source) else ''
+
+
+    def read_identifier(self):
+        self.skip_space()
+        start = self.pos
+        while self.pos < len(self.source) and (self.source[self.pos].isalnum() or self.source[self.pos] in '_-.'):
+            self.pos += 1
+        if start == self.pos:
+            raise TerraformParseError('expected an identifier at offset %d.' % start)
+        return self.source[start:self.pos]
+
+
+    def read_string(self):
+        self.skip_space()
+        self.pos += 1
+        start = self.pos
+        interpolation_depth = 0
+        while self.pos < len(self.source):
+            c = self.source[self.pos]
+            if c == '\\':
+                self.pos += 2
+                continue
+            if self.source.startswith('${', self.pos):
+                interpolation_depth += 1
+                self.pos += 2
+                continue
+            if c == '}' and interpolation_depth:
+                interpolation_depth -= 1
+            elif c == '"' and not interpolation_depth:
+                self.pos += 1
+                return self.source[start:self.pos - 1]
+            self.pos += 1
+        raise TerraformParseError('unterminated string starting at offset %d.' % start)
+
+
+    def read_bracketed(self, open_char, close_char):
+        start = self.pos
+        depth = 0
+        while self.pos < len(self.source):
+            c = self.source[self.pos]
+            if c == '"':
+                self.read_string()
+                continue
+            if c == open_char:
+                depth += 1
+            elif c == close_char:
+                depth -= 1
+                if not depth:
+                    self.pos += 1
+                    return self.source[start:self.pos]
+            self.pos += 1
+        raise TerraformParseError('unbalanced "%s" starting at offset %d.' % (open_char, start))
+
+
+    def read_value(self):
+        c = self.peek()
+        if c == '"':
+            return self.read_string()
+        if c == '{':
+            return self.read_body()
+        if c == '[':
+            return self.read_bracketed('[', ']')
+        if self.source.startswith('<<', self.pos):
+            _, self.pos, body = heredoc_end(self.source, self.pos)
+            return body
+        start = self.pos
+        while self.pos < len(self.source) and self.source[self.pos] not in '\n,}':
+            self.pos += 1
+        return self.source[start:self.pos].strip()
+
+
+    def read_body(self):
+        '''Reads a {...} block into a dict. Repeated nested blocks of the same type
+        are collected into a list.
+        '''
+
+        self.skip_space()
+        self.pos += 1
+        body = {}
+        while True:
+            c = self.peek()
+            if not c:
+                raise TerraformParseError('unterminated block.')
+            if c == '}':
+                self.pos += 1
+                return body
+            key = self.read_string() if c == '"' else self.read_identifier()
+            if self.peek() == '=':
+                self.pos += 1
+                body[key] = self.read_value()
+            else:
+                while self.peek() == '"':
+                    self.read_string()
+                block = self.read_body()
+                if key in body:
+                    existing = body[key]
+                    body[key] = (existing if isinstance(existing, list) else [existing]) + [block]
+                else:
+                    body[key] = block
+
+
+    def read_blocks(self):
+        blocks = []
+        while self.peek():
+            block_type = self.read_identifier()
+            labels = []
+            while self.peek() == '"':
+                labels.append(self.read_string())
+            if self.peek() != '{':
+                raise TerraformParseError('expected "{" after %s block header.' % block_type)
+            blocks.append(TerraformBlock(block_type, labels, self.read_body()))
+        return blocks
+
+
+
+def parse_tf(source):
+    return HCLReader(source).read_blocks()
+
+
+def parse_tf_dir(directory='.'):
+    '''Parses every .tf file in <directory>, in name order.'''
+
+    blocks = []
+    for filename in sorted(glob.glob(os.path.join(directory, '*.tf'))):
+        with open(filename, 'r') as f:
+            blocks.extend(parse_tf(f.read()))
+    return blocks
+
+
+def variable_defaults(blocks):
+    return {b.labels[0]: b.body.get('default') for b in blocks if b.block_type == 'variable'}
+
+
+def resources_of_type(blocks, resource_type):
+    return {b.labels[1]: b.body for b in blocks
+            if b.block_type == 'resource' and b.labels[0] == resource_type}
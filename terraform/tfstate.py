@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+'''Reader for Terraform state and "terraform output -json" files.
+
+Both the version 3 state layout (modules with flat "type.name.index" resource keys
+and dotted attributes) and the version 4 layout (resources with an instances list)
+are understood. Only managed resources and their primary instance are read.
+'''
+
+
+import json
+from collections import namedtuple
+
+
+class TerraformStateError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+InstanceRecord = namedtuple('InstanceRecord', 'resource_type name index private_ip public_ip tags')
+
+
+def load_json(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError) as err:
+        raise TerraformStateError('cannot read Terraform JSON from %s: %s' % (filename, err))
+
+
+def is_state(data):
+    return isinstance(data, dict) and 'version' in data and ('modules' in data or 'resources' in data)
+
+
+def v3_tags(attributes):
+    return {key[len('tags.'):]: value for key, value in attributes.items()
+            if key.startswith('tags.') and key != 'tags.%'}
+
+
+def v3_instances(state):
+    for module in state.get('modules', []):
+        for key, resource in module.get('resources', {}).items():
+            if key.startswith('data.'):
+                continue
+            parts = key.split('.')
+            index = int(parts[2]) if len(parts) > 2 else 0
+            attributes = resource.get('primary', {}).get('attributes', {})
+            yield InstanceRecord(parts[0], parts[1], index,
+                                 attributes.get('private_ip'),
+                                 attributes.get('public_ip'),
+                                 v3_tags(attributes))
+
+
+def v4_instances(state):
+    for resource in state.get('resources', []):
+        if resource.get('mode', 'managed') != 'managed':
+            continue
+        for position, instance in enumerate(resource.get('instances', [])):
+            attributes = instance.get('attributes', {})
+            index = instance.get('index_key', position)
+            yield InstanceRecord(resource['type'], resource['name'],
+                                 index if isinstance(index, int) else position,
+                                 attributes.get('private_ip'),
+                                 attributes.get('public_ip'),
+                                 attributes.get('tags') or {})
+
+
+def state_instances(state):
+    if not is_state(state):
+        raise TerraformStateError('not a Terraform state file.')
+    if int(state['version']) >= 4:
+        return list(v4_instances(state))
+    return list(v3_instances(state))
+
+
+def instances_of(state, resource_type, name):
+    '''Returns the instances of resource <resource_type>.<name>, ordered by count index.'''
+
+    return sorted([i for i in state_instances(state) if i.resource_type == resource_type and i.name == name],
+                  key=lambda i: i.index)
+
+
+def output_values(data):
+    '''Returns {name: value} from either a state file or "terraform output -json".'''
+
+    if is_state(data):
+        if int(data['version']) >= 4:
+            outputs = data.get('outputs', {})
+        else:
+            outputs = {}
+            for module in data.get('modules', []):
+                if module.get('path') == ['root']:
+                    outputs.update(module.get('outputs', {}))
+    else:
+        outputs = data
+    return {name: output.get('value') for name, output in outputs.items()}
+
+
+def private_ips(data, resource_type, name, output_name=None):
+    '''The private IPs of <resource_type>.<name> in count-index order. When given
+    "terraform output -json" data, the list output <output_name> is used instead.
+    '''
+
+    if is_state(data):
+        return [i.private_ip for i in instances_of(data, resource_type, name) if i.private_ip]
+
+    value = output_values(data).get(output_name)
+    if value is None:
+        raise TerraformStateError('Terraform output "%s" not found.' % output_name)
+    return [value] if isinstance(value, str) else list(value)